@@ -0,0 +1,42 @@
+"""
+Benchmark the latency of `InPlace.close()` with a backup, comparing
+``backup_method="rename"`` and ``backup_method="link"``
+
+Usage: python benchmarks/backup_commit.py [ITERATIONS]
+"""
+
+from __future__ import annotations
+from pathlib import Path
+import statistics
+import sys
+import tempfile
+import time
+from in_place import InPlace
+
+
+def bench(dirpath: Path, method: str, iterations: int) -> list[float]:
+    p = dirpath / f"{method}.txt"
+    p.write_text("x" * 1024)
+    timings = []
+    for _ in range(iterations):
+        fp = InPlace(p, backup_ext="~", backup_method=method)  # type: ignore[call-overload]
+        fp.write(fp.read())
+        start = time.perf_counter()
+        fp.close()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main() -> None:
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for method in ("rename", "link"):
+            timings = bench(Path(tmpdir), method, iterations)
+            print(
+                f"{method:>6}: median {statistics.median(timings) * 1e6:8.1f} µs,"
+                f" p99 {statistics.quantiles(timings, n=100)[98] * 1e6:8.1f} µs"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Benchmark the per-file latency of editing small files with `edit_file()`'s
+small-file fast path, with `edit_file()` forced onto the `InPlace` path, and
+with `InPlace` directly
+
+Usage: python benchmarks/small_files.py [ITERATIONS [SIZE]]
+"""
+
+from __future__ import annotations
+from collections.abc import Callable
+from pathlib import Path
+import statistics
+import sys
+import tempfile
+import time
+from in_place import InPlace, edit_file
+
+
+def flip(s: str) -> str:
+    return s.swapcase()
+
+
+def with_inplace(p: Path) -> None:
+    with InPlace(p) as fp:
+        fp.write(flip(fp.read()))
+
+
+def fast_path(p: Path) -> None:
+    edit_file(p, flip)
+
+
+def slow_path(p: Path) -> None:
+    edit_file(p, flip, small_file_limit=0)
+
+
+def bench(
+    dirpath: Path, func: Callable[[Path], None], iterations: int, size: int
+) -> list[float]:
+    p = dirpath / f"{func.__name__}.txt"
+    p.write_text("x" * size)
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func(p)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main() -> None:
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 1024
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for func in (with_inplace, slow_path, fast_path):
+            timings = bench(Path(tmpdir), func, iterations, size)
+            print(
+                f"{func.__name__:>12}: median"
+                f" {statistics.median(timings) * 1e6:8.1f} µs,"
+                f" p99 {statistics.quantiles(timings, n=100)[98] * 1e6:8.1f} µs"
+            )
+
+
+if __name__ == "__main__":
+    main()
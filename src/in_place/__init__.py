@@ -10,15 +10,37 @@ Visit <https://github.com/jwodder/inplace> for more information.
 """
 
 from __future__ import annotations
-from collections.abc import Iterable
+from array import array
+import codecs
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from contextlib import ExitStack, contextmanager, suppress
+from datetime import datetime, timezone
+import errno
+import hashlib
+import heapq
+import io
+from itertools import chain, islice
+import json
+import locale
+import mmap
 import os
 import os.path
+import queue
+import re
+import secrets
 import shutil
+import stat
+import sys
 import tempfile
+import threading
+import time
 from types import TracebackType
-from typing import IO, TYPE_CHECKING, Any, AnyStr, Literal, Union, overload
+from typing import IO, TYPE_CHECKING, Any, AnyStr, Literal, TypeVar, Union, overload
 
 if TYPE_CHECKING:
+    from concurrent.futures import Future, ThreadPoolExecutor
+    import csv
     from typing_extensions import Buffer
 
 __version__ = "1.1.0.dev1"
@@ -27,10 +49,32 @@ __author_email__ = "inplace@varonathe.org"
 __license__ = "MIT"
 __url__ = "https://github.com/jwodder/inplace"
 
-__all__ = ["InPlace"]
+__all__ = [
+    "ConflictError",
+    "DirCache",
+    "EditCache",
+    "InPlace",
+    "LineBatch",
+    "Transaction",
+    "apply_delta",
+    "edit_csv",
+    "edit_file",
+    "edit_json",
+    "edit_records",
+    "edit_toml",
+    "encode_delta",
+    "parallel_map_lines",
+    "dedupe_lines",
+    "retry_edit",
+    "sort_file",
+    "wait_for_backups",
+]
 
 AnyPath = Union[str, bytes, "os.PathLike[str]", "os.PathLike[bytes]"]
 
+T = TypeVar("T")
+U = TypeVar("U")
+
 
 class InPlace(IO[AnyStr]):
     """
@@ -52,7 +96,9 @@ class InPlace(IO[AnyStr]):
     :param backup: The path at which to save the file's original contents once
         editing has finished (resolved relative to the current directory at the
         time of the instance's creation); if `None` (the default), no backup is
-        saved.  Cannot be empty.
+        saved.  Cannot be empty.  If the path is on a different filesystem,
+        the original contents are copied there in a background thread after
+        the file is replaced; see `wait_for_backups()`.
     :type backup: path-like
 
     :param backup_ext: A string to append to ``name`` to get the path at which
@@ -60,7 +106,155 @@ class InPlace(IO[AnyStr]):
         ``backup_ext`` are mutually exclusive.
     :type backup_ext: path-like
 
-    :param kwargs: Additional keyword arguments to pass to `open()`
+    :param bool backup_numbered: If true, save the file's original contents
+        in a numbered backup, like GNU ``--backup=numbered``: the backup path
+        is the file's path plus ``.~N~``, where ``N`` is one more than the
+        number of the previous backup.  The next number is tracked in a hidden
+        ``.NAME.~next~`` file beside the file being edited, so that the
+        directory only needs to be scanned for existing backups the first
+        time.  Mutually exclusive with ``backup``, ``backup_ext``, and
+        ``backup_store``.
+
+    :param int backup_rotate: If set, make numbered backups as with
+        ``backup_numbered``, keeping only the ``backup_rotate`` most recent
+        ones.  Each edit deletes only the single backup that falls out of the
+        retention window, so the cost per edit does not depend on the number
+        of backups kept.
+
+    :param string backup_method: How the backup (if any) is created when
+        editing has finished.  If ``"rename"`` (the default), the original file
+        is renamed to the backup path and the edited file is then renamed into
+        place, leaving a brief window during which the file's path does not
+        exist.  If ``"link"``, the backup is instead created as a hard link to
+        the original (or, if hard links are not supported, as a copy), and the
+        edited file then atomically replaces the original, so that the file's
+        path always exists.
+
+    :param backup_store: The path to a directory in which to save the file's
+        original contents once editing has finished, as a content-addressed
+        store: the original is stored under its SHA-256 digest (computed as
+        the input is read), so that identical originals are only stored once,
+        and an entry recording the file's path, the time, and the digest is
+        appended to a ``manifest.jsonl`` file in the directory.  The directory
+        is created if it does not exist.  Mutually exclusive with ``backup``
+        and ``backup_ext``.
+    :type backup_store: path-like
+
+    :param dir_cache: A `DirCache` to use for resolving the paths of the
+        file's directory & the backup's directory and for holding those
+        directories open.  When given (on platforms that support it), all
+        operations on the temporary file, the input file, the backup, and the
+        lock, counter, and checkpoint files beside them are performed relative
+        to directory file descriptors instead of by full path.  The exceptions
+        are a ``backup_store``, which is always accessed by path, and the final
+        replacement of the files when committing a `Transaction`.  A single
+        `DirCache` can be shared by many `InPlace` instances.
+    :type dir_cache: DirCache
+
+    :param bool detect_conflicts: If true, the identity of the input file
+        (device, inode, size, and modification time) is recorded when it is
+        opened, and if it has changed by the time the instance is closed
+        (i.e., if something else modified or replaced the file in the
+        meantime), the output is discarded and a `ConflictError` is raised
+        instead of overwriting the other changes.
+
+    :param string lock: Whether to hold an advisory lock while editing:
+        ``"none"`` (the default) for no locking, ``"shared"`` for a shared
+        lock, or ``"exclusive"`` for an exclusive lock.  The lock is taken
+        with `fcntl.flock()` on a sidecar lock file (the path of the file being
+        edited plus ``.lock``), which is created if it does not exist and is
+        left in place afterwards, so that the lock is unaffected by the file
+        being replaced.  The lock is acquired before the file is opened and
+        released once the instance is closed or rolled back.  The number of
+        seconds spent waiting for the lock is stored in the `lock_wait`
+        attribute.  Locking is only supported on platforms with `fcntl`;
+        elsewhere, passing any value other than ``"none"`` raises a
+        `ValueError`.
+
+    :param lock_timeout: The maximum number of seconds to wait for the lock;
+        if `None` (the default), wait indefinitely.  If the lock cannot be
+        acquired in time, a `TimeoutError` is raised.
+    :type lock_timeout: float
+
+    :param bool dry_run: If true, closing the instance compares the output to
+        the input (recording the numbers of changed lines in the
+        `lines_removed` and `lines_added` attributes and writing a diff to
+        ``diff``, if set) and then discards the output as with
+        :meth:`rollback`, leaving the file, its backups, and any enclosing
+        `Transaction` untouched.
+
+    :param diff: If set, write a unified diff of the input against the output
+        to the given stream when the instance is closed (before the file is
+        replaced, unless ``dry_run`` is also true).  The stream must accept
+        `str` in text mode and `bytes` in binary mode; if ``diff`` is `True`,
+        the diff is written to `sys.stdout` (or its underlying binary buffer
+        in binary mode).  The line counts are also recorded as for
+        ``dry_run``.  The two files are compared by streaming through them in
+        windows of a bounded number of lines, so neither is held fully in
+        memory; as a result, a change spanning more lines than the window may
+        be reported less compactly than by a full diff.
+    :type diff: bool or file-like
+
+    :param string checksum: The name of a `hashlib` algorithm (e.g.,
+        ``"sha256"`` or ``"blake2b"``) with which to hash the output as it is
+        written (after encoding, in text mode).  The hex digest is stored in
+        the `output_digest` attribute when the instance is closed.  Output
+        copied directly between file descriptors (e.g., by :meth:`copy_lines`)
+        is read back from the page cache and hashed before the next write.
+
+    :param bool checksum_input: If true, also hash the input with the
+        ``checksum`` algorithm as it is read, storing the hex digest in the
+        `input_digest` attribute when the instance is closed; any input that
+        was skipped over rather than read is hashed at that point.  Requires
+        ``checksum``.  When combined with ``backup_store`` (which always hashes
+        the input with SHA-256), ``checksum`` must be ``"sha256"``.
+
+    :param bool sparse: If true (binary mode only), preserve holes in sparse
+        files: whole filesystem blocks of zero bytes written to the output are
+        skipped over with a seek instead of being written, and input copied
+        directly to the output (e.g., by :meth:`copy_lines`) is copied one
+        data region at a time, as found with ``SEEK_DATA`` & ``SEEK_HOLE``,
+        skipping over holes.  The edited file is thus left with holes wherever
+        the original had them (and wherever else whole blocks of zeros were
+        written).
+
+    :param tee: An iterable of additional sinks to which to send a copy of
+        everything written to the output (as encoded bytes, in text mode),
+        including data copied directly between file descriptors.  Each sink
+        is either a binary file-like object, whose ``write()`` method is
+        called with each chunk of data, or a callable, which is called with
+        each chunk.  Each sink is fed by its own thread from a queue of at
+        most `TEE_QUEUE_SIZE` chunks; once a sink's queue is full, writes
+        block until it catches up.  When the instance is closed, it waits for
+        all sinks to receive everything before the file is replaced; if any
+        sink raised an error, the edit is rolled back and the error is
+        re-raised.  Once the edit has been committed or rolled back, each
+        sink's ``flush()`` method is called (if it has one), followed by its
+        ``commit()`` or ``rollback()`` method, respectively (if it has one).
+    :type tee: iterable of file-like objects or callables
+
+    :param bool resume: If true, make the edit resumable: the temporary file is
+        given a deterministic name (``._in_place-resume-NAME`` in the same
+        directory as the file), :meth:`checkpoint` can be called to record a
+        point from which to resume in a ``._in_place-resume-NAME.json`` file
+        beside it, and exiting the context manager because of an exception
+        leaves both files in place instead of rolling back.  If a checkpoint
+        from such an interrupted edit exists when an instance is created with
+        ``resume=True`` and the file has not changed since, the edit is
+        resumed: the output is truncated to its length at the checkpoint, the
+        input is positioned where it was at the checkpoint, `resumed` is set
+        to `True`, and the state token passed to :meth:`checkpoint` is stored
+        in `resume_state`.  Otherwise, the edit starts from scratch.  The
+        checkpoint is deleted once the edit is committed or explicitly rolled
+        back.  Cannot be combined with ``dry_run``.  As the temporary file's
+        name is fixed, two resumable edits of the same file at once would
+        write to the same temporary file; use ``lock="exclusive"`` if that
+        could happen.
+
+    :param kwargs: Additional keyword arguments to pass to `open()`.  In text
+        mode, ``newline`` may additionally be set to ``"preserve"``, which is
+        equivalent to ``newline=""``: lines are read with their original line
+        endings, and written text is not translated.
     """
 
     @overload
@@ -70,6 +264,21 @@ class InPlace(IO[AnyStr]):
         mode: Literal["t", None] = None,
         backup: AnyPath | None = None,
         backup_ext: AnyPath | None = None,
+        backup_numbered: bool = False,
+        backup_rotate: int | None = None,
+        backup_method: Literal["rename", "link"] = "rename",
+        backup_store: AnyPath | None = None,
+        dir_cache: DirCache | None = None,
+        detect_conflicts: bool = False,
+        lock: Literal["none", "shared", "exclusive"] = "none",
+        lock_timeout: float | None = None,
+        dry_run: bool = False,
+        diff: bool | IO[Any] = False,
+        checksum: str | None = None,
+        checksum_input: bool = False,
+        sparse: bool = False,
+        tee: Iterable[Any] | None = None,
+        resume: bool = False,
         **kwargs: Any,
     ) -> None: ...
 
@@ -80,6 +289,21 @@ class InPlace(IO[AnyStr]):
         mode: Literal["b"],
         backup: AnyPath | None = None,
         backup_ext: AnyPath | None = None,
+        backup_numbered: bool = False,
+        backup_rotate: int | None = None,
+        backup_method: Literal["rename", "link"] = "rename",
+        backup_store: AnyPath | None = None,
+        dir_cache: DirCache | None = None,
+        detect_conflicts: bool = False,
+        lock: Literal["none", "shared", "exclusive"] = "none",
+        lock_timeout: float | None = None,
+        dry_run: bool = False,
+        diff: bool | IO[Any] = False,
+        checksum: str | None = None,
+        checksum_input: bool = False,
+        sparse: bool = False,
+        tee: Iterable[Any] | None = None,
+        resume: bool = False,
         **kwargs: Any,
     ) -> None: ...
 
@@ -89,6 +313,21 @@ class InPlace(IO[AnyStr]):
         mode: Literal["t", "b", None] = None,
         backup: AnyPath | None = None,
         backup_ext: AnyPath | None = None,
+        backup_numbered: bool = False,
+        backup_rotate: int | None = None,
+        backup_method: Literal["rename", "link"] = "rename",
+        backup_store: AnyPath | None = None,
+        dir_cache: DirCache | None = None,
+        detect_conflicts: bool = False,
+        lock: Literal["none", "shared", "exclusive"] = "none",
+        lock_timeout: float | None = None,
+        dry_run: bool = False,
+        diff: bool | IO[Any] = False,
+        checksum: str | None = None,
+        checksum_input: bool = False,
+        sparse: bool = False,
+        tee: Iterable[Any] | None = None,
+        resume: bool = False,
         **kwargs: Any,
     ) -> None:
         cwd = os.getcwd()
@@ -96,10 +335,25 @@ class InPlace(IO[AnyStr]):
         self._name = os.fsdecode(name)
         #: The absolute path of the file to edit in-place, with symbolic links
         #: resolved
-        self._path = os.path.realpath(os.path.join(cwd, self._name))
+        self._path: str
+        #: A file descriptor for the directory containing ``path``, if
+        #: operating relative to directory file descriptors
+        self._dirfd: int | None
+        if dir_cache is not None:
+            self._path, self._dirfd = dir_cache.resolve(os.path.join(cwd, self._name))
+        else:
+            self._path = os.path.realpath(os.path.join(cwd, self._name))
+            self._dirfd = None
         #: The absolute path of the backup file (if any) that the original
         #: contents of ``path`` will be moved to after editing
         self._backuppath: str | None
+        #: A file descriptor for the directory containing ``backuppath``, if
+        #: operating relative to directory file descriptors
+        self._backup_dirfd: int | None = None
+        #: A duplicate of the input's file descriptor, taken on closing when
+        #: making a backup, from which the original contents can be copied to
+        #: ``backuppath`` if it is on another filesystem
+        self._backup_srcfd: int | None = None
         if backup is not None:
             if backup_ext is not None:
                 raise ValueError("backup and backup_ext are mutually exclusive")
@@ -107,45 +361,239 @@ class InPlace(IO[AnyStr]):
             if not b:
                 raise ValueError("backup cannot be empty")
             self._backuppath = os.path.join(cwd, b)
+            if dir_cache is not None:
+                bdir, bbase = os.path.split(self._backuppath)
+                bdir, self._backup_dirfd = dir_cache.resolve_dir(bdir)
+                self._backuppath = os.path.join(bdir, bbase)
         elif backup_ext is not None:
             be = os.fsdecode(backup_ext)
             if not be:
                 raise ValueError("backup_ext cannot be empty")
             self._backuppath = self._path + be
+            self._backup_dirfd = self._dirfd
         else:
             self._backuppath = None
+        #: Whether to make numbered backups
+        self._backup_numbered = backup_numbered or backup_rotate is not None
+        #: The maximum number of numbered backups to keep, if limited
+        self._backup_rotate = backup_rotate
+        #: The number of the numbered backup being made, assigned at commit
+        self._backup_number = 0
+        #: The numbers of the existing numbered backups, if they were found by
+        #: scanning the directory when assigning ``_backup_number``
+        self._scanned_backups: list[int] = []
+        if self._backup_numbered:
+            if self._backuppath is not None or backup_store is not None:
+                raise ValueError(
+                    "Numbered backups are mutually exclusive with backup,"
+                    " backup_ext, and backup_store"
+                )
+            if backup_rotate is not None and backup_rotate <= 0:
+                raise ValueError("backup_rotate must be positive")
+            self._backup_dirfd = self._dirfd
+        if backup_method not in ("rename", "link"):
+            raise ValueError(f"{backup_method!r}: invalid backup method")
+        #: Whether to create the backup by hard-linking (or copying) instead of
+        #: renaming
+        self._link_backup = backup_method == "link"
+        #: The absolute path to the content-addressed backup store, if any
+        self._backup_store: str | None = None
+        if backup_store is not None:
+            if self._backuppath is not None:
+                raise ValueError(
+                    "backup_store is mutually exclusive with backup and backup_ext"
+                )
+            bs = os.fsdecode(backup_store)
+            if not bs:
+                raise ValueError("backup_store cannot be empty")
+            self._backup_store = os.path.join(cwd, bs)
+        if sparse and mode != "b":
+            raise ValueError("sparse is only supported in binary mode")
+        #: Whether to preserve holes in sparse files
+        self._sparse = sparse
+        #: The name of the hash algorithm for checksums, if any
+        self._checksum = checksum
+        if checksum is not None:
+            if hashlib.new(checksum).digest_size == 0:
+                raise ValueError(
+                    f"{checksum!r}: variable-length digests are not supported"
+                )
+        if checksum_input:
+            if checksum is None:
+                raise ValueError("checksum_input requires checksum")
+            if backup_store is not None and hashlib.new(checksum).name != "sha256":
+                raise ValueError(
+                    "checksum_input with backup_store requires checksum='sha256'"
+                )
+        #: The reader that hashes the input as it is read, if hashing the
+        #: input
+        self._input_hasher: HashingReader | None = None
+        #: The hex digest of the input's contents, computed on closing if
+        #: hashing the input (because ``checksum_input`` or ``backup_store``
+        #: was set)
+        self.input_digest: str | None = None
+        #: The writer that hashes the output as it is written, if computing a
+        #: checksum
+        self._output_hasher: HashingWriter | None = None
+        #: The hex digest of the output's contents, computed on closing if
+        #: ``checksum`` was set
+        self.output_digest: str | None = None
+        #: The sinks to which the output is copied, if any
+        self._tee: Tee | None = Tee(tee) if tee is not None else None
+        #: The writer that feeds the output to ``_tee``, if teeing
+        self._tee_writer: HashingWriter | None = None
+        if resume and dry_run:
+            raise ValueError("resume and dry_run are mutually exclusive")
+        #: The path to the checkpoint file, if the edit is resumable
+        self._checkpoint_path: str | None = None
+        #: Whether a checkpoint for the current output exists
+        self._has_checkpoint = False
+        #: The identity of the input file when opened, as recorded in
+        #: checkpoints
+        self._input_stamp = ""
+        #: Whether the edit was resumed from a checkpoint
+        self.resumed = False
+        #: The state token recorded by the checkpoint that the edit was
+        #: resumed from, if any
+        self.resume_state: Any = None
         if mode not in (None, "t", "b"):
             raise ValueError(f"{mode!r}: invalid mode")
+        #: `True` iff the file is opened in binary mode
+        self._binary = mode == "b"
+        if kwargs.get("newline") == "preserve":
+            kwargs["newline"] = ""
+        #: The ``newline`` argument with which the file was opened
+        self._newline: str | None = kwargs.get("newline")
+        #: The line index of the input file, built on first use by
+        #: :meth:`line_offsets`
+        self._line_offsets: array[int] | None = None
         #: `True` iff the filehandle is closed
         self._closed = False
-        #: The absolute path to the temporary file
-        self._tmppath = self._mktemp(self._path)
-        try:
-            #: The output filehandle to which data is written
-            self.output: IO[AnyStr]
-            if mode is None or mode == "t":
-                self.output = open(self._tmppath, "w", **kwargs)
-            else:
-                self.output = open(self._tmppath, "wb", **kwargs)
-        except Exception:
-            try_unlink(self._tmppath)
-            raise
-        try:
-            copystats(self._path, self._tmppath)
-        except Exception:
-            self.output.close()
-            try_unlink(self._tmppath)
-            raise
+        #: The `Transaction` that will commit this instance's changes, if any
+        self._transaction: Transaction | None = None
+        #: Whether to discard the output after comparing it to the input
+        self._dry_run = dry_run
+        #: The stream to which to write a diff of the input against the output
+        self._diff_out: IO[Any] | None
+        if diff is True:
+            self._diff_out = sys.stdout.buffer if self._binary else sys.stdout
+        elif diff is False:
+            self._diff_out = None
+        else:
+            self._diff_out = diff
+        #: The number of input lines removed or replaced in the output, once
+        #: computed for a dry run or diff
+        self.lines_removed = 0
+        #: The number of lines added to or replaced in the output, once
+        #: computed for a dry run or diff
+        self.lines_added = 0
+        if lock not in ("none", "shared", "exclusive"):
+            raise ValueError(f"{lock!r}: invalid lock mode")
+        if lock != "none":
+            try:
+                import fcntl  # noqa: F401
+            except ImportError:
+                raise ValueError(
+                    "File locking is not supported on this platform"
+                ) from None
+        #: The number of seconds spent waiting to acquire the lock
+        self.lock_wait = 0.0
+        #: The file descriptor of the lock file, if locked
+        self._lockfd: int | None = None
+        if lock != "none":
+            self._lockfd, self.lock_wait = acquire_lock(
+                self._path + ".lock", self._dirfd, lock == "exclusive", lock_timeout
+            )
         try:
-            #: The input filehandle from which data is read
-            self.input: IO[AnyStr]
-            if mode is None or mode == "t":
-                self.input = open(self._path, "r", **kwargs)
+            #: The absolute path to the temporary file
+            if resume:
+                self._tmppath, self._checkpoint_path = resume_paths(self._path)
+                os.close(
+                    os.open(
+                        (
+                            self._tmppath
+                            if self._dirfd is None
+                            else os.path.basename(self._tmppath)
+                        ),
+                        os.O_RDWR | os.O_CREAT | getattr(os, "O_CLOEXEC", 0),
+                        0o600,
+                        dir_fd=self._dirfd,
+                    )
+                )
             else:
-                self.input = open(self._path, "rb", **kwargs)
-        except Exception:
-            self.output.close()
-            try_unlink(self._tmppath)
+                self._tmppath = self._mktemp(self._path)
+            try:
+                #: The output filehandle to which data is written
+                self.output: IO[AnyStr]
+                if checksum is not None or sparse or self._tee is not None:
+                    self.output = self._open_layered(
+                        self._tmppath,
+                        "w",
+                        kwargs,
+                        hasher=hashlib.new(checksum) if checksum is not None else None,
+                        sparse=sparse,
+                        tee=self._tee,
+                    )
+                elif mode is None or mode == "t":
+                    self.output = self._open(
+                        self._tmppath, "r+" if resume else "w", kwargs
+                    )
+                else:
+                    self.output = self._open(
+                        self._tmppath, "r+b" if resume else "wb", kwargs
+                    )
+            except Exception:
+                self._discard_tmp()
+                raise
+            if self._dirfd is None:
+                try:
+                    copystats(self._path, self._tmppath)
+                except Exception:
+                    self.output.close()
+                    self._discard_tmp()
+                    raise
+            try:
+                #: The input filehandle from which data is read
+                self.input: IO[AnyStr]
+                if checksum_input:
+                    assert checksum is not None
+                    self.input = self._open_layered(
+                        self._path, "r", kwargs, hasher=hashlib.new(checksum)
+                    )
+                elif self._backup_store is not None:
+                    self.input = self._open_layered(
+                        self._path, "r", kwargs, hasher=hashlib.sha256()
+                    )
+                elif mode is None or mode == "t":
+                    self.input = self._open(self._path, "r", kwargs)
+                else:
+                    self.input = self._open(self._path, "rb", kwargs)
+            except Exception:
+                self.output.close()
+                self._discard_tmp()
+                raise
+            if self._dirfd is not None:
+                try:
+                    copystats_fd(self.input.fileno(), self.output.fileno())
+                except Exception:
+                    self.input.close()
+                    self.output.close()
+                    self._discard_tmp()
+                    raise
+            if resume:
+                try:
+                    self._resume()
+                except Exception:
+                    self.input.close()
+                    self.output.close()
+                    raise
+            #: The identity of the input file when opened, if checking for
+            #: conflicts
+            self._input_id: tuple[int, int, int, int] | None = None
+            if detect_conflicts:
+                self._input_id = file_id(os.fstat(self.input.fileno()))
+        except BaseException:
+            self._release_lock()
             raise
 
     def __enter__(self) -> InPlace[AnyStr]:
@@ -158,28 +606,298 @@ class InPlace(IO[AnyStr]):
         _exc_tb: TracebackType | None,
     ) -> None:
         if not self.closed:
-            if exc_type is not None:
-                self.rollback()
-            else:
+            if exc_type is None:
                 self.close()
+            elif self._checkpoint_path is not None:
+                self._suspend()
+            else:
+                self.rollback()
+
+    def _resume(self) -> None:
+        """
+        If there is a valid checkpoint for the input file, truncate the output
+        to its length at the checkpoint and seek the input to its position at
+        the checkpoint; otherwise, empty the output and delete any checkpoint
+        """
+        assert self._checkpoint_path is not None
+        self._input_stamp = file_stamp(os.fstat(self.input.fileno()))
+        ckpt = read_checkpoint(self._checkpoint_path, self._dirfd)
+        fd = self.output.fileno()
+        if (
+            ckpt is not None
+            and ckpt["input"] == self._input_stamp
+            and ckpt["output_length"] <= os.fstat(fd).st_size
+        ):
+            os.ftruncate(fd, ckpt["output_length"])
+            self.output.seek(0, os.SEEK_END)
+            self.input.seek(ckpt["input_offset"])
+            self.resumed = True
+            self.resume_state = ckpt["state"]
+            self._has_checkpoint = True
+        else:
+            os.ftruncate(fd, 0)
+            try_unlink(self._checkpoint_path, self._dirfd)
+
+    def _discard_tmp(self) -> None:
+        """
+        Delete the temporary file after failing to open the instance, unless
+        the edit is resumable, in which case the temporary file (which may hold
+        the progress recorded by a checkpoint) is kept
+        """
+        if self._checkpoint_path is None:
+            try_unlink(self._tmppath, self._dirfd)
 
     def _mktemp(self, filepath: str) -> str:
         """
         Create an empty temporary file in the same directory as ``filepath``
         and return the path to the new file
         """
-        fd, tmppath = tempfile.mkstemp(
-            dir=os.path.dirname(filepath),
-            prefix="._in_place-",
-        )
+        if self._dirfd is not None:
+            # Rely on O_EXCL to detect collisions rather than checking for
+            # existing files by full path.
+            while True:
+                basename = random_basename()
+                try:
+                    fd = os.open(
+                        basename,
+                        os.O_RDWR | os.O_CREAT | os.O_EXCL,
+                        0o600,
+                        dir_fd=self._dirfd,
+                    )
+                except FileExistsError:
+                    continue
+                break
+            tmppath = os.path.join(os.path.dirname(filepath), basename)
+        else:
+            fd, tmppath = tempfile.mkstemp(
+                dir=os.path.dirname(filepath),
+                prefix="._in_place-",
+            )
         os.close(fd)
         return tmppath
 
-    def _close(self) -> None:
-        """Close filehandles and set them to `None`"""
+    def _open(self, path: str, mode: str, kwargs: dict[str, Any]) -> IO[Any]:
+        """
+        Open ``path`` with `open()`, relative to the directory file descriptor
+        if there is one
+        """
+        if self._dirfd is not None:
+            dirfd = self._dirfd
+
+            def opener(p: str, flags: int) -> int:
+                return os.open(p, flags, dir_fd=dirfd)
+
+            return open(os.path.basename(path), mode, opener=opener, **kwargs)
+        else:
+            return open(path, mode, **kwargs)
+
+    def _open_layered(
+        self,
+        path: str,
+        mode: str,
+        kwargs: dict[str, Any],
+        hasher: Any = None,
+        sparse: bool = False,
+        tee: Tee | None = None,
+    ) -> IO[Any]:
+        """
+        Open ``path`` for reading (if ``mode`` is ``"r"``) or writing (if
+        ``mode`` is ``"w"``) like `open()` would, but with extra layers
+        inserted above the raw stream: a `SparseWriter` if ``sparse`` is true
+        and a `HashingWriter` feeding the output to ``tee`` if that is not
+        `None` (writing only), and a `HashingReader` or `HashingWriter`
+        feeding the file's contents to ``hasher`` as they are read or written
+        if ``hasher`` is not `None`
+        """
+        kwargs = dict(kwargs)
+        buffering = kwargs.pop("buffering", -1)
+        encoding = kwargs.pop("encoding", None)
+        errors = kwargs.pop("errors", None)
+        newline = kwargs.pop("newline", None)
+        if not self._binary and buffering == 0:
+            raise ValueError("can't have unbuffered text I/O")
+        # The output is opened for reading as well so that data copied into it
+        # by other means can be read back and hashed.
+        if mode == "r":
+            rawmode = "rb"
+        elif self._checkpoint_path is not None:
+            rawmode = "r+b"
+        else:
+            rawmode = "w+b"
+        raw: Any = self._open(path, rawmode, {"buffering": 0, **kwargs})
+        if sparse:
+            raw = SparseWriter(raw)
+        if tee is not None:
+            raw = self._tee_writer = HashingWriter(raw, tee)
+        if hasher is not None:
+            if mode == "r":
+                raw = self._input_hasher = HashingReader(raw, hasher)
+            else:
+                raw = self._output_hasher = HashingWriter(raw, hasher)
+        stream: IO[Any]
+        if buffering == 0:
+            stream = raw
+        elif mode == "r":
+            stream = io.BufferedReader(  # type: ignore[assignment]
+                raw, buffering if buffering > 1 else io.DEFAULT_BUFFER_SIZE
+            )
+        else:
+            stream = io.BufferedWriter(  # type: ignore[assignment]
+                raw, buffering if buffering > 1 else io.DEFAULT_BUFFER_SIZE
+            )
+        if not self._binary:
+            stream = io.TextIOWrapper(  # type: ignore[assignment,arg-type]
+                stream,
+                encoding=encoding,
+                errors=errors,
+                newline=newline,
+                line_buffering=buffering == 1,
+            )
+        return stream
+
+    def _finish_hash(self) -> None:
+        """
+        If hashing the input, hash any parts of the input that have not been
+        read yet and store the resulting digest; likewise, if hashing the
+        output, flush it, hash any parts not yet hashed, and store the digest
+        """
+        if self._input_hasher is not None and self.input_digest is None:
+            self.input_digest = self._input_hasher.finish()
+        if self._output_hasher is not None and self.output_digest is None:
+            self.output.flush()
+            self.output_digest = self._output_hasher.finish()
+
+    def _finish_tee(self) -> None:
+        """
+        If teeing the output, flush it, send any parts not yet sent to the
+        sinks, and wait for the sinks to receive everything
+        """
+        if self._tee is not None:
+            assert self._tee_writer is not None
+            self.output.flush()
+            self._tee_writer.catch_up()
+            self._tee.drain()
+
+    def _end_tee(self, committed: bool) -> None:
+        """
+        If teeing the output, tell the sinks whether the edit was committed or
+        rolled back
+        """
+        if self._tee is not None:
+            tee, self._tee = self._tee, None
+            tee.end(committed)
+
+    def _store_backup(self) -> None:
+        """
+        If using a backup store, save the original file in it (without removing
+        it from its current path)
+        """
+        if self._backup_store is not None:
+            assert self.input_digest is not None
+            store_blob(self._path, self._backup_store, self.input_digest, self._dirfd)
+
+    def _record_backup(self) -> None:
+        """
+        If using a backup store, add an entry for the edit to the store's
+        manifest
+        """
+        if self._backup_store is not None:
+            assert self.input_digest is not None
+            assert self._input_hasher is not None
+            record_blob(
+                self._backup_store,
+                self._path,
+                self.input_digest,
+                self._input_hasher.hashed,
+            )
+
+    def _assign_numbered_backup(self) -> None:
+        """
+        If making numbered backups, set the backup path to the next numbered
+        backup path
+        """
+        if self._backup_numbered:
+            self._backup_number, self._scanned_backups = next_backup_number(
+                self._path, self._dirfd
+            )
+            self._backuppath = f"{self._path}.~{self._backup_number}~"
+
+    def _advance_numbered_backup(self) -> None:
+        """
+        If making numbered backups, record the number of the next backup and,
+        if rotating, delete the backup that has fallen out of the retention
+        window (along with any older backups found when the directory was
+        scanned)
+        """
+        if self._backup_numbered:
+            n = self._backup_number
+            write_backup_counter(self._path, n + 1, self._dirfd)
+            if self._backup_rotate is not None and n > self._backup_rotate:
+                cutoff = n - self._backup_rotate
+                stale: list[int] = [i for i in self._scanned_backups if i < cutoff]
+                for k in [cutoff, *stale]:
+                    try_unlink(f"{self._path}.~{k}~", self._dirfd)
+
+    def _dup_backup_source(self) -> None:
+        """
+        If backing up to a fixed path, duplicate the input's file descriptor
+        before it is closed so that the original contents remain readable after
+        the file is replaced
+        """
+        if self._backuppath is not None and not self._link_backup:
+            self._backup_srcfd = os.dup(self.input.fileno())
+
+    def _copy_backup_later(self) -> None:
+        """
+        Start copying the original contents to the backup path in the
+        background, for when the backup path is on another filesystem
+        """
+        assert self._backup_srcfd is not None
+        assert self._backuppath is not None
+        fd, self._backup_srcfd = self._backup_srcfd, None
+        copy_backup_later(fd, self._backuppath)
+
+    def _remove_checkpoint(self) -> None:
+        """Delete the checkpoint file, if the edit is resumable"""
+        if self._checkpoint_path is not None:
+            try_unlink(self._checkpoint_path, self._dirfd)
+
+    def _suspend(self) -> None:
+        """
+        Close filehandles of a resumable edit, leaving the temporary file and
+        the checkpoint in place so that the edit can be resumed (unless no
+        checkpoint has been made, in which case the temporary file is
+        deleted)
+        """
+        self._close()
+        try:
+            if not self._has_checkpoint:
+                try_unlink(self._tmppath, self._dirfd)
+        finally:
+            self._release_lock()
+        if self._transaction is not None:
+            self._transaction._discard(self)
+        self._end_tee(False)
+
+    def _close_backup_source(self) -> None:
+        """Close the duplicate input file descriptor, if any"""
+        if self._backup_srcfd is not None:
+            fd, self._backup_srcfd = self._backup_srcfd, None
+            os.close(fd)
+
+    def _close(self, fsync: bool = False) -> None:
+        """
+        Close filehandles, first flushing the output to disk with `os.fsync()`
+        if ``fsync`` is true
+        """
         self._closed = True
         self.input.close()
-        self.output.close()
+        try:
+            if fsync:
+                self.output.flush()
+                os.fsync(self.output.fileno())
+        finally:
+            self.output.close()
 
     def close(self) -> None:
         """
@@ -187,28 +905,147 @@ class InPlace(IO[AnyStr]):
         If called after the filehandle has already been closed (with either
         this method or :meth:`rollback`), :meth:`close` does nothing.
 
+        If the instance belongs to a `Transaction`, the output is only staged
+        for commit, and the files are moved when the transaction is committed.
+
         :return: `None`
+        :raises ConflictError: if ``detect_conflicts`` is true and the input
+            file was changed by something else while being edited
         """
         if not self.closed:
+            try:
+                self._finish_hash()
+                self._finish_tee()
+            except BaseException:
+                self.rollback()
+                raise
+            if self._dry_run:
+                self._close()
+                try:
+                    self._diff()
+                finally:
+                    try:
+                        try_unlink(self._tmppath, self._dirfd)
+                    finally:
+                        self._release_lock()
+                    if self._transaction is not None:
+                        self._transaction._discard(self)
+                    self._end_tee(False)
+                return
+            if self._transaction is not None:
+                self._dup_backup_source()
+                self._close(fsync=self._transaction.fsync)
+                self._diff()
+                return
+            self._dup_backup_source()
             self._close()
             try:
-                if self._backuppath is not None:
-                    os.replace(self._path, self._backuppath)
-                os.replace(self._tmppath, self._path)
+                self._check_conflict()
+                self._diff()
+                self._store_backup()
+                self._assign_numbered_backup()
+                if self._backuppath is None:
+                    pass
+                elif self._link_backup:
+                    link_or_copy(
+                        self._path, self._backuppath, self._dirfd, self._backup_dirfd
+                    )
+                else:
+                    try:
+                        replace_at(
+                            self._path,
+                            self._backuppath,
+                            self._dirfd,
+                            self._backup_dirfd,
+                        )
+                    except OSError as e:
+                        if e.errno != errno.EXDEV:
+                            raise
+                        self._copy_backup_later()
+                replace_at(self._tmppath, self._path, self._dirfd, self._dirfd)
+                self._remove_checkpoint()
+                self._record_backup()
+                self._advance_numbered_backup()
+            except BaseException:
+                self._end_tee(False)
+                raise
             finally:
-                try_unlink(self._tmppath)
+                try_unlink(self._tmppath, self._dirfd)
+                self._close_backup_source()
+                self._release_lock()
+            self._end_tee(True)
+
+    def _diff(self) -> None:
+        """
+        If making a dry run or a diff, compare the closed input to the output,
+        recording the numbers of lines removed & added and writing a unified
+        diff to the diff stream (if any)
+        """
+        if not self._dry_run and self._diff_out is None:
+            return
+        kwargs: dict[str, Any]
+        if self._binary:
+            mode = "rb"
+            kwargs = {}
+        else:
+            assert isinstance(self.input, io.TextIOWrapper)
+            mode = "r"
+            kwargs = {
+                "encoding": self.input.encoding,
+                "errors": self.input.errors,
+                "newline": "",
+            }
+        with self._open(self._path, mode, kwargs) as a:
+            with self._open(self._tmppath, mode, kwargs) as b:
+                self.lines_removed, self.lines_added = write_unified_diff(
+                    diff_lines(a, b), self._diff_out, self.name, self._binary
+                )
+
+    def _release_lock(self) -> None:
+        """Release the lock on the file, if held"""
+        if self._lockfd is not None:
+            fd, self._lockfd = self._lockfd, None
+            os.close(fd)
+
+    def _check_conflict(self) -> None:
+        """
+        If checking for conflicts, raise a `ConflictError` if the file at the
+        input path is no longer the same as when the input was opened
+        """
+        if self._input_id is None:
+            return
+        try:
+            if self._dirfd is not None:
+                st = os.stat(os.path.basename(self._path), dir_fd=self._dirfd)
+            else:
+                st = os.stat(self._path)
+        except FileNotFoundError:
+            raise ConflictError(self._path) from None
+        if file_id(st) != self._input_id:
+            raise ConflictError(self._path)
 
     def rollback(self) -> None:
         """
         Close filehandles and remove/rename temporary files so that things look
-        like they did before the `InPlace` instance was opened
+        like they did before the `InPlace` instance was opened.
+
+        If the instance belongs to a `Transaction`, it is removed from the
+        transaction, and the file will be left untouched when the transaction
+        is committed.
 
         :return: `None`
         :raises ValueError: if called after the `InPlace` instance is closed
         """
         if not self.closed:
             self._close()
-            try_unlink(self._tmppath)
+            try:
+                try_unlink(self._tmppath, self._dirfd)
+                self._remove_checkpoint()
+            finally:
+                self._release_lock()
+            if self._transaction is not None:
+                self._transaction._discard(self)
+            self._end_tee(False)
         else:
             raise ValueError("Cannot rollback closed file")
 
@@ -250,10 +1087,260 @@ class InPlace(IO[AnyStr]):
     def writelines(self, seq: Iterable[AnyStr]) -> None:
         self.output.writelines(seq)
 
+    def map_lines(
+        self,
+        func: Callable[[AnyStr], AnyStr | None],
+        contains: AnyStr | None = None,
+    ) -> None:
+        """
+        Pass each remaining line of the input through ``func`` and write the
+        result to the output.  If ``func`` returns `None`, the line is written
+        out unchanged.  If ``contains`` is given, only lines containing it are
+        passed to ``func``; all other lines are written out unchanged.
+
+        In text mode, when the encoding is UTF-8 or another stateless
+        ASCII-compatible encoding and line endings are not translated (i.e.,
+        ``newline`` is ``""``, ``"\\n"``, or ``"preserve"``), lines that end
+        up unchanged are copied from input to output as raw bytes without
+        being re-encoded, and lines that do not contain ``contains`` are not
+        decoded at all (and so are not checked for decoding errors).
+        """
+        encoding = self._passthrough_encoding()
+        pos = self._raw_input_position() if encoding is not None else None
+        if encoding is None or pos is None:
+            for line in self.input:
+                self.output.write(map_line(func, contains, line))
+            return
+        assert isinstance(self.input, io.TextIOWrapper)
+        assert isinstance(self.output, io.TextIOWrapper)
+        errors = self.input.errors
+        needle = contains.encode(encoding) if isinstance(contains, str) else None
+        inbuf = self.input.buffer
+        outbuf = self.output.buffer
+        self.output.flush()
+        inbuf.seek(pos)
+        for raw in inbuf:
+            if needle is not None and needle not in raw:
+                outbuf.write(raw)
+                continue
+            if self._newline == "" and b"\r" in raw:
+                pieces = raw.splitlines(keepends=True)
+            else:
+                pieces = [raw]
+            for piece in pieces:
+                line = piece.decode(encoding, errors)
+                new = map_line(func, contains, line)
+                if new == line:
+                    outbuf.write(piece)
+                else:
+                    outbuf.write(new.encode(encoding, self.output.errors))
+        # Discard any data buffered by the input's decoder:
+        self.input.seek(0, os.SEEK_END)
+
+    def _raw_input_position(self) -> int | None:
+        """
+        Return the byte offset in the underlying binary input corresponding to
+        the current position of the text input, or `None` if it cannot be
+        determined
+        """
+        try:
+            pos = self.input.tell()
+        except OSError:
+            # Telling is disabled while the input is being iterated over.
+            return None
+        if pos >= 1 << 64:
+            # The decoder is in a state that can't be reproduced by seeking
+            # the underlying binary input.
+            return None
+        return pos
+
+    def _passthrough_encoding(self) -> str | None:
+        """
+        If the file is opened in text mode with an encoding for which data can
+        be copied unchanged from input to output as raw bytes, return the
+        normalized name of the encoding; otherwise, return `None`
+        """
+        if self._binary or self._newline not in ("", "\n"):
+            return None
+        if not isinstance(self.input, io.TextIOWrapper) or not isinstance(
+            self.output, io.TextIOWrapper
+        ):
+            return None
+        name = ascii_compatible(self.input.encoding)
+        if name is None or name != codecs.lookup(self.output.encoding).name:
+            return None
+        return name
+
+    def line_offsets(self: InPlace[bytes]) -> array[int]:
+        """
+        Return an index of the lines in the input file as an `array.array` of
+        byte offsets: element ``i`` is the offset at which line ``i``
+        (zero-based) begins, and the last element is the size of the file, so
+        the file has ``len(index) - 1`` lines.  Lines are terminated by
+        ``b"\\n"``, as when iterating over the input.
+
+        The index is built on first call with a single scan over a memory map
+        of the input file (using NumPy if it is installed) and is cached for
+        subsequent calls.  It is only available in binary mode.
+
+        :raises ValueError: if the file is opened in text mode
+        """
+        if not self._binary:
+            raise ValueError("Line index is only supported in binary mode")
+        if self._line_offsets is None:
+            self._line_offsets = index_lines(self.input.fileno())
+        return self._line_offsets
+
+    def copy_lines(self: InPlace[bytes], stop: int | None = None) -> None:
+        """
+        Copy the input from the current read position up to (but not including)
+        line ``stop`` (a zero-based index into the input file) to the output
+        unchanged, without reading the data into Python.  If ``stop`` is
+        `None`, copy the rest of the input.  Afterwards, reading resumes at the
+        start of line ``stop``.
+
+        :raises ValueError: if the file is opened in text mode, if ``stop`` is
+            negative, or if line ``stop`` begins before the current read
+            position
+        """
+        offsets = self.line_offsets()
+        if stop is None:
+            end = offsets[-1]
+        elif stop < 0:
+            raise ValueError("Line numbers cannot be negative")
+        else:
+            end = offsets[min(stop, len(offsets) - 1)]
+        self._copy_input_to(end)
+
+    def replace_lines(
+        self: InPlace[bytes], start: int, stop: int, new_lines: Iterable[bytes]
+    ) -> None:
+        """
+        Replace lines ``start`` through ``stop - 1`` (zero-based indices into
+        the input file, clamped to the number of lines as with slicing) with
+        ``new_lines``.  Any input between the current read position and line
+        ``start`` is first copied to the output unchanged, as with
+        :meth:`copy_lines`; reading then resumes at the start of line
+        ``stop``.  Call :meth:`copy_lines` with no arguments afterwards to keep
+        the rest of the file.
+
+        :raises ValueError: if the file is opened in text mode, if ``start``
+            is negative or greater than ``stop``, or if line ``start`` begins
+            before the current read position
+        """
+        if start < 0:
+            raise ValueError("Line numbers cannot be negative")
+        if start > stop:
+            raise ValueError("start cannot be greater than stop")
+        offsets = self.line_offsets()
+        self.copy_lines(start)
+        self.writelines(new_lines)
+        self.input.seek(offsets[min(stop, len(offsets) - 1)])
+
+    def iter_line_batches(
+        self: InPlace[bytes], max_bytes: int = 1024 * 1024
+    ) -> Iterator[LineBatch]:
+        """
+        Read the rest of the input in blocks of about ``max_bytes`` bytes and
+        yield each one as a `LineBatch` of complete ``b"\\n"``-terminated
+        lines (the last batch may end with an unterminated line at end of
+        file).  A partial line at the end of a block is carried over to the
+        next batch, and a single line longer than ``max_bytes`` is returned
+        whole in a larger batch.
+
+        This is much faster than iterating over the input line by line, as
+        each block is read with one call and split into lines with one scan.
+        A batch's lines can be written out in bulk with
+        ``fp.write(batch.data)`` or ``fp.writelines(batch.lines())``.
+
+        :raises ValueError: if the file is opened in text mode or if
+            ``max_bytes`` is not positive
+        """
+        if not self._binary:
+            raise ValueError("Line batches are only supported in binary mode")
+        if max_bytes <= 0:
+            raise ValueError("max_bytes must be positive")
+        # The pieces of the partial line carried over from previous blocks,
+        # joined only once the line is complete so that a line spanning many
+        # blocks is not copied over and over:
+        carry: list[bytes] = []
+        while True:
+            block = self.input.read(max_bytes)
+            if not block:
+                if carry:
+                    yield LineBatch(b"".join(carry))
+                return
+            i = block.rfind(b"\n")
+            if i == -1:
+                carry.append(block)
+            else:
+                carry.append(block[: i + 1])
+                yield LineBatch(b"".join(carry))
+                carry = [block[i + 1 :]] if i + 1 < len(block) else []
+
+    def checkpoint(self, state: Any = None) -> None:
+        """
+        Record the current input position and output length in the checkpoint
+        file of a resumable edit (one opened with ``resume=True``), first
+        flushing the output and syncing it to disk, so that the edit can be
+        resumed from this point if it is interrupted.
+
+        In text mode, the input must be read with :meth:`readline`,
+        :meth:`read`, or iteration over the instance (not over `input`
+        directly), as the position of a text stream cannot be determined in
+        the middle of iterating over it.
+
+        :param state: A JSON-serializable token describing the state of the
+            transformation at this point (e.g., running totals), stored in
+            `resume_state` when the edit is resumed
+        :raises ValueError: if the edit is not resumable or the instance is
+            closed
+        """
+        if self._checkpoint_path is None:
+            raise ValueError("checkpoint() requires resume=True")
+        if self.closed:
+            raise ValueError("Cannot checkpoint a closed file")
+        self.output.flush()
+        fd = self.output.fileno()
+        os.fsync(fd)
+        write_checkpoint(
+            self._checkpoint_path,
+            {
+                "input": self._input_stamp,
+                "input_offset": self.input.tell(),
+                "output_length": os.fstat(fd).st_size,
+                "state": state,
+            },
+            self._dirfd,
+        )
+        self._has_checkpoint = True
+
+    def _copy_input_to(self, end: int) -> None:
+        """
+        Copy the input from the current read position to byte offset ``end``
+        directly to the output, leaving the input positioned at ``end``
+        """
+        pos = self.input.tell()
+        if end < pos:
+            raise ValueError("Cannot copy lines before the current read position")
+        if end > pos:
+            self.output.flush()
+            copy = copy_sparse_range if self._sparse else copy_range
+            copy(self.input.fileno(), self.output.fileno(), pos, end - pos)
+            self.output.seek(0, os.SEEK_END)
+            self.input.seek(end)
+
     def __iter__(self) -> InPlace[AnyStr]:
         return self
 
     def __next__(self) -> AnyStr:
+        if self._checkpoint_path is not None:
+            # Iterating with readline() keeps the input's position available
+            # for checkpoints in text mode.
+            line = self.input.readline()
+            if not line:
+                raise StopIteration
+            return line
         return next(self.input)
 
     def flush(self) -> None:
@@ -284,30 +1371,3003 @@ class InPlace(IO[AnyStr]):
         return False
 
 
-def copystats(from_file: str, to_file: str) -> None:
+class HashingReader(io.RawIOBase):
     """
-    Copy stat info from ``from_file`` to ``to_file`` using `shutil.copystat`.
-    If possible, also copy the user and/or group ownership information.
+    A raw binary stream wrapping another raw stream that feeds the bytes read
+    from it, starting from the beginning of the stream, into a `hashlib` hash
+    object.  Only data read sequentially is hashed as it is read; any data
+    that was skipped over (e.g., by seeking) is hashed by :meth:`finish`.
     """
-    shutil.copystat(from_file, to_file)
-    if hasattr(os, "chown"):
-        st = os.stat(from_file)
-        # Based on GNU sed's behavior:
+
+    def __init__(self, raw: IO[bytes], hasher: Any) -> None:
+        #: The underlying raw stream
+        self.raw = raw
+        #: The hash object
+        self.hasher = hasher
+        #: The number of bytes from the start of the stream that have been
+        #: hashed
+        self.hashed = 0
+        #: The current position in the stream
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return self.raw.seekable()
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        self._pos = self.raw.seek(offset, whence)
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+    def fileno(self) -> int:
+        return self.raw.fileno()
+
+    def readinto(self, b: Buffer) -> int:
+        if self._pos > self.hashed:
+            self.hashed = hash_fd_range(
+                self.fileno(), self.hasher, self.hashed, self._pos
+            )
+        n = self.raw.readinto(b)  # type: ignore[attr-defined]
+        assert isinstance(n, int)
+        if n and self._pos == self.hashed:
+            self.hasher.update(memoryview(b)[:n])
+            self.hashed += n
+        self._pos += n
+        return n
+
+    def close(self) -> None:
         try:
-            os.chown(to_file, st.st_uid, st.st_gid)
-        except OSError:
-            try:
-                os.chown(to_file, -1, st.st_gid)
-            except OSError:
-                pass
+            self.raw.close()
+        finally:
+            super().close()
+
+    def finish(self) -> str:
+        """
+        Hash any data from the end of the sequentially-read data to the end of
+        the file (without changing the stream position) and return the hex
+        digest of the complete contents
+        """
+        self.hashed = hash_fd_range(self.fileno(), self.hasher, self.hashed, None)
+        digest = self.hasher.hexdigest()
+        assert isinstance(digest, str)
+        return digest
+
+
+class HashingWriter(io.RawIOBase):
+    """
+    A raw binary stream wrapping another raw stream that feeds the bytes
+    written to it, starting from the beginning of the stream, into a
+    `hashlib` hash object (or any other object with an ``update()`` method,
+    such as a `Tee`).  Data that was written to the underlying file by other
+    means (e.g., by copying directly between file descriptors and then
+    seeking past it) is read back and hashed before the next write or by
+    :meth:`catch_up` or :meth:`finish`, so the digest covers the whole file
+    as long as it is written from front to back.
+    """
+
+    def __init__(self, raw: IO[bytes], hasher: Any) -> None:
+        #: The underlying raw stream
+        self.raw = raw
+        #: The hash object
+        self.hasher = hasher
+        #: The number of bytes from the start of the stream that have been
+        #: hashed
+        self.hashed = 0
+        #: The current position in the stream
+        self._pos = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return self.raw.seekable()
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        self._pos = self.raw.seek(offset, whence)
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+    def fileno(self) -> int:
+        return self.raw.fileno()
+
+    def write(self, b: Buffer) -> int:
+        if self._pos > self.hashed:
+            self.hashed = hash_fd_range(
+                self.fileno(), self.hasher, self.hashed, self._pos
+            )
+        n = self.raw.write(b)  # type: ignore[arg-type]
+        if n and self._pos == self.hashed:
+            self.hasher.update(memoryview(b)[:n])
+            self.hashed += n
+        self._pos += n
+        return n
+
+    def close(self) -> None:
+        try:
+            self.raw.close()
+        finally:
+            super().close()
+
+    def catch_up(self) -> None:
+        """Hash any data from the end of the hashed data to the end of the file"""
+        self.hashed = hash_fd_range(self.fileno(), self.hasher, self.hashed, None)
+
+    def finish(self) -> str:
+        """
+        Hash any data from the end of the hashed data to the end of the file
+        and return the hex digest of the complete contents
+        """
+        self.catch_up()
+        digest = self.hasher.hexdigest()
+        assert isinstance(digest, str)
+        return digest
+
+
+#: The maximum number of chunks of output queued for each ``tee`` sink
+TEE_QUEUE_SIZE = 64
+
+
+class Tee:
+    """
+    Sends copies of the chunks of data passed to :meth:`update` to a list of
+    sinks (binary file-like objects or callables).  Each sink is fed by its
+    own thread, started on first use, from a queue holding at most
+    `TEE_QUEUE_SIZE` chunks, so that a slow sink only holds up the writer
+    once its queue is full.  Once any sink raises an error, the remaining
+    data is discarded, and the error is raised by the next call to
+    :meth:`update` or :meth:`drain`.
+    """
+
+    def __init__(self, sinks: Iterable[Any]) -> None:
+        #: The sinks
+        self.sinks = list(sinks)
+        #: The queue for each sink, once started
+        self._queues: list[queue.Queue[bytes | None]] = []
+        #: The thread for each sink, once started
+        self._threads: list[threading.Thread] = []
+        #: The first error raised by any sink
+        self._error: BaseException | None = None
+
+    def _start(self) -> None:
+        for sink in self.sinks:
+            q: queue.Queue[bytes | None] = queue.Queue(TEE_QUEUE_SIZE)
+            write = sink.write if hasattr(sink, "write") else sink
+            t = threading.Thread(
+                target=self._run, args=(write, q), name="in_place-tee", daemon=True
+            )
+            t.start()
+            self._queues.append(q)
+            self._threads.append(t)
+
+    def _run(self, write: Callable[[bytes], Any], q: queue.Queue[bytes | None]) -> None:
+        while (data := q.get()) is not None:
+            if self._error is None:
+                try:
+                    write(data)
+                except Exception as e:
+                    if self._error is None:
+                        self._error = e
+
+    def update(self, data: Buffer) -> None:
+        """Queue a copy of ``data`` for each sink"""
+        if self._error is not None:
+            raise self._error
+        if not self._threads:
+            self._start()
+        data = bytes(data)
+        for q in self._queues:
+            q.put(data)
+
+    def drain(self) -> None:
+        """
+        Wait for all queued data to be sent to the sinks and stop their
+        threads.  If any sink raised an error, it is re-raised.
+        """
+        threads, self._threads = self._threads, []
+        queues, self._queues = self._queues, []
+        for q in queues:
+            q.put(None)
+        for t in threads:
+            t.join()
+        if self._error is not None:
+            raise self._error
+
+    def end(self, committed: bool) -> None:
+        """
+        Stop the sinks' threads (discarding any errors) and then call each
+        sink's ``flush()`` method, if any, followed by its ``commit()`` or
+        ``rollback()`` method (depending on ``committed``), if any
+        """
+        with suppress(Exception):
+            self.drain()
+        for sink in self.sinks:
+            if hasattr(sink, "flush"):
+                sink.flush()
+            method = getattr(sink, "commit" if committed else "rollback", None)
+            if method is not None:
+                method()
+
+
+class SparseWriter(io.RawIOBase):
+    """
+    A raw binary stream wrapping another raw stream open on a regular file
+    that, instead of writing whole filesystem blocks of zero bytes (aligned to
+    block boundaries in the file), seeks over them, leaving holes in the file.
+    Whenever a write ends in a hole, the file is extended to cover it.
+    """
+
+    def __init__(self, raw: IO[bytes]) -> None:
+        #: The underlying raw stream
+        self.raw = raw
+        #: The filesystem block size
+        self.blksize = getattr(os.fstat(raw.fileno()), "st_blksize", 0) or 4096
+        #: A block of zero bytes
+        self.zeros = bytes(self.blksize)
+        #: The current position in the stream
+        self._pos = raw.tell()
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return self.raw.seekable()
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        self._pos = self.raw.seek(offset, whence)
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+    def fileno(self) -> int:
+        return self.raw.fileno()
+
+    def write(self, b: Buffer) -> int:
+        data = bytes(b)
+        view = memoryview(data)
+        n = len(data)
+        blk = self.blksize
+        # `start` is the start of the data not yet written; `search` is where
+        # to look for the next zero block.
+        start = search = 0
+        hole = False
+        while (i := data.find(self.zeros, search)) != -1:
+            # Round up to the next block boundary in the file:
+            i += -(self._pos + i) % blk
+            if i + blk > n:
+                break
+            if view[i : i + blk] != self.zeros:
+                search = i + 1
+                continue
+            j = i + blk
+            while j + blk <= n and view[j : j + blk] == self.zeros:
+                j += blk
+            self._write_all(view[start:i])
+            self._pos = self.raw.seek(j - i, os.SEEK_CUR)
+            start = search = j
+            hole = start == n
+        if start < n:
+            self._write_all(view[start:])
+        elif hole:
+            extend_to(self.fileno(), self._pos)
+        return n
+
+    def _write_all(self, view: memoryview) -> None:
+        while view:
+            k = self.raw.write(view)
+            assert k is not None
+            self._pos += k
+            view = view[k:]
+
+    def close(self) -> None:
+        try:
+            self.raw.close()
+        finally:
+            super().close()
+
+
+def extend_to(fd: int, size: int) -> None:
+    """
+    Extend the file open on ``fd`` to ``size`` bytes (creating a hole at the
+    end) if it is currently shorter
+    """
+    if os.fstat(fd).st_size < size:
+        os.ftruncate(fd, size)
+
+
+def hash_fd_range(fd: int, hasher: Any, start: int, end: int | None) -> int:
+    """
+    Feed the bytes of the file open on ``fd`` from offset ``start`` up to
+    offset ``end`` (or to the end of the file, if ``end`` is `None`) into
+    ``hasher`` without changing the file position, and return the offset at
+    which hashing stopped
+    """
+    while end is None or start < end:
+        size = COPY_BUFSIZE if end is None else min(end - start, COPY_BUFSIZE)
+        if hasattr(os, "pread"):
+            bs = os.pread(fd, size, start)
+        else:
+            pos = os.lseek(fd, 0, os.SEEK_CUR)
+            os.lseek(fd, start, os.SEEK_SET)
+            bs = os.read(fd, size)
+            os.lseek(fd, pos, os.SEEK_SET)
+        if not bs:
+            break
+        hasher.update(bs)
+        start += len(bs)
+    return start
+
+
+class LineBatch:
+    """
+    A block of consecutive lines read from an `InPlace` input by
+    :meth:`InPlace.iter_line_batches`.  The lines are stored together in a
+    single `bytes` object, and the boundaries between them are only computed
+    when needed.
+
+    Iterating over or indexing a `LineBatch` produces `memoryview` slices of
+    the underlying data, so no per-line copies are made.
+    """
+
+    def __init__(self, data: bytes) -> None:
+        #: The lines in the batch, concatenated
+        self.data = data
+        self._offsets: array[int] | None = None
+
+    @property
+    def offsets(self) -> array[int]:
+        """
+        An `array.array` of the offsets in `data` at which each line begins,
+        followed by the length of `data`
+        """
+        if self._offsets is None:
+            self._offsets = scan_lines(self.data)
+        return self._offsets
+
+    def lines(self) -> list[bytes]:
+        """Return the lines in the batch as a list of `bytes`"""
+        if b"\r" not in self.data:
+            # `bytes.splitlines()` only breaks on "\r" and "\n", so this is
+            # equivalent to splitting on "\n" alone.
+            return self.data.splitlines(keepends=True)
+        offsets = self.offsets
+        return [self.data[offsets[i] : offsets[i + 1]] for i in range(len(self))]
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> memoryview:
+        offsets = self.offsets
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("LineBatch index out of range")
+        return memoryview(self.data)[offsets[i] : offsets[i + 1]]
+
+    def __iter__(self) -> Iterator[memoryview]:
+        view = memoryview(self.data)
+        offsets = self.offsets
+        for i in range(len(offsets) - 1):
+            yield view[offsets[i] : offsets[i + 1]]
+
+
+class ConflictError(Exception):
+    """
+    Raised by `InPlace.close()` when ``detect_conflicts`` is true and the file
+    being edited was modified or replaced by something else during editing.
+    The edited output is discarded, and the file is left as the other writer
+    left it.
+    """
+
+    def __init__(self, path: str) -> None:
+        #: The path to the file that was changed
+        self.path = path
+        super().__init__(path)
+
+    def __str__(self) -> str:
+        return f"{self.path}: file was changed by something else during editing"
+
+
+def retry_edit(
+    name: AnyPath,
+    func: Callable[[InPlace[Any]], T],
+    mode: Literal["t", "b", None] = None,
+    retries: int = 3,
+    on_conflict: Callable[[ConflictError, int], Any] | None = None,
+    **kwargs: Any,
+) -> T:
+    """
+    Edit a file in-place by calling ``func`` on an `InPlace` instance opened
+    with ``detect_conflicts=True``, and, if the file was changed by something
+    else during the edit, rerun the edit on the new contents, up to
+    ``retries`` more times.  Returns the return value of the successful call
+    to ``func``.
+
+    :param name: The path to the file to edit
+    :param func: A function that reads from & writes to the given `InPlace`
+        instance.  It must be safe to call more than once.
+    :param mode: as for `InPlace`
+    :param int retries: The maximum number of times to retry the edit after a
+        conflict
+    :param on_conflict: A function to call with the `ConflictError` and the
+        number of the upcoming retry (starting from 1) before each retry, e.g.,
+        to log the conflict or sleep for a backoff period
+    :param kwargs: Additional keyword arguments to pass to `InPlace`
+    :raises ConflictError: if the edit still conflicts after ``retries``
+        retries
+    """
+    attempt = 0
+    while True:
+        try:
+            with InPlace(
+                name,
+                mode,  # type: ignore[arg-type]
+                detect_conflicts=True,
+                **kwargs,
+            ) as fp:
+                result = func(fp)
+            return result
+        except ConflictError as e:
+            if attempt >= retries:
+                raise
+            attempt += 1
+            if on_conflict is not None:
+                on_conflict(e, attempt)
+
+
+class Transaction:
+    """
+    A group of `InPlace` edits that are committed all together or not at all.
+
+    Files are opened for editing with :meth:`open`, which returns an `InPlace`
+    instance.  Closing such an instance only stages its output; the actual
+    moving of files for all instances happens in one quick pass when the
+    transaction is committed with :meth:`commit`.  If moving any file fails,
+    all files that were already replaced are restored to their original
+    contents before the error is raised.  Calling :meth:`rollback` discards
+    all of the edits.
+
+    When used as a context manager, a `Transaction` is committed on exit if
+    no exception occurred and rolled back otherwise.
+
+    :param bool fsync: If true, the output of each edit is flushed to disk
+        with `os.fsync()` when it is staged, and each directory containing an
+        edited file is synced once after all files have been replaced
+    """
+
+    def __init__(self, fsync: bool = False) -> None:
+        #: Whether to fsync files & directories on commit
+        self.fsync = fsync
+        #: The edits in the transaction that have not been rolled back
+        self._edits: list[InPlace[Any]] = []
+        #: `True` iff the transaction has been committed or rolled back
+        self._closed = False
+
+    def __enter__(self) -> Transaction:
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        _exc_val: BaseException | None,
+        _exc_tb: TracebackType | None,
+    ) -> None:
+        if not self.closed:
+            if exc_type is not None:
+                self.rollback()
+            else:
+                self.commit()
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    @overload
+    def open(
+        self,
+        name: AnyPath,
+        mode: Literal["t", None] = None,
+        backup: AnyPath | None = None,
+        backup_ext: AnyPath | None = None,
+        **kwargs: Any,
+    ) -> InPlace[str]: ...
+
+    @overload
+    def open(
+        self,
+        name: AnyPath,
+        mode: Literal["b"],
+        backup: AnyPath | None = None,
+        backup_ext: AnyPath | None = None,
+        **kwargs: Any,
+    ) -> InPlace[bytes]: ...
+
+    def open(
+        self,
+        name: AnyPath,
+        mode: Literal["t", "b", None] = None,
+        backup: AnyPath | None = None,
+        backup_ext: AnyPath | None = None,
+        **kwargs: Any,
+    ) -> InPlace[Any]:
+        """
+        Open a file for editing as part of the transaction.  The arguments are
+        the same as for `InPlace`.
+
+        :raises ValueError: if the transaction has already been committed or
+            rolled back
+        """
+        if self.closed:
+            raise ValueError("Cannot open files in a closed transaction")
+        fp: InPlace[Any] = InPlace(
+            name,
+            mode,  # type: ignore[arg-type]
+            backup=backup,
+            backup_ext=backup_ext,
+            **kwargs,
+        )
+        fp._transaction = self
+        self._edits.append(fp)
+        return fp
+
+    def commit(self) -> None:
+        """
+        Close any edits that are still open and move all edited files to their
+        final destinations.  If an error occurs, all files are left with their
+        original contents.
+
+        :raises ConflictError: if any edit was opened with
+            ``detect_conflicts=True`` and its input file was changed by
+            something else while being edited; no files are changed
+        :raises ValueError: if the transaction has already been committed or
+            rolled back
+        """
+        if self.closed:
+            raise ValueError("Transaction is already closed")
+        try:
+            # Closing a dry-run edit removes it from `_edits`, so iterate over a
+            # copy.
+            for fp in list(self._edits):
+                fp.close()
+        except BaseException:
+            self.rollback()
+            raise
+        self._closed = True
+        edits, self._edits = self._edits, []
+        try:
+            try:
+                for fp in edits:
+                    fp._check_conflict()
+                for fp in edits:
+                    fp._store_backup()
+                    fp._assign_numbered_backup()
+            except BaseException:
+                for fp in edits:
+                    try_unlink(fp._tmppath)
+                raise
+            deferred = commit_all(
+                [(fp._tmppath, fp._path, fp._backuppath) for fp in edits],
+                fsync=self.fsync,
+            )
+            for i in deferred:
+                edits[i]._copy_backup_later()
+            for fp in edits:
+                fp._remove_checkpoint()
+                fp._record_backup()
+                fp._advance_numbered_backup()
+        except BaseException:
+            for fp in edits:
+                fp._end_tee(False)
+            raise
+        finally:
+            for fp in edits:
+                fp._close_backup_source()
+                fp._release_lock()
+        for fp in edits:
+            fp._end_tee(True)
+
+    def rollback(self) -> None:
+        """
+        Discard all edits in the transaction, leaving the files untouched
+
+        :raises ValueError: if the transaction has already been committed or
+            rolled back
+        """
+        if self.closed:
+            raise ValueError("Transaction is already closed")
+        self._closed = True
+        edits, self._edits = self._edits, []
+        for fp in edits:
+            fp._transaction = None
+            if not fp.closed:
+                fp._close()
+            try_unlink(fp._tmppath)
+            fp._remove_checkpoint()
+            fp._close_backup_source()
+            fp._release_lock()
+            fp._end_tee(False)
+
+    def _discard(self, fp: InPlace[Any]) -> None:
+        """Remove a rolled-back `InPlace` instance from the transaction"""
+        self._edits.remove(fp)
+
+
+class DirCache:
+    """
+    A cache of resolved directory paths and open directory file descriptors
+    that can be shared by many `InPlace` instances (via the ``dir_cache``
+    argument) editing files in the same directory tree.  Each directory is
+    resolved with `os.path.realpath()` and opened at most once, and files in
+    it are then created, opened, renamed, and deleted relative to the
+    directory's file descriptor rather than by full path.
+
+    On platforms that do not support operations relative to directory file
+    descriptors, only the resolved paths are cached.
+
+    The cache assumes that the directories involved are not moved or replaced
+    while it is in use.  It should be closed (directly or by using it as a
+    context manager) once all `InPlace` instances using it are closed.
+    """
+
+    def __init__(self) -> None:
+        #: Mapping from absolute directory paths to their resolved forms
+        self._realdirs: dict[str, str] = {}
+        #: Mapping from resolved directory paths to open file descriptors
+        self._fds: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> DirCache:
+        return self
+
+    def __exit__(
+        self,
+        _exc_type: type[BaseException] | None,
+        _exc_val: BaseException | None,
+        _exc_tb: TracebackType | None,
+    ) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Close all cached directory file descriptors and clear the cache"""
+        with self._lock:
+            fds = list(self._fds.values())
+            self._fds.clear()
+            self._realdirs.clear()
+        for fd in fds:
+            os.close(fd)
+
+    def resolve_dir(self, dirpath: str) -> tuple[str, int | None]:
+        """
+        Given an absolute path to a directory, return a pair of the path with
+        symbolic links resolved and an open file descriptor for the directory
+        (or `None` if directory file descriptors are not supported)
+        """
+        with self._lock:
+            try:
+                realdir = self._realdirs[dirpath]
+            except KeyError:
+                realdir = self._realdirs[dirpath] = os.path.realpath(dirpath)
+            if not DIR_FD_SUPPORTED:
+                return (realdir, None)
+            try:
+                fd = self._fds[realdir]
+            except KeyError:
+                fd = self._fds[realdir] = os.open(realdir, DIR_OPEN_FLAGS)
+            return (realdir, fd)
+
+    def resolve(self, path: str) -> tuple[str, int | None]:
+        """
+        Given an absolute path to a file, return a pair of the path with
+        symbolic links resolved (as by `os.path.realpath()`) and an open file
+        descriptor for the file's directory (or `None` if directory file
+        descriptors are not supported)
+        """
+        dirpath, basename = os.path.split(path)
+        realdir, fd = self.resolve_dir(dirpath)
+        try:
+            if fd is not None:
+                st = os.stat(basename, dir_fd=fd, follow_symlinks=False)
+            else:
+                st = os.lstat(os.path.join(realdir, basename))
+        except FileNotFoundError:
+            # Leave it to the caller to report the error.
+            pass
+        else:
+            if stat.S_ISLNK(st.st_mode):
+                link = os.path.join(realdir, basename)
+                try:
+                    # This raises an `OSError` with `errno.ELOOP` for symlink
+                    # loops.
+                    target = os.path.realpath(link, strict=True)
+                except FileNotFoundError:
+                    # Leave it to the caller to report the dangling link.
+                    target = os.path.realpath(link)
+                realdir, fd = self.resolve_dir(os.path.dirname(target))
+                basename = os.path.basename(target)
+        return (os.path.join(realdir, basename), fd)
+
+
+class EditCache:
+    """
+    A persistent record, kept in an SQLite database, of the files that a given
+    version of an idempotent transform has already been applied to, so that
+    rerunning the transform over the same tree can skip every file that has
+    not changed since with just a `os.stat()` call.
+
+    After a file has been edited, call :meth:`record` to store its path (with
+    symbolic links resolved), device, inode number, size, and modification
+    time in nanoseconds along with ``version``; on later runs,
+    :meth:`is_current` returns true for as long as all of these still match.
+    Change ``version`` whenever the transform changes so that every file is
+    processed again.  The batch editing functions `edit_csv()` and
+    `parallel_map_lines()` accept a ``cache`` argument that does this
+    automatically.
+
+    A single instance can be shared between threads.  It should be closed
+    (directly or by using it as a context manager) once it is no longer
+    needed.  Losing the database or individual records is harmless; the
+    affected files are simply processed again.
+
+    :param path: The path to the database file, which is created if it does
+        not exist
+    :type path: path-like
+    :param str version: An identifier for the version of the transform
+    """
+
+    def __init__(self, path: AnyPath, version: str = "") -> None:
+        import sqlite3
+
+        #: The identifier of the version of the transform
+        self.version = version
+        self._lock = threading.Lock()
+        # Records are only hints, so each one is committed without waiting for
+        # it to reach the disk.
+        self._db = sqlite3.connect(
+            os.fsdecode(path), isolation_level=None, check_same_thread=False
+        )
+        try:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                " path TEXT PRIMARY KEY,"
+                " stamp TEXT NOT NULL,"
+                " version TEXT NOT NULL"
+                ")"
+            )
+        except BaseException:
+            self._db.close()
+            raise
+
+    def __enter__(self) -> EditCache:
+        return self
+
+    def __exit__(
+        self,
+        _exc_type: type[BaseException] | None,
+        _exc_val: BaseException | None,
+        _exc_tb: TracebackType | None,
+    ) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Close the database"""
+        with self._lock:
+            self._db.close()
+
+    def is_current(self, name: AnyPath) -> bool:
+        """
+        Return true iff the file at ``name`` is unchanged since it was last
+        recorded with the current version.  Returns false if the file does not
+        exist.
+        """
+        path = os.path.realpath(os.fsdecode(name))
+        try:
+            stamp = file_stamp(os.stat(path))
+        except FileNotFoundError:
+            return False
+        with self._lock:
+            row: tuple[str, str] | None = self._db.execute(
+                "SELECT stamp, version FROM files WHERE path = ?", (path,)
+            ).fetchone()
+        return row == (stamp, self.version)
+
+    def record(self, name: AnyPath) -> None:
+        """
+        Record the current state of the file at ``name`` as having been
+        processed by the current version of the transform.  Call this after
+        the edit of the file has been committed.
+        """
+        path = os.path.realpath(os.fsdecode(name))
+        stamp = file_stamp(os.stat(path))
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO files (path, stamp, version)"
+                " VALUES (?, ?, ?)",
+                (path, stamp, self.version),
+            )
+
+
+#: Whether the platform supports all the operations that `DirCache` performs
+#: relative to directory file descriptors
+DIR_FD_SUPPORTED = {
+    os.link,
+    os.open,
+    os.rename,
+    os.stat,
+    os.unlink,
+} <= os.supports_dir_fd and os.scandir in os.supports_fd
+
+#: The flags with which `DirCache` opens directories
+DIR_OPEN_FLAGS = (
+    os.O_RDONLY | getattr(os, "O_DIRECTORY", 0) | getattr(os, "O_CLOEXEC", 0)
+)
+
+
+def edit_file(
+    name: AnyPath,
+    func: Callable[[Any], Any],
+    mode: Literal["t", "b", None] = None,
+    encoding: str | None = None,
+    errors: str | None = None,
+    backup: AnyPath | None = None,
+    backup_ext: AnyPath | None = None,
+    small_file_limit: int = 4096,
+    max_size: int | None = None,
+) -> bool:
+    """
+    Edit a file in-place by passing its entire contents to ``func`` and
+    replacing them with the return value.  If ``func`` returns `None` or the
+    original contents, the file is left untouched and no backup is made.
+    Returns true iff the file was changed.
+
+    The whole file is read into memory, and ``func``'s result is held in
+    memory as well, whatever the size of the file; to refuse files that are
+    too big for this, set ``max_size``.  Use `InPlace` directly (or
+    `parallel_map_lines()`) to stream a large file instead.
+
+    Files of at most ``small_file_limit`` bytes take a fast path that skips
+    most of `InPlace`'s machinery: the file is opened once, checked with
+    `os.fstat()`, and read with a single `os.read()`, and the new contents are
+    written to a temporary file with a single `os.write()` (after copying the
+    original's permissions, ownership, and other metadata by file descriptor)
+    before being renamed into place.  Larger files (and anything that is not a
+    regular file) are edited with an `InPlace` instance instead.  Either way,
+    the replacement is atomic and the backup semantics are the same as for
+    `InPlace`.
+
+    In text mode (the default), the contents are decoded with ``encoding``
+    (default: the locale encoding) and ``errors`` and passed to ``func`` with
+    universal newlines translated to ``"\\n"``, and ``"\\n"`` in the result
+    is translated to `os.linesep`, just as with `InPlace`.  In binary mode,
+    ``func`` is passed & returns `bytes`.
+
+    :raises OSError: with `errno.EFBIG` if ``max_size`` is not `None` and the
+        file is a regular file larger than ``max_size`` bytes
+    """
+    if mode not in (None, "t", "b"):
+        raise ValueError(f"{mode!r}: invalid mode")
+    cwd = os.getcwd()
+    path = os.path.realpath(os.path.join(cwd, os.fsdecode(name)))
+    backuppath: str | None
+    if backup is not None:
+        if backup_ext is not None:
+            raise ValueError("backup and backup_ext are mutually exclusive")
+        b = os.fsdecode(backup)
+        if not b:
+            raise ValueError("backup cannot be empty")
+        backuppath = os.path.join(cwd, b)
+    elif backup_ext is not None:
+        be = os.fsdecode(backup_ext)
+        if not be:
+            raise ValueError("backup_ext cannot be empty")
+        backuppath = path + be
+    else:
+        backuppath = None
+    fd = os.open(path, os.O_RDONLY | getattr(os, "O_CLOEXEC", 0))
+    try:
+        st = os.fstat(fd)
+        if max_size is not None and stat.S_ISREG(st.st_mode) and st.st_size > max_size:
+            raise OSError(
+                errno.EFBIG,
+                f"File is larger than max_size ({st.st_size} > {max_size} bytes)",
+                os.fsdecode(name),
+            )
+        data = b""
+        if stat.S_ISREG(st.st_mode) and st.st_size <= small_file_limit:
+            data = os.read(fd, small_file_limit + 1)
+        if (
+            not stat.S_ISREG(st.st_mode)
+            or len(data) != st.st_size
+            or len(data) > small_file_limit
+        ):
+            # Not small (or not a regular file, or changed since the fstat()):
+            os.close(fd)
+            fd = -1
+            fp: InPlace[Any] = InPlace(
+                name,
+                mode,  # type: ignore[arg-type]
+                backup=backup,
+                backup_ext=backup_ext,
+                encoding=encoding,
+                errors=errors,
+            )
+            with fp:
+                content = fp.read()
+                new = func(content)
+                if new is None or new == content:
+                    fp.rollback()
+                    return False
+                fp.write(new)
+            return True
+        content = data
+        if mode != "b":
+            text = data.decode(
+                encoding or locale.getpreferredencoding(False), errors or "strict"
+            )
+            if "\r" in text:
+                text = text.replace("\r\n", "\n").replace("\r", "\n")
+            content = text
+        new = func(content)
+        if new is None or new == content:
+            return False
+        if mode != "b":
+            if os.linesep != "\n":
+                new = new.replace("\n", os.linesep)
+            new = new.encode(
+                encoding or locale.getpreferredencoding(False), errors or "strict"
+            )
+        dirpath = os.path.dirname(path)
+        while True:
+            tmppath = unique_path(dirpath)
+            try:
+                tfd = os.open(
+                    tmppath,
+                    os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_CLOEXEC", 0),
+                    0o600,
+                )
+            except FileExistsError:
+                continue
+            break
+        try:
+            try:
+                copystats_fd(fd, tfd)
+                view = memoryview(new)
+                while view:
+                    view = view[os.write(tfd, view) :]
+            finally:
+                os.close(tfd)
+            if backuppath is not None:
+                try:
+                    os.replace(path, backuppath)
+                except OSError as e:
+                    if e.errno != errno.EXDEV:
+                        raise
+                    copy_backup_later(os.dup(fd), backuppath)
+            os.replace(tmppath, path)
+        finally:
+            try_unlink(tmppath)
+        return True
+    finally:
+        if fd >= 0:
+            os.close(fd)
+
+
+@contextmanager
+def edit_json(
+    name: AnyPath,
+    backup: AnyPath | None = None,
+    backup_ext: AnyPath | None = None,
+    indent: int | None = None,
+    sort_keys: bool = False,
+) -> Iterator[Any]:
+    """
+    A context manager for editing a JSON file in-place.  The file is parsed,
+    and the resulting document is returned as the context target; any changes
+    made to the document within the context are serialized back to the file
+    on exit (using an `InPlace` instance, so the usual atomicity & backup
+    semantics apply).  If the document compares unchanged on exit, the file
+    is left untouched and no backup is made.  If an exception occurs within
+    the context, the file is left untouched as well.
+
+    Parsing & serialization are done with |orjson|_ if it is installed (and
+    supports the given options) and with the standard library's `json` module
+    otherwise.  Output is UTF-8, compact unless ``indent`` is given, and ends
+    with a newline if the original file did.
+
+    .. |orjson| replace:: ``orjson``
+    .. _orjson: https://github.com/ijl/orjson
+
+    :param name: The path to the JSON file to edit
+    :param backup: as for `InPlace`
+    :param backup_ext: as for `InPlace`
+    :param indent: The number of spaces with which to indent nested
+        structures, or `None` to produce compact output
+    :param bool sort_keys: Whether to sort the keys of objects on output
+    """
+    with InPlace(name, "b", backup=backup, backup_ext=backup_ext) as fp:
+        data = fp.read()
+        doc = load_json(data)
+        yield doc
+        newdata = dump_json(doc, indent=indent, sort_keys=sort_keys)
+        if newdata == dump_json(load_json(data), indent=indent, sort_keys=sort_keys):
+            fp.rollback()
+        else:
+            if data.endswith(b"\n"):
+                newdata += b"\n"
+            fp.write(newdata)
+
+
+@contextmanager
+def edit_toml(
+    name: AnyPath,
+    backup: AnyPath | None = None,
+    backup_ext: AnyPath | None = None,
+) -> Iterator[dict[str, Any]]:
+    """
+    A context manager for editing a TOML file in-place.  The file is parsed,
+    and the resulting table is returned as the context target; any changes
+    made to it within the context are serialized back to the file on exit
+    (using an `InPlace` instance, so the usual atomicity & backup semantics
+    apply).  If the table compares unchanged on exit, the file is left
+    untouched and no backup is made.  If an exception occurs within the
+    context, the file is left untouched as well.
+
+    Parsing & serialization are done with |rtoml|_ if it is installed.
+    Otherwise, parsing is done with the standard library's `tomllib` (or
+    |tomli|_ on Python 3.10), and serialization is done with |tomli_w|_, which
+    must be installed.  Note that comments & formatting in the original file
+    are not preserved.
+
+    .. |rtoml| replace:: ``rtoml``
+    .. _rtoml: https://github.com/samuelcolvin/rtoml
+
+    .. |tomli| replace:: ``tomli``
+    .. _tomli: https://github.com/hukkin/tomli
+
+    .. |tomli_w| replace:: ``tomli-w``
+    .. _tomli_w: https://github.com/hukkin/tomli-w
+
+    :param name: The path to the TOML file to edit
+    :param backup: as for `InPlace`
+    :param backup_ext: as for `InPlace`
+    :raises ImportError: if no TOML serializer is installed
+    """
+    loads, dumps = toml_backend()
+    with InPlace(
+        name, "t", backup=backup, backup_ext=backup_ext, encoding="utf-8"
+    ) as fp:
+        text = fp.read()
+        doc = loads(text)
+        yield doc
+        if doc == loads(text):
+            fp.rollback()
+        else:
+            fp.write(dumps(doc))
+
+
+@contextmanager
+def edit_records(
+    name: AnyPath,
+    dtype: Any,
+    backup: AnyPath | None = None,
+    backup_ext: AnyPath | None = None,
+    **kwargs: Any,
+) -> Iterator[tuple[Any, Any]]:
+    """
+    A context manager for editing a file of fixed-size binary records
+    in-place through memory maps.  The context target is a pair of the input
+    records, backed by a read-only memory map of the original file, and the
+    output records, backed by a writable memory map of the temporary output
+    file, which starts out as a copy of the input (made in the kernel where
+    possible).  Modify the output records within the context; on exit, the
+    output replaces the file (using an `InPlace` instance, so the usual
+    atomicity & backup semantics apply).  If an exception occurs within the
+    context, the file is left untouched.
+
+    If ``dtype`` is an `int`, it is the size of each record in bytes, and the
+    input & output are exposed as flat `memoryview`\\s of bytes.  Otherwise,
+    |numpy|_ must be installed, ``dtype`` is anything accepted by
+    ``numpy.dtype()`` (typically a structured dtype), and the input & output
+    are exposed as one-dimensional NumPy arrays of records, so that edits can
+    be vectorized, e.g., ``out["x"][inp["y"] > 0] += offset``.
+
+    The input & output objects must not be used after the context exits.
+
+    .. |numpy| replace:: NumPy
+    .. _numpy: https://numpy.org
+
+    :param name: The path to the file to edit
+    :param dtype: The size of each record in bytes or a NumPy dtype
+    :param backup: as for `InPlace`
+    :param backup_ext: as for `InPlace`
+    :param kwargs: Additional keyword arguments to pass to `InPlace`
+    :raises ValueError: if the size of the file is not a multiple of the size
+        of a record
+    :raises ImportError: if ``dtype`` is not an `int` and NumPy is not
+        installed
+    """
+    np: Any = None
+    if isinstance(dtype, int):
+        itemsize = dtype
+    else:
+        try:
+            import numpy  # type: ignore[import-not-found]
+        except ImportError:
+            raise ImportError(
+                "Editing records with a dtype requires NumPy to be installed"
+            ) from None
+        np = numpy
+        dtype = np.dtype(dtype)
+        itemsize = dtype.itemsize
+    if itemsize <= 0:
+        raise ValueError("Record size must be positive")
+    fp: InPlace[bytes]
+    with InPlace(name, "b", backup=backup, backup_ext=backup_ext, **kwargs) as fp:
+        infd = fp.input.fileno()
+        size = os.fstat(infd).st_size
+        if size % itemsize:
+            raise ValueError(
+                f"File size ({size}) is not a multiple of the record size"
+                f" ({itemsize})"
+            )
+        fp._copy_input_to(size)
+        fp.output.flush()
+        inbuf: bytes | mmap.mmap = b""
+        outbuf: bytearray | mmap.mmap = bytearray()
+        if size:
+            inbuf = mmap.mmap(infd, size, access=mmap.ACCESS_READ)
+            tmppath = fp._tmppath
+            if fp._dirfd is not None:
+                tmppath = os.path.basename(tmppath)
+            outfd = os.open(tmppath, os.O_RDWR, dir_fd=fp._dirfd)
+            try:
+                outbuf = mmap.mmap(outfd, size, access=mmap.ACCESS_WRITE)
+            except BaseException:
+                inbuf.close()
+                raise
+            finally:
+                os.close(outfd)
+        try:
+            if np is None:
+                yield (memoryview(inbuf).toreadonly(), memoryview(outbuf))
+            else:
+                yield (
+                    np.frombuffer(inbuf, dtype=dtype),
+                    np.frombuffer(outbuf, dtype=dtype),
+                )
+        finally:
+            for buf in (inbuf, outbuf):
+                if isinstance(buf, mmap.mmap):
+                    # If the caller still holds references to the arrays,
+                    # the maps can't be closed yet and are instead unmapped
+                    # once the arrays are garbage-collected.
+                    with suppress(BufferError):
+                        buf.close()
+
+
+def edit_csv(
+    name: AnyPath,
+    func: Callable[[list[list[str]]], Iterable[Iterable[Any]]],
+    batch_size: int = 10000,
+    workers: int = 1,
+    dialect: str | csv.Dialect | type[csv.Dialect] | None = None,
+    backup: AnyPath | None = None,
+    backup_ext: AnyPath | None = None,
+    cache: EditCache | None = None,
+    **kwargs: Any,
+) -> None:
+    """
+    Edit a CSV file in-place by passing its rows through ``func`` in batches.
+
+    The rows of the file are read in lists of up to ``batch_size`` rows at a
+    time, each list is passed to ``func``, and the rows that ``func`` returns
+    are written back out in place of the batch, in the same order as the
+    input.  Only a bounded number of batches are held in memory at once.  If
+    ``workers`` is greater than 1, the batches are transformed concurrently in
+    a pool of that many processes, in which case ``func`` must be picklable
+    (e.g., a module-level function).  If ``func`` raises an exception, the
+    file is left untouched.
+
+    If ``dialect`` is `None`, the dialect of the file is detected once from a
+    sample at the start of the file with `csv.Sniffer`, falling back to
+    ``"excel"`` if detection fails; the line terminator of the first line is
+    used for output.
+
+    :param name: The path to the CSV file to edit
+    :param func: A function that takes a list of rows and returns the rows to
+        write in their place
+    :param int batch_size: The maximum number of rows to pass to ``func`` at
+        once
+    :param int workers: The number of processes in which to run ``func``
+    :param dialect: The CSV dialect to use for both reading & writing
+    :param backup: as for `InPlace`
+    :param backup_ext: as for `InPlace`
+    :param cache: An `EditCache` to consult before editing the file, which is
+        skipped if it is current, and to record the file in after editing
+    :param kwargs: Additional keyword arguments to pass to `InPlace` (such as
+        ``encoding``)
+    :raises ValueError: if ``batch_size`` or ``workers`` is not positive
+    """
+    import csv
+
+    if batch_size <= 0:
+        raise ValueError("batch_size must be positive")
+    if workers <= 0:
+        raise ValueError("workers must be positive")
+    if cache is not None and cache.is_current(name):
+        return
+    with InPlace(
+        name, "t", backup=backup, backup_ext=backup_ext, newline="", **kwargs
+    ) as fp:
+        head: list[str] = []
+        if dialect is None:
+            size = 0
+            while size < CSV_SNIFF_SIZE:
+                line = fp.readline()
+                if not line:
+                    break
+                head.append(line)
+                size += len(line)
+            dialect = sniff_csv(head)
+        reader = csv.reader(chain(head, fp), dialect)
+        writer = csv.writer(fp, dialect)
+        batches = iter(lambda: list(islice(reader, batch_size)), [])
+        for rows in iter_map(func, batches, workers):
+            writer.writerows(rows)
+    if cache is not None and not kwargs.get("dry_run"):
+        cache.record(name)
+
+
+def sniff_csv(lines: list[str]) -> type[csv.Dialect] | str:
+    """
+    Detect the dialect of CSV data from a sample of its lines.  If the dialect
+    cannot be determined, return ``"excel"`` (adjusted to use the line
+    terminator of the first line, if any).
+    """
+    import csv
+
+    sample = "".join(lines)
+    if not sample:
+        return "excel"
+    lineterminator = "\r\n" if lines[0].endswith("\r\n") else "\n"
+    try:
+        dialect = csv.Sniffer().sniff(sample)
+    except csv.Error:
+        dialect = type("sniffed", (csv.excel,), {})
+    dialect.lineterminator = lineterminator
+    return dialect
+
+
+#: The minimum number of characters at the start of a CSV file to use for
+#: detecting its dialect
+CSV_SNIFF_SIZE = 64 * 1024
+
+
+def parallel_map_lines(
+    name: AnyPath,
+    func: Callable[[Any], Any],
+    workers: int | None = None,
+    mode: Literal["t", "b", None] = None,
+    encoding: str | None = None,
+    errors: str | None = None,
+    backup: AnyPath | None = None,
+    backup_ext: AnyPath | None = None,
+    shards: int | None = None,
+    cache: EditCache | None = None,
+) -> None:
+    """
+    Edit a file in-place by passing each of its lines through ``func`` (as
+    with `InPlace.map_lines()`: if ``func`` returns `None`, the line is kept
+    unchanged), processing separate parts of the file in parallel.
+
+    The input is split at line boundaries into ``shards`` byte ranges
+    (default: four per worker), each of which is read directly by a worker in
+    a pool of ``workers`` processes (default: the number of CPUs) and
+    transformed into a separate temporary file.  The shard outputs are then
+    concatenated in order into the output of an `InPlace` instance, using
+    kernel-side copying where possible, before the usual atomic commit.
+    ``func`` must be picklable (e.g., a module-level function) if ``workers``
+    is greater than 1.
+
+    In text mode (the default), lines are split on ``"\\n"`` and passed to
+    ``func`` with their original line endings, and ``encoding`` (default: the
+    locale encoding) must be UTF-8 or another stateless ASCII-compatible
+    encoding.  In binary mode, ``func`` is passed & returns `bytes`.
+
+    If ``cache`` is given, the file is skipped if the `EditCache` shows it to
+    be current, and it is recorded in the cache after being edited.
+
+    :raises ConflictError: if the file is replaced by something else while
+        the workers are reading it
+    :raises ValueError: if ``workers`` or ``shards`` is not positive or if
+        ``encoding`` is not ASCII-compatible
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 0:
+        raise ValueError("workers must be positive")
+    if shards is None:
+        shards = 4 * workers
+    if shards <= 0:
+        raise ValueError("shards must be positive")
+    if cache is not None and cache.is_current(name):
+        return
+    if mode not in (None, "t", "b"):
+        raise ValueError(f"{mode!r}: invalid mode")
+    codec: tuple[str, str] | None = None
+    if mode != "b":
+        if encoding is None:
+            encoding = locale.getpreferredencoding(False)
+        enc = ascii_compatible(encoding)
+        if enc is None:
+            raise ValueError(f"{encoding!r}: encoding is not ASCII-compatible")
+        codec = (enc, errors or "strict")
+    with InPlace(name, "b", backup=backup, backup_ext=backup_ext) as fp:
+        infd = fp.input.fileno()
+        st = os.fstat(infd)
+        bounds = shard_bounds(infd, st.st_size, shards)
+        dirpath = os.path.dirname(fp._path)
+        outpaths: list[str] = []
+        try:
+            for _ in bounds:
+                fd, outpath = tempfile.mkstemp(dir=dirpath, prefix="._in_place-")
+                os.close(fd)
+                outpaths.append(outpath)
+            jobs = [
+                (fp._path, (st.st_dev, st.st_ino), start, end, func, codec, outpath)
+                for (start, end), outpath in zip(bounds, outpaths)
+            ]
+            fp.output.flush()
+            outfd = fp.output.fileno()
+            for outpath in iter_map(map_shard, jobs, workers):
+                with open(outpath, "rb") as shardfp:
+                    shardfd = shardfp.fileno()
+                    copy_range(shardfd, outfd, 0, os.fstat(shardfd).st_size)
+                try_unlink(outpath)
+            fp.output.seek(0, os.SEEK_END)
+        finally:
+            for outpath in outpaths:
+                try_unlink(outpath)
+    if cache is not None:
+        cache.record(name)
+
+
+def shard_bounds(fd: int, size: int, n: int) -> list[tuple[int, int]]:
+    """
+    Split the first ``size`` bytes of the file open on ``fd`` into at most
+    ``n`` nonempty ranges of roughly equal size that each end at a line
+    boundary, and return a list of ``(start, end)`` pairs
+    """
+    if size == 0:
+        return []
+    bounds: list[tuple[int, int]] = []
+    with mmap.mmap(fd, size, access=mmap.ACCESS_READ) as mm:
+        start = 0
+        for k in range(1, n + 1):
+            if start >= size:
+                break
+            target = max(start, size * k // n)
+            if k == n or target >= size:
+                end = size
+            else:
+                i = mm.find(b"\n", target)
+                end = size if i == -1 else i + 1
+            if end > start:
+                bounds.append((start, end))
+                start = end
+    return bounds
+
+
+def map_shard(
+    job: tuple[
+        str,
+        tuple[int, int],
+        int,
+        int,
+        Callable[[Any], Any],
+        tuple[str, str] | None,
+        str,
+    ],
+) -> str:
+    """
+    Worker function for `parallel_map_lines()`: pass the lines in bytes
+    ``start`` through ``end`` of the file at ``path`` through ``func``
+    (decoding & encoding them with ``codec`` if it is not `None`) and write
+    the results to ``outpath``.  Returns ``outpath``.
+    """
+    path, ident, start, end, func, codec, outpath = job
+    with open(path, "rb") as infp, open(outpath, "wb") as outfp:
+        st = os.fstat(infp.fileno())
+        if (st.st_dev, st.st_ino) != ident:
+            raise ConflictError(path)
+        infp.seek(start)
+        pos = start
+        while pos < end:
+            raw = infp.readline(end - pos)
+            if not raw:
+                break
+            pos += len(raw)
+            if codec is None:
+                outfp.write(map_line(func, None, raw))
+            else:
+                line = raw.decode(*codec)
+                new = map_line(func, None, line)
+                outfp.write(raw if new == line else new.encode(*codec))
+    return outpath
+
+
+def iter_map(func: Callable[[T], U], items: Iterable[T], workers: int) -> Iterator[U]:
+    """
+    Yield ``func(x)`` for each ``x`` in ``items``, in order.  If ``workers`` is
+    greater than 1, the calls are made in a pool of ``workers`` processes, with
+    at most ``2 * workers`` items submitted but not yet yielded at any time.
+    """
+    if workers <= 1:
+        for x in items:
+            yield func(x)
+        return
+    from concurrent.futures import ProcessPoolExecutor
+
+    pending: deque[Future[U]] = deque()
+    with ProcessPoolExecutor(workers) as pool:
+        try:
+            for x in items:
+                pending.append(pool.submit(func, x))
+                if len(pending) >= 2 * workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for fut in pending:
+                fut.cancel()
+
+
+def sort_file(
+    name: AnyPath,
+    key: Callable[[Any], Any] | None = None,
+    reverse: bool = False,
+    memory_limit: int = 64 * 1024 * 1024,
+    workers: int = 1,
+    mode: Literal["t", "b", None] = None,
+    encoding: str | None = None,
+    errors: str | None = None,
+    backup: AnyPath | None = None,
+    backup_ext: AnyPath | None = None,
+) -> None:
+    """
+    Sort the lines of a file in-place with an external merge sort, holding
+    only about ``memory_limit`` bytes of lines in memory at once.
+
+    The input is read into runs of lines that fit within the memory limit;
+    each run is sorted and written to a temporary file in the same directory
+    as the file, and the runs are then merged with `heapq.merge()` into the
+    output of an `InPlace` instance before the usual atomic commit.  If the
+    whole file fits within the limit, it is simply sorted in memory.  If
+    ``workers`` is greater than 1, runs are sorted concurrently in a pool of
+    that many processes (with the memory limit divided between the runs in
+    flight), in which case ``key`` must be picklable.  The sort is stable, and
+    ``key`` and ``reverse`` have the same meanings as for `sorted()`.
+
+    Lines are compared with their line endings.  If the last line of the file
+    does not end with a newline, one is added so that it cannot run into the
+    following line once sorted.
+
+    :raises ValueError: if ``memory_limit`` or ``workers`` is not positive
+    """
+    if memory_limit <= 0:
+        raise ValueError("memory_limit must be positive")
+    if workers <= 0:
+        raise ValueError("workers must be positive")
+    binary = mode == "b"
+    if workers > 1:
+        budget = max(1, memory_limit // (2 * workers + 1))
+    else:
+        budget = memory_limit
+    with InPlace(
+        name,  # type: ignore[call-overload]
+        mode,
+        backup=backup,
+        backup_ext=backup_ext,
+        encoding=encoding,
+        errors=errors,
+    ) as fp:
+        chunks = iter_sort_chunks(fp, budget, b"\n" if binary else "\n")
+        first = next(chunks, [])
+        second = next(chunks, None)
+        if second is None:
+            first.sort(key=key, reverse=reverse)
+            fp.writelines(first)
+            return
+        chunks = chain([first, second], chunks)
+        del first, second
+        dirpath = os.path.dirname(fp._path)
+        runs: list[str] = []
+
+        def jobs() -> Iterator[tuple[list[Any], Any, bool, str, bool]]:
+            for lines in chunks:
+                fd, runpath = tempfile.mkstemp(dir=dirpath, prefix="._in_place-")
+                os.close(fd)
+                runs.append(runpath)
+                yield (lines, key, reverse, runpath, binary)
+
+        try:
+            sorted_runs = list(iter_map(sort_run, jobs(), workers))
+            while len(sorted_runs) > SORT_MERGE_WIDTH:
+                merged: list[str] = []
+                for i in range(0, len(sorted_runs), SORT_MERGE_WIDTH):
+                    group = sorted_runs[i : i + SORT_MERGE_WIDTH]
+                    fd, runpath = tempfile.mkstemp(dir=dirpath, prefix="._in_place-")
+                    runs.append(runpath)
+                    with open_run(runpath, "w", binary, fd=fd) as outfp:
+                        merge_runs(group, outfp, key, reverse, binary)
+                    for path in group:
+                        try_unlink(path)
+                    merged.append(runpath)
+                sorted_runs = merged
+            merge_runs(sorted_runs, fp, key, reverse, binary)
+        finally:
+            for runpath in runs:
+                try_unlink(runpath)
+
+
+#: The maximum number of sorted runs that `sort_file()` merges at once
+SORT_MERGE_WIDTH = 128
+
+
+def iter_sort_chunks(
+    fp: InPlace[Any], budget: int, newline: str | bytes
+) -> Iterator[list[Any]]:
+    """
+    Read the lines of ``fp`` and yield them in lists whose estimated memory
+    usage is at most ``budget`` bytes (but always at least one line each),
+    adding ``newline`` to the end of the last line if it lacks one
+    """
+    lines: list[Any] = []
+    size = 0
+    for line in fp:
+        if not line.endswith(newline):
+            line += newline
+        lines.append(line)
+        # Count the list slot as well as the line object itself:
+        size += sys.getsizeof(line) + 8
+        if size >= budget:
+            yield lines
+            lines = []
+            size = 0
+    if lines:
+        yield lines
+
+
+def sort_run(
+    job: tuple[list[Any], Callable[[Any], Any] | None, bool, str, bool],
+) -> str:
+    """
+    Worker function for `sort_file()`: sort ``lines`` and write them to
+    ``runpath``.  Returns ``runpath``.
+    """
+    lines, key, reverse, runpath, binary = job
+    lines.sort(key=key, reverse=reverse)
+    with open_run(runpath, "w", binary) as fp:
+        fp.writelines(lines)
+    return runpath
+
+
+def merge_runs(
+    paths: list[str],
+    out: IO[Any],
+    key: Callable[[Any], Any] | None,
+    reverse: bool,
+    binary: bool,
+) -> None:
+    """
+    Merge the sorted runs in the files at ``paths`` (in order, so that the
+    merge is stable) and write the result to ``out``
+    """
+    with ExitStack() as stack:
+        files = [stack.enter_context(open_run(p, "r", binary)) for p in paths]
+        out.writelines(heapq.merge(*files, key=key, reverse=reverse))
+
+
+def open_run(path: str, mode: str, binary: bool, fd: int | None = None) -> IO[Any]:
+    """
+    Open a temporary file of sorted lines for `sort_file()`.  In text mode,
+    lines are stored as UTF-8 without newline translation, with lone
+    surrogates (e.g., from decoding with ``errors="surrogateescape"``) passed
+    through unchanged.
+    """
+    target = path if fd is None else fd
+    if binary:
+        return open(target, mode + "b")
+    else:
+        return open(
+            target, mode, encoding="utf-8", errors="surrogatepass", newline="\n"
+        )
+
+
+def dedupe_lines(
+    name: AnyPath,
+    keep: Literal["first", "last"] = "first",
+    memory_limit: int = 64 * 1024 * 1024,
+    mode: Literal["t", "b", None] = None,
+    encoding: str | None = None,
+    errors: str | None = None,
+    backup: AnyPath | None = None,
+    backup_ext: AnyPath | None = None,
+) -> int:
+    """
+    Remove duplicate lines from a file in-place, keeping either the first or
+    the last occurrence of each line (according to ``keep``) and otherwise
+    preserving the order of the lines.  Returns the number of lines removed.
+
+    Lines are compared by 128-bit BLAKE2b fingerprints of their contents
+    (ignoring a trailing newline, so that an unterminated last line matches
+    the same line elsewhere in the file).  The file is read twice: once to
+    determine which lines to drop, and once to copy the remaining lines to the
+    output of an `InPlace` instance before the usual atomic commit.  Memory
+    use is bounded by ``memory_limit``: once more distinct fingerprints have
+    been seen than fit within it, the fingerprints are partitioned by their
+    leading bytes into temporary files next to the file, and each partition
+    (repartitioned further if necessary) is deduplicated separately.  The set
+    of dropped lines is kept as a bitmap in a sparse temporary file.
+
+    :raises ValueError: if ``keep`` is invalid or ``memory_limit`` is not
+        positive
+    :raises ConflictError: if the file grows while it is being read
+    """
+    if keep not in ("first", "last"):
+        raise ValueError(f"{keep!r}: invalid keep value")
+    if memory_limit <= 0:
+        raise ValueError("memory_limit must be positive")
+    capacity = max(1, memory_limit // DEDUPE_ENTRY_COST)
+    fp: InPlace[Any] = InPlace(
+        name,
+        mode,  # type: ignore[arg-type]
+        backup=backup,
+        backup_ext=backup_ext,
+        encoding=encoding,
+        errors=errors,
+    )
+    with fp:
+        newline: Any = b"\n" if mode == "b" else "\n"
+        size = os.fstat(fp.input.fileno()).st_size
+        with tempfile.TemporaryDirectory(
+            dir=os.path.dirname(fp._path), prefix="._in_place-"
+        ) as tmpdir:
+            # Every line is at least one byte long, so the file's size bounds
+            # the number of lines.
+            with open(os.path.join(tmpdir, "dropped"), "w+b") as bmfp:
+                bmfp.truncate(size // 8 + 1)
+                with mmap.mmap(bmfp.fileno(), size // 8 + 1) as bitmap:
+                    dedup = LineDeduper(bitmap, keep == "last", capacity, tmpdir)
+                    nlines = 0
+                    for line in fp:
+                        if nlines > size:
+                            raise ConflictError(fp._path)
+                        key = line[:-1] if line.endswith(newline) else line
+                        if isinstance(key, str):
+                            key = key.encode("utf-8", "surrogatepass")
+                        dedup.add(hashlib.blake2b(key, digest_size=16).digest(), nlines)
+                        nlines += 1
+                    dedup.finish()
+                    fp.input.seek(0)
+                    for i, kept in enumerate(islice(fp, nlines)):
+                        if not bitmap[i >> 3] & (1 << (i & 7)):
+                            fp.write(kept)
+                    return dedup.dropped
+
+
+#: Estimated number of bytes of memory used by each distinct line fingerprint
+#: held in memory by `dedupe_lines()`
+DEDUPE_ENTRY_COST = 128
+
+#: The number of partitions into which `LineDeduper` spills fingerprints
+DEDUPE_FANOUT = 256
+
+
+class LineDeduper:
+    """
+    Helper for `dedupe_lines()` that is fed line fingerprints and line
+    numbers in increasing order of line number and marks the line numbers of
+    duplicate lines in a bitmap.  The most recent line number for each
+    distinct fingerprint is kept in memory, up to ``capacity`` fingerprints;
+    beyond that, the fingerprints (and all subsequent input) are spilled into
+    `DEDUPE_FANOUT` files in ``tmpdir``, partitioned by byte ``depth`` of the
+    fingerprint, and :meth:`finish` then processes each partition with a new
+    `LineDeduper` one level deeper.
+    """
+
+    def __init__(
+        self,
+        bitmap: mmap.mmap,
+        keep_last: bool,
+        capacity: int,
+        tmpdir: str,
+        depth: int = 0,
+    ) -> None:
+        self.bitmap = bitmap
+        self.keep_last = keep_last
+        self.capacity = capacity
+        self.tmpdir = tmpdir
+        self.depth = depth
+        #: Mapping from fingerprints to the line numbers of the occurrences to
+        #: keep so far
+        self.seen: dict[bytes, int] = {}
+        #: The partition files, once spilled
+        self.parts: list[IO[bytes]] | None = None
+        #: The number of lines marked as duplicates
+        self.dropped = 0
+
+    def add(self, fingerprint: bytes, lineno: int) -> None:
+        if self.parts is not None:
+            self.parts[fingerprint[self.depth] % DEDUPE_FANOUT].write(
+                fingerprint + lineno.to_bytes(8, "little")
+            )
+            return
+        prev = self.seen.get(fingerprint)
+        if prev is None:
+            self.seen[fingerprint] = lineno
+            if len(self.seen) > self.capacity:
+                self._spill()
+        elif self.keep_last:
+            self._drop(prev)
+            self.seen[fingerprint] = lineno
+        else:
+            self._drop(lineno)
+
+    def _drop(self, lineno: int) -> None:
+        self.bitmap[lineno >> 3] |= 1 << (lineno & 7)
+        self.dropped += 1
+
+    def _spill(self) -> None:
+        self.parts = []
+        try:
+            for _ in range(DEDUPE_FANOUT):
+                fd, _ = tempfile.mkstemp(dir=self.tmpdir)
+                self.parts.append(open(fd, "w+b"))
+        except BaseException:
+            for part in self.parts:
+                part.close()
+            raise
+        seen, self.seen = self.seen, {}
+        for fingerprint, lineno in seen.items():
+            self.add(fingerprint, lineno)
+
+    def finish(self) -> None:
+        """Process the partitions, if any"""
+        if self.parts is None:
+            return
+        parts, self.parts = self.parts, None
+        for part in parts:
+            with part:
+                part.seek(0)
+                sub = LineDeduper(
+                    self.bitmap,
+                    self.keep_last,
+                    self.capacity,
+                    self.tmpdir,
+                    self.depth + 1,
+                )
+                while rec := part.read(24 * 4096):
+                    for i in range(0, len(rec), 24):
+                        sub.add(
+                            rec[i : i + 16],
+                            int.from_bytes(rec[i + 16 : i + 24], "little"),
+                        )
+                sub.finish()
+                self.dropped += sub.dropped
+                os.truncate(part.fileno(), 0)
+
+
+def apply_delta(
+    name: AnyPath,
+    delta: bytes | AnyPath | IO[bytes] | Iterable[tuple[Any, ...]],
+    backup: AnyPath | None = None,
+    backup_ext: AnyPath | None = None,
+    **kwargs: Any,
+) -> None:
+    """
+    Replace the contents of a file in-place with the result of applying a
+    delta to it.  A delta is a sequence of operations, each of which is
+    either ``("copy", offset, length)``, which copies ``length`` bytes
+    starting at byte ``offset`` of the original file to the output, or
+    ``("insert", data)``, which writes the literal bytes ``data``.
+
+    ``delta`` may be given as an iterable of such tuples, or in the binary
+    format produced by `encode_delta()`, either as a `bytes` object, as the
+    path to a file, or as a binary filehandle.  The delta is applied as a
+    stream, without reading the whole delta or either version of the file
+    into memory; copies are performed by the kernel directly from the
+    original file's descriptor where possible.  If the delta is invalid or
+    refers to bytes beyond the end of the original file, a `ValueError` is
+    raised and the file is left untouched.
+
+    :param kwargs: Additional keyword arguments to pass to `InPlace`
+    """
+    if isinstance(delta, (bytes, bytearray, memoryview)):
+        delta = io.BytesIO(delta)
+    if isinstance(delta, (str, os.PathLike)):
+        with open(delta, "rb") as fp:
+            apply_delta(name, fp, backup=backup, backup_ext=backup_ext, **kwargs)
+        return
+    with InPlace(name, "b", backup=backup, backup_ext=backup_ext, **kwargs) as out:
+        infd = out.input.fileno()
+        size = os.fstat(infd).st_size
+        ops: Iterator[tuple[Any, ...]]
+        if isinstance(delta, io.IOBase):
+            ops = read_delta(delta)
+        else:
+            ops = iter(delta)  # type: ignore[arg-type]
+        for op in ops:
+            if op[0] == "copy" and len(op) == 3:
+                _, offset, length = op
+                if not (
+                    isinstance(offset, int)
+                    and isinstance(length, int)
+                    and 0 <= offset
+                    and 0 <= length
+                    and offset + length <= size
+                ):
+                    raise ValueError(
+                        f"Invalid delta: copy of {length!r} bytes at offset"
+                        f" {offset!r} is out of bounds"
+                    )
+                if length:
+                    out.output.flush()
+                    copy = copy_sparse_range if out._sparse else copy_range
+                    copy(infd, out.output.fileno(), offset, length)
+                    out.output.seek(0, os.SEEK_END)
+            elif op[0] == "insert" and len(op) == 2:
+                out.write(op[1])
+            else:
+                raise ValueError(f"Invalid delta: unknown operation {op!r}")
+
+
+def encode_delta(ops: Iterable[tuple[Any, ...]]) -> bytes:
+    """
+    Serialize an iterable of delta operations (as accepted by `apply_delta()`)
+    in `apply_delta()`'s binary format: the magic bytes ``b"IPD1"``, followed
+    by each operation as a one-byte opcode (1 for copy, 2 for insert) and its
+    arguments as unsigned LEB128 integers (the offset and length for a copy;
+    the length, followed by the data itself, for an insert).
+    """
+    buf = bytearray(DELTA_MAGIC)
+    for op in ops:
+        if op[0] == "copy" and len(op) == 3:
+            buf.append(DELTA_COPY)
+            buf += encode_varint(op[1])
+            buf += encode_varint(op[2])
+        elif op[0] == "insert" and len(op) == 2:
+            buf.append(DELTA_INSERT)
+            buf += encode_varint(len(op[1]))
+            buf += op[1]
+        else:
+            raise ValueError(f"Invalid delta: unknown operation {op!r}")
+    return bytes(buf)
+
+
+#: Magic bytes at the start of a serialized delta
+DELTA_MAGIC = b"IPD1"
+
+#: Opcode for a copy operation in a serialized delta
+DELTA_COPY = 1
+
+#: Opcode for an insert operation in a serialized delta
+DELTA_INSERT = 2
+
+
+def read_delta(fp: IO[bytes]) -> Iterator[tuple[Any, ...]]:
+    """
+    Parse a delta serialized by `encode_delta()` from ``fp`` and yield its
+    operations.  Inserted data is yielded in pieces of at most `COPY_BUFSIZE`
+    bytes.
+    """
+    if fp.read(len(DELTA_MAGIC)) != DELTA_MAGIC:
+        raise ValueError("Invalid delta: bad magic number")
+    while opcode := fp.read(1):
+        if opcode[0] == DELTA_COPY:
+            offset = read_varint(fp)
+            yield ("copy", offset, read_varint(fp))
+        elif opcode[0] == DELTA_INSERT:
+            remaining = read_varint(fp)
+            while remaining:
+                data = fp.read(min(remaining, COPY_BUFSIZE))
+                if not data:
+                    raise ValueError("Invalid delta: truncated insert")
+                remaining -= len(data)
+                yield ("insert", data)
+        else:
+            raise ValueError(f"Invalid delta: unknown opcode {opcode[0]}")
+
+
+def encode_varint(n: int) -> bytes:
+    """Encode a nonnegative integer as unsigned LEB128"""
+    if n < 0:
+        raise ValueError("Invalid delta: negative integer")
+    buf = bytearray()
+    while n >= 0x80:
+        buf.append((n & 0x7F) | 0x80)
+        n >>= 7
+    buf.append(n)
+    return bytes(buf)
+
+
+def read_varint(fp: IO[bytes]) -> int:
+    """Read an unsigned LEB128 integer from ``fp``"""
+    n = shift = 0
+    while True:
+        b = fp.read(1)
+        if not b:
+            raise ValueError("Invalid delta: truncated integer")
+        n |= (b[0] & 0x7F) << shift
+        if b[0] < 0x80:
+            return n
+        shift += 7
+
+
+def load_json(data: bytes) -> Any:
+    """Parse JSON with ``orjson`` if it's installed or with `json` otherwise"""
+    try:
+        import orjson  # type: ignore[import-not-found]
+    except ImportError:
+        return json.loads(data)
+    else:
+        return orjson.loads(data)
+
+
+def dump_json(doc: Any, indent: int | None, sort_keys: bool) -> bytes:
+    """
+    Serialize ``doc`` to UTF-8 JSON with ``orjson`` if it's installed and
+    supports the requested ``indent``, or with `json` otherwise
+    """
+    if indent in (None, 2):
+        try:
+            import orjson
+        except ImportError:
+            pass
+        else:
+            opts = 0
+            if indent == 2:
+                opts |= orjson.OPT_INDENT_2
+            if sort_keys:
+                opts |= orjson.OPT_SORT_KEYS
+            bs = orjson.dumps(doc, option=opts)
+            assert isinstance(bs, bytes)
+            return bs
+    return json.dumps(
+        doc,
+        ensure_ascii=False,
+        indent=indent,
+        separators=(",", ":") if indent is None else (",", ": "),
+        sort_keys=sort_keys,
+    ).encode("utf-8")
+
+
+def toml_backend() -> (
+    tuple[Callable[[str], dict[str, Any]], Callable[[dict[str, Any]], str]]
+):
+    """
+    Return a pair of the functions to use for parsing & serializing TOML
+
+    :raises ImportError: if no TOML serializer is installed
+    """
+    try:
+        import rtoml  # type: ignore[import-not-found]
+    except ImportError:
+        pass
+    else:
+        return (rtoml.loads, rtoml.dumps)
+    try:
+        import tomli_w
+    except ImportError:
+        raise ImportError(
+            "Writing TOML requires rtoml or tomli-w to be installed"
+        ) from None
+    if sys.version_info >= (3, 11):
+        import tomllib
+    else:
+        import tomli as tomllib
+    return (tomllib.loads, tomli_w.dumps)
+
+
+def ascii_compatible(encoding: str) -> str | None:
+    """
+    If ``encoding`` is UTF-8 or another stateless encoding in which ASCII
+    characters (in particular, ``"\\n"``) are always encoded as single bytes
+    that occur nowhere else, return its normalized name; otherwise, return
+    `None`
+    """
+    name = codecs.lookup(encoding).name
+    if name in ("utf-8", "ascii") or name.startswith(("iso8859-", "latin-", "cp125")):
+        return name
+    return None
+
+
+def map_line(func: Callable[[Any], Any], contains: Any, line: Any) -> Any:
+    """
+    Return ``func(line)``, or ``line`` if ``func`` returns `None` or if
+    ``contains`` is not `None` and does not occur in ``line``
+    """
+    if contains is None or contains in line:
+        new = func(line)
+        if new is not None:
+            return new
+    return line
+
+
+#: The maximum number of lines from each file that `diff_lines()` holds in
+#: memory at once
+DIFF_WINDOW = 1000
+
+
+def diff_lines(
+    a: Iterable[T], b: Iterable[T], window: int = DIFF_WINDOW
+) -> Iterator[tuple[str, T]]:
+    """
+    Compare two iterables of lines and yield ``(tag, line)`` pairs that turn
+    ``a`` into ``b``, where ``tag`` is ``" "`` for a line common to both,
+    ``"-"`` for a line only in ``a``, and ``"+"`` for a line only in ``b``.
+    The iterables are consumed lazily, with at most ``window`` lines from each
+    held at a time; each run of differing lines is matched up with
+    `difflib.SequenceMatcher` within the lines currently held, and the last
+    difference in the window is deferred until more lines have been read so
+    that it is not cut off at the edge of the window.
+    """
+    from difflib import SequenceMatcher
+
+    ait = iter(a)
+    bit = iter(b)
+    abuf: list[T] = []
+    bbuf: list[T] = []
+    while True:
+        abuf.extend(islice(ait, window - len(abuf)))
+        bbuf.extend(islice(bit, window - len(bbuf)))
+        if not abuf and not bbuf:
+            return
+        k = 0
+        n = min(len(abuf), len(bbuf))
+        while k < n and abuf[k] == bbuf[k]:
+            k += 1
+        if k:
+            for line in abuf[:k]:
+                yield (" ", line)
+            del abuf[:k], bbuf[:k]
+            continue
+        ops = SequenceMatcher(None, abuf, bbuf, autojunk=False).get_opcodes()
+        if len(abuf) == window or len(bbuf) == window:
+            # The input may not be exhausted yet, so hold back the last
+            # difference (and anything after it) unless it's the only one.
+            last = max(i for i, op in enumerate(ops) if op[0] != "equal")
+            if last > 0:
+                ops = ops[:last]
+            else:
+                ops = ops[:1]
+        for tag, i1, i2, j1, j2 in ops:
+            if tag == "equal":
+                for line in abuf[i1:i2]:
+                    yield (" ", line)
+            else:
+                for line in abuf[i1:i2]:
+                    yield ("-", line)
+                for line in bbuf[j1:j2]:
+                    yield ("+", line)
+        _, _, i2, _, j2 = ops[-1]
+        del abuf[:i2], bbuf[:j2]
+
+
+def write_unified_diff(
+    events: Iterable[tuple[str, Any]],
+    out: IO[Any] | None,
+    name: str,
+    binary: bool,
+    context: int = 3,
+) -> tuple[int, int]:
+    """
+    Given the output of `diff_lines()`, write a unified diff with ``context``
+    lines of context to ``out`` (if not `None`), labelling both sides with
+    ``name``, and return the numbers of removed and added lines.  Lines (and
+    the diff) are `bytes` if ``binary`` is true and `str` otherwise.
+    """
+    removed = added = 0
+    if out is None:
+        for tag, _ in events:
+            if tag == "-":
+                removed += 1
+            elif tag == "+":
+                added += 1
+        return (removed, added)
+
+    def emit(s: str) -> None:
+        assert out is not None
+        out.write(os.fsencode(s) if binary else s)
+
+    endings: tuple[Any, ...] = (b"\n", b"\r") if binary else ("\n", "\r")
+    started = False
+
+    def flush(lines: list[tuple[str, Any]], astart: int, bstart: int) -> None:
+        nonlocal started
+        if not started:
+            emit(f"--- {name}\n+++ {name}\n")
+            started = True
+        alen = sum(1 for tag, _ in lines if tag != "+")
+        blen = sum(1 for tag, _ in lines if tag != "-")
+        emit(f"@@ -{unified_range(astart, alen)} +{unified_range(bstart, blen)} @@\n")
+        for tag, line in lines:
+            emit(tag)
+            out.write(line)
+            if not line.endswith(endings):
+                emit("\n\\ No newline at end of file\n")
+
+    # Line numbers (zero-based) of the next line of each file:
+    ano = bno = 0
+    before: deque[tuple[str, Any]] = deque(maxlen=context)
+    hunk: list[tuple[str, Any]] | None = None
+    hstart = (0, 0)
+    tail: list[tuple[str, Any]] = []
+    for tag, line in events:
+        if tag == " ":
+            ano += 1
+            bno += 1
+            if hunk is None:
+                before.append((tag, line))
+            else:
+                tail.append((tag, line))
+                if len(tail) > 2 * context:
+                    flush(hunk + tail[:context], *hstart)
+                    before.extend(tail[context:])
+                    hunk = None
+                    tail = []
+            continue
+        if hunk is None:
+            hstart = (ano - len(before), bno - len(before))
+            hunk = list(before)
+            before.clear()
+        else:
+            hunk.extend(tail)
+            tail = []
+        hunk.append((tag, line))
+        if tag == "-":
+            ano += 1
+            removed += 1
+        else:
+            bno += 1
+            added += 1
+    if hunk is not None:
+        flush(hunk + tail[:context], *hstart)
+    return (removed, added)
+
+
+def unified_range(start: int, length: int) -> str:
+    """
+    Format a zero-based starting line number and a line count as a range in a
+    unified diff hunk header
+    """
+    if length == 1:
+        return str(start + 1)
+    if length == 0:
+        return f"{start},0"
+    return f"{start + 1},{length}"
+
+
+def commit_all(
+    moves: list[tuple[str, str, str | None]], fsync: bool = False
+) -> list[int]:
+    """
+    Given a list of ``(tmppath, path, backuppath)`` triples, replace each
+    ``path`` with its ``tmppath`` and, if ``backuppath`` is not `None`, save
+    the original file at ``backuppath``.  Either all of the files are replaced
+    or, if an error occurs, none of them are.
+
+    If a ``backuppath`` is on a different filesystem from its ``path``, the
+    original file is not saved there; instead, the indices of all such moves
+    are returned so that the caller can copy the originals to their backup
+    paths.
+
+    Before anything is replaced, each original file is hard-linked to a
+    temporary name (in the directory of its backup path, if any), so that the
+    replacements themselves can be done in a single tight loop of
+    `os.replace()` calls and so that each original can be restored if a later
+    replacement fails.  On filesystems that do not support hard links, the
+    originals are instead renamed out of the way just before being replaced.
+    The originals are only moved onto their backup paths once every file has
+    been replaced, so that a failure leaves any existing backups untouched;
+    if an original then cannot be moved onto its backup path, it is left at
+    its temporary name, and the error is raised after the remaining backups
+    are made.  If ``fsync`` is true, each affected directory is synced once at
+    the end.
+    """
+    # For each move, the path at which the original file is kept (or `None`
+    # if not yet set aside) and whether it is a hard link:
+    aside: list[str | None] = []
+    linked: list[bool] = []
+    replaced = 0
+    try:
+        for _, path, backuppath in moves:
+            link = link_aside(path, os.path.dirname(backuppath or path))
+            aside.append(link)
+            linked.append(link is not None)
+        for i, (tmppath, path, _) in enumerate(moves):
+            if aside[i] is None:
+                dest = unique_path(os.path.dirname(path))
+                os.replace(path, dest)
+                aside[i] = dest
+            os.replace(tmppath, path)
+            replaced += 1
+    except BaseException:
+        for i in reversed(range(len(aside))):
+            a = aside[i]
+            if a is not None:
+                with suppress(OSError):
+                    if i < replaced or not linked[i]:
+                        os.replace(a, moves[i][1])
+                    else:
+                        os.unlink(a)
+        for tmppath, _, _ in moves:
+            with suppress(OSError):
+                os.unlink(tmppath)
+        raise
+    deferred: list[int] = []
+    error: OSError | None = None
+    for i, (a, (_, _, backuppath)) in enumerate(zip(aside, moves)):
+        assert a is not None
+        if backuppath is None:
+            try_unlink(a)
+            continue
+        try:
+            os.replace(a, backuppath)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                # Leave the original where it is rather than lose it.
+                error = error or e
+                continue
+            deferred.append(i)
+            try_unlink(a)
+    if fsync:
+        dirs = [os.path.dirname(path) for _, path, _ in moves]
+        dirs.extend(os.path.dirname(b) for _, _, b in moves if b is not None)
+        for d in dict.fromkeys(dirs):
+            fsync_dir(d)
+    if error is not None:
+        raise error
+    return deferred
+
+
+#: The maximum number of backups copied to other filesystems at once
+BACKUP_COPY_WORKERS = 4
+
+#: Lock guarding `_backup_pool` and `_backup_copies`
+_backup_lock = threading.Lock()
+
+#: The thread pool in which backups are copied to other filesystems, created
+#: on first use
+_backup_pool: ThreadPoolExecutor | None = None
+
+#: Background backup copies that are still running or that failed and have
+#: not yet been reported by `wait_for_backups()`
+_backup_copies: set[Future[None]] = set()
+
+
+def copy_backup_later(src_fd: int, dest: str) -> None:
+    """
+    Start copying the file open on ``src_fd`` to ``dest`` in a background
+    thread.  ``src_fd`` is closed once the copy is done (or fails).
+    """
+    global _backup_pool
+    try:
+        with _backup_lock:
+            if _backup_pool is None:
+                from concurrent.futures import ThreadPoolExecutor
+
+                _backup_pool = ThreadPoolExecutor(
+                    BACKUP_COPY_WORKERS, thread_name_prefix="in_place-backup"
+                )
+            fut = _backup_pool.submit(copy_backup, src_fd, dest)
+            _backup_copies.add(fut)
+    except BaseException:
+        os.close(src_fd)
+        raise
+    # Registered outside the lock, as the callback runs immediately (in this
+    # thread) if the copy has already finished:
+    fut.add_done_callback(_forget_backup)
+
+
+def _forget_backup(fut: Future[None]) -> None:
+    """
+    Drop a successfully-finished backup copy from `_backup_copies`.  Failed
+    copies are kept so that `wait_for_backups()` can report them.
+    """
+    if not fut.cancelled() and fut.exception() is None:
+        with _backup_lock:
+            _backup_copies.discard(fut)
+
+
+def copy_backup(src_fd: int, dest: str) -> None:
+    """
+    Copy the entire file open on ``src_fd`` (along with its stat info) to
+    ``dest`` via a temporary file in the same directory, so that ``dest`` is
+    created atomically, and then close ``src_fd``
+    """
+    try:
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dest), prefix="._in_place-")
+        try:
+            try:
+                copy_range(src_fd, fd, 0, os.fstat(src_fd).st_size)
+                copystats_fd(src_fd, fd)
+            finally:
+                os.close(fd)
+            os.replace(tmp, dest)
+        finally:
+            try_unlink(tmp)
+    finally:
+        os.close(src_fd)
+
+
+def wait_for_backups(timeout: float | None = None) -> None:
+    """
+    Wait for all backups currently being copied to other filesystems in the
+    background to finish.  If any of the copies failed, the first error is
+    raised (after all of the copies have finished).
+
+    :param timeout: The maximum number of seconds to wait; if `None` (the
+        default), wait indefinitely
+    :type timeout: float
+    :raises TimeoutError: if the copies did not all finish in time
+    """
+    from concurrent.futures import wait
+
+    with _backup_lock:
+        pending = list(_backup_copies)
+    done, not_done = wait(pending, timeout)
+    with _backup_lock:
+        _backup_copies.difference_update(done)
+    if not_done:
+        raise TimeoutError(f"{len(not_done)} backup copies still in progress")
+    for fut in done:
+        fut.result()
+
+
+def link_aside(path: str, dirpath: str) -> str | None:
+    """
+    Create a hard link to ``path`` with a new random name in ``dirpath`` and
+    return the path to the link.  If a hard link cannot be created (e.g.,
+    because ``dirpath`` is on a different filesystem), return `None`.
+    """
+    try:
+        return hardlink(path, dirpath)
+    except OSError as e:
+        if e.errno in _NO_HARD_LINKS:
+            return None
+        raise
+
+
+def hardlink(
+    path: str,
+    dirpath: str,
+    src_dir_fd: int | None = None,
+    dst_dir_fd: int | None = None,
+) -> str:
+    """
+    Create a hard link to ``path`` with a new random name in ``dirpath`` and
+    return the path to the link.  If a directory file descriptor is given for
+    a path, only the path's basename is used, relative to the descriptor.
+    """
+    if src_dir_fd is not None:
+        path = os.path.basename(path)
+    while True:
+        basename = random_basename()
+        link = os.path.join(dirpath, basename)
+        try:
+            if src_dir_fd is None and dst_dir_fd is None:
+                os.link(path, link)
+            else:
+                os.link(
+                    path,
+                    link if dst_dir_fd is None else basename,
+                    src_dir_fd=src_dir_fd,
+                    dst_dir_fd=dst_dir_fd,
+                )
+        except FileExistsError:
+            continue
+        return link
+
+
+def link_or_copy(
+    path: str,
+    dest: str,
+    src_dir_fd: int | None = None,
+    dst_dir_fd: int | None = None,
+) -> None:
+    """
+    Make ``dest`` a hard link to ``path``, replacing any file already at
+    ``dest``.  If a hard link cannot be created (e.g., because ``dest`` is on a
+    different filesystem), make ``dest`` a copy of ``path`` (with its stat
+    info) instead.  In either case, ``dest`` is created atomically.  If a
+    directory file descriptor is given for a path, only the path's basename
+    is used, relative to the descriptor.
+    """
+    destdir = os.path.dirname(dest)
+    try:
+        tmp = hardlink(path, destdir, src_dir_fd, dst_dir_fd)
+    except OSError as e:
+        if e.errno not in _NO_HARD_LINKS:
+            raise
+        tmp = copy_aside(path, destdir, src_dir_fd, dst_dir_fd)
+    try:
+        replace_at(tmp, dest, dst_dir_fd, dst_dir_fd)
+    except BaseException:
+        try_unlink(tmp, dst_dir_fd)
+        raise
+
+
+def copy_aside(
+    path: str,
+    dirpath: str,
+    src_dir_fd: int | None = None,
+    dst_dir_fd: int | None = None,
+) -> str:
+    """
+    Copy the file at ``path`` (along with its stat info) to a new random name
+    in ``dirpath`` and return the path to the copy.  If a directory file
+    descriptor is given for a path, only the path's basename is used, relative
+    to the descriptor.
+    """
+    src_fd = os.open(
+        path if src_dir_fd is None else os.path.basename(path),
+        os.O_RDONLY | getattr(os, "O_CLOEXEC", 0),
+        dir_fd=src_dir_fd,
+    )
+    try:
+        while True:
+            basename = random_basename()
+            tmp = os.path.join(dirpath, basename)
+            try:
+                fd = os.open(
+                    tmp if dst_dir_fd is None else basename,
+                    os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_CLOEXEC", 0),
+                    0o600,
+                    dir_fd=dst_dir_fd,
+                )
+            except FileExistsError:
+                continue
+            break
+        try:
+            try:
+                copy_range(src_fd, fd, 0, os.fstat(src_fd).st_size)
+                copystats_fd(src_fd, fd)
+            finally:
+                os.close(fd)
+        except BaseException:
+            try_unlink(tmp, dst_dir_fd)
+            raise
+    finally:
+        os.close(src_fd)
+    return tmp
+
+
+#: Errors from `os.link()` indicating that hard links are not supported
+_NO_HARD_LINKS = frozenset(
+    getattr(errno, name)
+    for name in ("EPERM", "EXDEV", "EMLINK", "EOPNOTSUPP", "ENOTSUP", "ENOSYS")
+    if hasattr(errno, name)
+)
+
+
+def unique_path(dirpath: str) -> str:
+    """
+    Return a path in ``dirpath`` with a random name that does not currently
+    exist.  (Note that nothing prevents the path from being created by
+    something else before it is used.)
+    """
+    while True:
+        path = os.path.join(dirpath, random_basename())
+        if not os.path.lexists(path):
+            return path
+
+
+def random_basename() -> str:
+    """Return a random name for a temporary file"""
+    return f"._in_place-{secrets.token_hex(8)}"
+
+
+def fsync_dir(dirpath: str) -> None:
+    """
+    Flush the directory entries of ``dirpath`` to disk.  Does nothing on
+    platforms where directories cannot be opened.
+    """
+    try:
+        fd = os.open(dirpath, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def acquire_lock(
+    path: str, dir_fd: int | None, exclusive: bool, timeout: float | None
+) -> tuple[int, float]:
+    """
+    Open (creating if necessary) the lock file at ``path`` and lock it with
+    `fcntl.flock()`, waiting at most ``timeout`` seconds (or indefinitely if
+    `None`).  Returns a pair of the file descriptor holding the lock and the
+    number of seconds spent waiting for it.  The platform must support
+    `fcntl`.
+
+    :raises TimeoutError: if the lock could not be acquired in time
+    """
+    import fcntl
+
+    if dir_fd is not None:
+        path = os.path.basename(path)
+    fd = os.open(
+        path,
+        os.O_RDWR | os.O_CREAT | getattr(os, "O_CLOEXEC", 0),
+        0o666,
+        dir_fd=dir_fd,
+    )
+    op = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+    start = time.monotonic()
+    try:
+        if timeout is None:
+            fcntl.flock(fd, op)
+        else:
+            delay = 0.001
+            while True:
+                try:
+                    fcntl.flock(fd, op | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    remaining = timeout - (time.monotonic() - start)
+                    if remaining <= 0:
+                        raise TimeoutError(
+                            f"Timed out waiting for lock on {path}"
+                        ) from None
+                    time.sleep(min(delay, remaining))
+                    delay = min(delay * 2, 0.1)
+                else:
+                    break
+    except BaseException:
+        os.close(fd)
+        raise
+    return (fd, time.monotonic() - start)
+
+
+def store_blob(path: str, store: str, digest: str, dir_fd: int | None = None) -> str:
+    """
+    Save the contents of the file at ``path`` in the content-addressed store
+    at ``store`` under the hex digest ``digest``, unless a blob with that
+    digest is already present, and return the path to the blob.  The blob is
+    created as a hard link to ``path`` if possible and as a copy otherwise.
+    If ``dir_fd`` is given, ``path`` is looked up by its basename relative to
+    it; the store itself is always accessed by path.
+    """
+    blobdir = os.path.join(store, digest[:2])
+    blob = os.path.join(blobdir, digest)
+    if os.path.exists(blob):
+        return blob
+    os.makedirs(blobdir, exist_ok=True)
+    link_or_copy(path, blob, src_dir_fd=dir_fd)
+    return blob
+
+
+def record_blob(store: str, path: str, digest: str, size: int) -> None:
+    """
+    Append an entry to the manifest of the content-addressed store at
+    ``store`` recording that the original contents of ``path`` as of now are
+    stored under ``digest``
+    """
+    entry = {
+        "path": path,
+        "time": datetime.now(timezone.utc).isoformat(),
+        "sha256": digest,
+        "size": size,
+    }
+    line = (json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8")
+    fd = os.open(
+        os.path.join(store, "manifest.jsonl"),
+        os.O_WRONLY | os.O_CREAT | os.O_APPEND | getattr(os, "O_CLOEXEC", 0),
+        0o666,
+    )
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+
+def next_backup_number(path: str, dir_fd: int | None = None) -> tuple[int, list[int]]:
+    """
+    Return the number of the next numbered backup of ``path`` along with the
+    numbers of the existing numbered backups, if known.  The number is read
+    from the counter file written by `write_backup_counter()`, in which case
+    the list is empty; if that file is missing or invalid, the directory is
+    scanned for existing numbered backups (made by ``in_place`` or by GNU
+    tools) instead, and the list holds the numbers found.  If ``dir_fd`` is
+    given, the directory is accessed through it rather than by path.
+    """
+    try:
+        with open_at(backup_counter_path(path), "rb", dir_fd) as fp:
+            n = int(fp.read())
+    except (OSError, ValueError):
+        pass
+    else:
+        if n > 0:
+            return (n, [])
+    dirpath, basename = os.path.split(path)
+    rgx = re.compile(re.escape(basename) + r"\.~([0-9]+)~")
+    found: list[int] = []
+    with os.scandir(dirpath if dir_fd is None else dir_fd) as entries:
+        for entry in entries:
+            if m := rgx.fullmatch(entry.name):
+                found.append(int(m[1]))
+    return (max(found, default=0) + 1, found)
+
+
+def write_backup_counter(path: str, n: int, dir_fd: int | None = None) -> None:
+    """
+    Record ``n`` as the number of the next numbered backup of ``path``.  If
+    ``dir_fd`` is given, the counter file is created relative to it.
+    """
+    counter = backup_counter_path(path)
+    fd = os.open(
+        counter if dir_fd is None else os.path.basename(counter),
+        os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_CLOEXEC", 0),
+        0o666,
+        dir_fd=dir_fd,
+    )
+    try:
+        os.write(fd, f"{n}\n".encode("us-ascii"))
+    finally:
+        os.close(fd)
+
+
+def backup_counter_path(path: str) -> str:
+    """
+    Return the path to the file recording the number of the next numbered
+    backup of ``path``
+    """
+    dirpath, basename = os.path.split(path)
+    return os.path.join(dirpath, f".{basename}.~next~")
+
+
+def resume_paths(path: str) -> tuple[str, str]:
+    """
+    Return the paths to the temporary file and the checkpoint file for a
+    resumable edit of ``path``
+    """
+    dirpath, basename = os.path.split(path)
+    tmppath = os.path.join(dirpath, f"._in_place-resume-{basename}")
+    return (tmppath, tmppath + ".json")
+
+
+def read_checkpoint(path: str, dir_fd: int | None = None) -> dict[str, Any] | None:
+    """
+    Read the checkpoint file at ``path`` (relative to ``dir_fd``, if given)
+    and return its contents, or `None` if it is missing or invalid
+    """
+    try:
+        with open_at(path, "rb", dir_fd) as fp:
+            ckpt = json.load(fp)
+    except (OSError, ValueError):
+        return None
+    if not (
+        isinstance(ckpt, dict)
+        and isinstance(ckpt.get("input"), str)
+        and isinstance(ckpt.get("input_offset"), int)
+        and isinstance(ckpt.get("output_length"), int)
+    ):
+        return None
+    ckpt.setdefault("state", None)
+    return ckpt
+
+
+def write_checkpoint(
+    path: str, ckpt: dict[str, Any], dir_fd: int | None = None
+) -> None:
+    """
+    Atomically replace the checkpoint file at ``path`` (relative to
+    ``dir_fd``, if given) with ``ckpt``, syncing it to disk first
+    """
+    data = json.dumps(ckpt).encode("utf-8")
+    newpath = path + ".new"
+    fd = os.open(
+        newpath if dir_fd is None else os.path.basename(newpath),
+        os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_CLOEXEC", 0),
+        0o600,
+        dir_fd=dir_fd,
+    )
+    try:
+        try:
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view) :]
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        replace_at(newpath, path, dir_fd, dir_fd)
+    finally:
+        try_unlink(newpath, dir_fd)
+
+
+def file_id(st: os.stat_result) -> tuple[int, int, int, int]:
+    """
+    Return a tuple of the device, inode, size, and modification time in a
+    file's stat info, for detecting whether a file has changed
+    """
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def file_stamp(st: os.stat_result) -> str:
+    """
+    Return `file_id()` of a file's stat info as a string for storing in an
+    `EditCache` or a checkpoint.  (Inode numbers can exceed the range of
+    SQLite integers.)
+    """
+    return ":".join(map(str, file_id(st)))
+
+
+def copystats(from_file: str, to_file: str) -> None:
+    """
+    Copy stat info from ``from_file`` to ``to_file`` using `shutil.copystat`.
+    If possible, also copy the user and/or group ownership information.
+    """
+    shutil.copystat(from_file, to_file)
+    if hasattr(os, "chown"):
+        st = os.stat(from_file)
+        # Based on GNU sed's behavior:
+        try:
+            os.chown(to_file, st.st_uid, st.st_gid)
+        except OSError:
+            try:
+                os.chown(to_file, -1, st.st_gid)
+            except OSError:
+                pass
+
+
+def index_lines(fd: int) -> array[int]:
+    """
+    Scan the file open on ``fd`` for ``b"\\n"`` bytes and return an
+    `array.array` containing the offset at which each line begins followed by
+    the size of the file.  The scan is done over a memory map of the file.
+    """
+    size = os.fstat(fd).st_size
+    if size == 0:
+        return array("q", [0])
+    with mmap.mmap(fd, size, access=mmap.ACCESS_READ) as mm:
+        return scan_lines(mm)
+
+
+#: The number of bytes scanned at a time by `scan_lines()` when using NumPy
+SCAN_WINDOW = 64 * 1024 * 1024
+
+
+def scan_lines(buf: bytes | mmap.mmap) -> array[int]:
+    """
+    Return an `array.array` containing the offset within ``buf`` at which each
+    ``b"\\n"``-terminated line begins followed by ``len(buf)``.  The scan is
+    vectorized with NumPy if it is available (in windows of `SCAN_WINDOW`
+    bytes, to bound memory use); otherwise, it is done with repeated calls to
+    ``buf.find()``.
+    """
+    offsets = array("q", [0])
+    try:
+        import numpy as np  # type: ignore[import-not-found]
+    except ImportError:
+        i = buf.find(b"\n")
+        while i != -1:
+            offsets.append(i + 1)
+            i = buf.find(b"\n", i + 1)
+    else:
+        if len(buf):
+            view = np.frombuffer(buf, dtype=np.uint8)
+            # Scan in windows so that the temporary arrays stay small no
+            # matter how big the file is.
+            for start in range(0, len(buf), SCAN_WINDOW):
+                window = view[start : start + SCAN_WINDOW]
+                offsets.frombytes(
+                    (np.flatnonzero(window == 0x0A) + start + 1)
+                    .astype(np.int64)
+                    .tobytes()
+                )
+                del window
+            del view
+    if offsets[-1] != len(buf):
+        offsets.append(len(buf))
+    return offsets
+
+
+def copy_range(src_fd: int, dst_fd: int, offset: int, count: int) -> None:
+    """
+    Copy ``count`` bytes starting at offset ``offset`` of ``src_fd`` to the
+    current position of ``dst_fd``, advancing the latter.  The position of
+    ``src_fd`` is unspecified afterwards.  The copy is done in the kernel with
+    `os.copy_file_range` or `os.sendfile` when possible, falling back to
+    ordinary reads & writes.
+    """
+    end = offset + count
+    if hasattr(os, "copy_file_range"):
+        try:
+            while offset < end:
+                n = os.copy_file_range(src_fd, dst_fd, end - offset, offset)
+                if n == 0:
+                    return
+                offset += n
+        except OSError as e:
+            if e.errno not in _NO_KERNEL_COPY:
+                raise
+    if hasattr(os, "sendfile"):
+        try:
+            while offset < end:
+                n = os.sendfile(dst_fd, src_fd, offset, end - offset)
+                if n == 0:
+                    return
+                offset += n
+        except OSError as e:
+            if e.errno not in _NO_KERNEL_COPY:
+                raise
+    while offset < end:
+        if hasattr(os, "pread"):
+            bs = os.pread(src_fd, min(end - offset, COPY_BUFSIZE), offset)
+        else:
+            os.lseek(src_fd, offset, os.SEEK_SET)
+            bs = os.read(src_fd, min(end - offset, COPY_BUFSIZE))
+        if not bs:
+            return
+        view = memoryview(bs)
+        while view:
+            view = view[os.write(dst_fd, view) :]
+        offset += len(bs)
+
+
+def copy_sparse_range(src_fd: int, dst_fd: int, offset: int, count: int) -> None:
+    """
+    Like `copy_range()`, but copy only the data regions of ``src_fd`` (as
+    found with ``SEEK_DATA`` & ``SEEK_HOLE``) and seek over any holes in
+    ``dst_fd`` instead of writing zeros, so that the holes are preserved.
+    Falls back to `copy_range()` if holes cannot be detected.
+    """
+    end = offset + count
+    if not hasattr(os, "SEEK_DATA"):
+        copy_range(src_fd, dst_fd, offset, count)
+        return
+    pos = offset
+    hole = False
+    while pos < end:
+        try:
+            data = os.lseek(src_fd, pos, os.SEEK_DATA)
+        except OSError as e:
+            if e.errno == errno.ENXIO:
+                # There's no data between `pos` and the end of the file.
+                data = end
+            elif e.errno in _NO_SEEK_HOLE:
+                copy_range(src_fd, dst_fd, pos, end - pos)
+                return
+            else:
+                raise
+        data = min(data, end)
+        if data > pos:
+            os.lseek(dst_fd, data - pos, os.SEEK_CUR)
+            pos = data
+            hole = True
+        if pos >= end:
+            break
+        nexthole = min(os.lseek(src_fd, pos, os.SEEK_HOLE), end)
+        copy_range(src_fd, dst_fd, pos, nexthole - pos)
+        pos = nexthole
+        hole = False
+    if hole:
+        extend_to(dst_fd, os.lseek(dst_fd, 0, os.SEEK_CUR))
+
+
+#: Errors from `os.lseek` indicating that ``SEEK_DATA`` & ``SEEK_HOLE`` are not
+#: supported
+_NO_SEEK_HOLE = frozenset(
+    getattr(errno, name)
+    for name in ("EINVAL", "ENOTSUP", "EOPNOTSUPP")
+    if hasattr(errno, name)
+)
+
+#: Errors from `os.copy_file_range` and `os.sendfile` indicating that the
+#: kernel cannot copy between the given file descriptors
+_NO_KERNEL_COPY = frozenset(
+    getattr(errno, name)
+    for name in ("EXDEV", "ENOSYS", "EINVAL", "EOPNOTSUPP", "ENOTSUP", "EBADF")
+    if hasattr(errno, name)
+)
+
+#: Size of the chunks in which `copy_range` copies data when it can't use the
+#: kernel
+COPY_BUFSIZE = 1024 * 1024
+
+
+def copystats_fd(src_fd: int, dst_fd: int) -> None:
+    """
+    Copy the permission bits, access & modification times, extended
+    attributes, and (if possible) user and/or group ownership of the file open
+    on ``src_fd`` to the file open on ``dst_fd``, without looking up either
+    file by path
+    """
+    st = os.fstat(src_fd)
+    os.utime(dst_fd, ns=(st.st_atime_ns, st.st_mtime_ns))
+    if hasattr(os, "listxattr"):
+        try:
+            names = os.listxattr(src_fd)
+        except OSError as e:
+            if e.errno not in _NO_XATTRS:
+                raise
+            names = []
+        for xname in names:
+            try:
+                os.setxattr(dst_fd, xname, os.getxattr(src_fd, xname))
+            except OSError as e:
+                if e.errno not in _NO_XATTRS:
+                    raise
+    os.chmod(dst_fd, stat.S_IMODE(st.st_mode))
+    if hasattr(os, "fchown"):
+        # Based on GNU sed's behavior:
+        try:
+            os.fchown(dst_fd, st.st_uid, st.st_gid)
+        except OSError:
+            try:
+                os.fchown(dst_fd, -1, st.st_gid)
+            except OSError:
+                pass
+
+
+#: Errors from the `os` xattr functions that `shutil.copystat` ignores
+_NO_XATTRS = frozenset(
+    getattr(errno, name)
+    for name in ("EPERM", "ENOTSUP", "ENODATA", "EINVAL", "EACCES")
+    if hasattr(errno, name)
+)
+
+
+def replace_at(
+    src: str, dst: str, src_dir_fd: int | None, dst_dir_fd: int | None
+) -> None:
+    """
+    Move ``src`` to ``dst`` with `os.replace()`.  If a directory file
+    descriptor is given for a path, only the path's basename is used, relative
+    to the descriptor.
+    """
+    if src_dir_fd is not None:
+        src = os.path.basename(src)
+    if dst_dir_fd is not None:
+        dst = os.path.basename(dst)
+    os.replace(src, dst, src_dir_fd=src_dir_fd, dst_dir_fd=dst_dir_fd)
+
+
+def open_at(path: str, mode: str, dir_fd: int | None) -> IO[Any]:
+    """
+    Open ``path`` with `open()`.  If ``dir_fd`` is not `None`, only the path's
+    basename is used, relative to the descriptor.
+    """
+    if dir_fd is None:
+        return open(path, mode)
+
+    def opener(p: str, flags: int) -> int:
+        return os.open(p, flags, dir_fd=dir_fd)
+
+    return open(os.path.basename(path), mode, opener=opener)
 
 
-def try_unlink(path: str) -> None:
+def try_unlink(path: str, dir_fd: int | None = None) -> None:
     """
-    Try to delete the file at ``path``.  If the file doesn't exist, do nothing;
-    any other errors are propagated to the caller.
+    Try to delete the file at ``path`` (or, if ``dir_fd`` is given, the file
+    with the basename of ``path`` in the directory open on ``dir_fd``).  If
+    the file doesn't exist, do nothing; any other errors are propagated to the
+    caller.
     """
+    if dir_fd is not None:
+        path = os.path.basename(path)
     try:
-        os.unlink(path)
+        os.unlink(path, dir_fd=dir_fd)
     except FileNotFoundError:
         pass
@@ -0,0 +1,77 @@
+from __future__ import annotations
+import errno
+import os
+from pathlib import Path
+from typing import Any
+import pytest
+from in_place import InPlace
+from test_in_place_util import TEXT, pylistdir
+
+
+@pytest.mark.parametrize("backup_method", ["rename", "link"])
+def test_backup_method(tmp_path: Path, backup_method: Any) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT)
+    with InPlace(p, backup_ext="~", backup_method=backup_method) as fp:
+        for line in fp:
+            fp.write(line.swapcase())
+    assert pylistdir(tmp_path) == ["file.txt", "file.txt~"]
+    assert (tmp_path / "file.txt~").read_text() == TEXT
+    assert p.read_text() == TEXT.swapcase()
+
+
+def test_backup_method_link_no_gap(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT)
+    bkp = tmp_path / "backup.txt"
+    bkp.write_text("Old backup\n")
+    ino = p.stat().st_ino
+    real_replace = os.replace
+    exists: list[bool] = []
+
+    def replace(src: Any, dst: Any, **kwargs: Any) -> None:
+        exists.append(p.exists())
+        real_replace(src, dst, **kwargs)
+        exists.append(p.exists())
+
+    with InPlace(p, backup=bkp, backup_method="link") as fp:
+        fp.write(fp.read().swapcase())
+        monkeypatch.setattr(os, "replace", replace)
+    assert exists and all(exists)
+    assert pylistdir(tmp_path) == ["backup.txt", "file.txt"]
+    assert bkp.read_text() == TEXT
+    assert bkp.stat().st_ino == ino
+    assert p.read_text() == TEXT.swapcase()
+
+
+def test_backup_method_link_fallback_copy(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT)
+    p.chmod(0o640)
+    ino = p.stat().st_ino
+
+    def link(_src: Any, _dst: Any, **_kwargs: Any) -> None:
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+    monkeypatch.setattr(os, "link", link)
+    with InPlace(p, backup_ext="~", backup_method="link") as fp:
+        fp.write(fp.read().swapcase())
+    bkp = tmp_path / "file.txt~"
+    assert pylistdir(tmp_path) == ["file.txt", "file.txt~"]
+    assert bkp.read_text() == TEXT
+    assert bkp.stat().st_ino != ino
+    assert bkp.stat().st_mode & 0o777 == 0o640
+    assert p.read_text() == TEXT.swapcase()
+
+
+def test_bad_backup_method(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT)
+    with pytest.raises(ValueError, match="invalid backup method"):
+        InPlace(p, backup_ext="~", backup_method="copy")  # type: ignore[call-overload]
+    assert pylistdir(tmp_path) == ["file.txt"]
+    assert p.read_text() == TEXT
@@ -0,0 +1,95 @@
+from __future__ import annotations
+import hashlib
+import json
+from pathlib import Path
+import pytest
+from in_place import InPlace, Transaction
+from test_in_place_util import TEXT, UNICODE, pylistdir
+
+
+def sha256(s: str) -> str:
+    return hashlib.sha256(s.encode("utf-8")).hexdigest()
+
+
+def read_manifest(store: Path) -> list[dict]:
+    with (store / "manifest.jsonl").open() as fp:
+        return [json.loads(line) for line in fp]
+
+
+def test_backup_store(tmp_path: Path) -> None:
+    store = tmp_path / "store"
+    paths = []
+    for i in range(3):
+        p = tmp_path / f"file{i}.txt"
+        p.write_text(TEXT if i < 2 else UNICODE, encoding="utf-8")
+        paths.append(p)
+    for p in paths:
+        with InPlace(p, backup_store=store, encoding="utf-8") as fp:
+            for line in fp:
+                fp.write(line.swapcase())
+    assert pylistdir(tmp_path) == ["file0.txt", "file1.txt", "file2.txt", "store"]
+    for i, p in enumerate(paths):
+        assert p.read_text(encoding="utf-8") == (TEXT if i < 2 else UNICODE).swapcase()
+    d1, d2 = sha256(TEXT), sha256(UNICODE)
+    assert sorted(pylistdir(store)) == sorted([d1[:2], d2[:2], "manifest.jsonl"])
+    assert (store / d1[:2] / d1).read_text(encoding="utf-8") == TEXT
+    assert (store / d2[:2] / d2).read_text(encoding="utf-8") == UNICODE
+    entries = read_manifest(store)
+    assert [(e["path"], e["sha256"], e["size"]) for e in entries] == [
+        (str(paths[0]), d1, len(TEXT)),
+        (str(paths[1]), d1, len(TEXT)),
+        (str(paths[2]), d2, len(UNICODE.encode("utf-8"))),
+    ]
+    assert all(e["time"] for e in entries)
+
+
+def test_backup_store_partial_read(tmp_path: Path) -> None:
+    store = tmp_path / "store"
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT)
+    with InPlace(p, backup_store=store) as fp:
+        fp.write(fp.readline())
+    with InPlace(p, "b", backup_store=store) as fp:
+        fp.copy_lines(1)
+        fp.write(b"foo\n")
+    d1 = sha256(TEXT)
+    d2 = sha256(TEXT.splitlines(keepends=True)[0])
+    assert (store / d1[:2] / d1).read_text() == TEXT
+    assert [e["sha256"] for e in read_manifest(store)] == [d1, d2]
+    assert p.read_text() == TEXT.splitlines(keepends=True)[0] + "foo\n"
+
+
+def test_backup_store_rollback(tmp_path: Path) -> None:
+    store = tmp_path / "store"
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT)
+    with pytest.raises(RuntimeError):
+        with InPlace(p, backup_store=store) as fp:
+            fp.write(fp.read().swapcase())
+            raise RuntimeError("I changed my mind.")
+    assert pylistdir(tmp_path) == ["file.txt"]
+    assert p.read_text() == TEXT
+
+
+def test_backup_store_transaction(tmp_path: Path) -> None:
+    store = tmp_path / "store"
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT)
+    with Transaction() as txn:
+        with txn.open(p, backup_store=store) as fp:
+            fp.write(fp.read().swapcase())
+        assert not store.exists()
+    d = sha256(TEXT)
+    assert (store / d[:2] / d).read_text() == TEXT
+    assert [e["sha256"] for e in read_manifest(store)] == [d]
+    assert p.read_text() == TEXT.swapcase()
+
+
+def test_backup_store_and_backup(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT)
+    with pytest.raises(ValueError, match="mutually exclusive"):
+        InPlace(p, backup_ext="~", backup_store=tmp_path / "store")
+    with pytest.raises(ValueError):
+        InPlace(p, backup_store="")
+    assert pylistdir(tmp_path) == ["file.txt"]
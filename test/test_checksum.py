@@ -0,0 +1,78 @@
+from __future__ import annotations
+import hashlib
+from pathlib import Path
+import pytest
+from in_place import InPlace
+from test_in_place_util import TEXT
+
+
+@pytest.mark.parametrize("checksum", ["sha256", "blake2b", "md5"])
+def test_checksum_text(tmp_path: Path, checksum: str) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT, encoding="utf-8")
+    with InPlace(p, encoding="utf-8", checksum=checksum) as fp:
+        for line in fp:
+            fp.write(line.swapcase() + "ü")
+    assert fp.output_digest == hashlib.new(checksum, p.read_bytes()).hexdigest()
+    assert fp.input_digest is None
+
+
+def test_checksum_input(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT)
+    with InPlace(p, checksum="blake2b", checksum_input=True) as fp:
+        fp.write(fp.readline().upper())
+    assert fp.input_digest == hashlib.blake2b(TEXT.encode()).hexdigest()
+    assert fp.output_digest == hashlib.blake2b(p.read_bytes()).hexdigest()
+
+
+def test_checksum_copy_lines(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    data = b"".join(b"line %d\n" % i for i in range(10000))
+    p.write_bytes(data)
+    with InPlace(p, "b", checksum="sha256", checksum_input=True) as fp:
+        fp.replace_lines(10, 20, [b"replaced\n"])
+        fp.copy_lines(5000)
+        fp.write(fp.readline().upper())
+        fp.copy_lines()
+    assert fp.input_digest == hashlib.sha256(data).hexdigest()
+    assert fp.output_digest == hashlib.sha256(p.read_bytes()).hexdigest()
+
+
+def test_checksum_unbuffered(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_bytes(b"foo\n")
+    with InPlace(p, "b", buffering=0, checksum="sha1") as fp:
+        fp.write(b"bar\n")
+        fp.write(b"baz\n")
+    assert fp.output_digest == hashlib.sha1(b"bar\nbaz\n").hexdigest()
+
+
+def test_checksum_rollback(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT)
+    with InPlace(p, checksum="sha256") as fp:
+        fp.write("foo")
+        fp.rollback()
+    assert fp.output_digest is None
+    assert p.read_text() == TEXT
+
+
+@pytest.mark.parametrize(
+    "kwargs,msg",
+    [
+        ({"checksum": "nonexistent"}, "unsupported hash type"),
+        ({"checksum": "shake_128"}, "variable-length digests"),
+        ({"checksum_input": True}, "checksum_input requires checksum"),
+        (
+            {"checksum": "md5", "checksum_input": True, "backup_store": "store"},
+            "requires checksum='sha256'",
+        ),
+    ],
+)
+def test_checksum_invalid(tmp_path: Path, kwargs: dict, msg: str) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT)
+    with pytest.raises(ValueError, match=msg):
+        InPlace(p, **kwargs)
+    assert [q.name for q in tmp_path.iterdir()] == ["file.txt"]
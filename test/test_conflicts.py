@@ -0,0 +1,111 @@
+from __future__ import annotations
+from pathlib import Path
+import pytest
+from in_place import ConflictError, InPlace, Transaction, retry_edit
+from test_in_place_util import TEXT, pylistdir
+
+
+def test_no_conflict(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT)
+    with InPlace(p, backup_ext="~", detect_conflicts=True) as fp:
+        for line in fp:
+            fp.write(line.swapcase())
+    assert pylistdir(tmp_path) == ["file.txt", "file.txt~"]
+    assert p.read_text() == TEXT.swapcase()
+
+
+def test_conflict_modified(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT)
+    with pytest.raises(ConflictError) as excinfo:
+        with InPlace(p, backup_ext="~", detect_conflicts=True) as fp:
+            for line in fp:
+                fp.write(line.swapcase())
+            with open(p, "a") as other:
+                other.write("Another writer was here.\n")
+    assert excinfo.value.path == str(p)
+    assert pylistdir(tmp_path) == ["file.txt"]
+    assert p.read_text() == TEXT + "Another writer was here.\n"
+
+
+def test_conflict_replaced(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT)
+    with pytest.raises(ConflictError):
+        with InPlace(p, detect_conflicts=True) as fp:
+            fp.write(fp.read().swapcase())
+            (tmp_path / "new.txt").write_text("new\n")
+            (tmp_path / "new.txt").replace(p)
+    assert pylistdir(tmp_path) == ["file.txt"]
+    assert p.read_text() == "new\n"
+
+
+def test_conflict_deleted(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT)
+    fp = InPlace(p, detect_conflicts=True)
+    fp.write(fp.read().swapcase())
+    fp.input.close()
+    p.unlink()
+    with pytest.raises(ConflictError):
+        fp.close()
+    assert fp.closed
+    assert pylistdir(tmp_path) == []
+
+
+def test_conflict_transaction(tmp_path: Path) -> None:
+    p1 = tmp_path / "file1.txt"
+    p1.write_text(TEXT)
+    p2 = tmp_path / "file2.txt"
+    p2.write_text(TEXT)
+    with pytest.raises(ConflictError):
+        with Transaction() as txn:
+            for p in (p1, p2):
+                with txn.open(p, detect_conflicts=True) as fp:
+                    fp.write(fp.read().swapcase())
+            p2.write_text("changed\n")
+    assert pylistdir(tmp_path) == ["file1.txt", "file2.txt"]
+    assert p1.read_text() == TEXT
+    assert p2.read_text() == "changed\n"
+
+
+def test_retry_edit(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text("")
+    calls = 0
+    conflicts: list[int] = []
+
+    def edit(fp: InPlace[str]) -> int:
+        nonlocal calls
+        calls += 1
+        fp.write(fp.read() + "edit\n")
+        if calls <= 2:
+            # Simulate another process editing the file concurrently:
+            with open(p, "a") as other:
+                other.write("other\n")
+        return calls
+
+    def on_conflict(e: ConflictError, attempt: int) -> None:
+        assert e.path == str(p)
+        conflicts.append(attempt)
+
+    assert retry_edit(p, edit, on_conflict=on_conflict) == 3
+    assert conflicts == [1, 2]
+    assert pylistdir(tmp_path) == ["file.txt"]
+    assert p.read_text() == "other\nother\nedit\n"
+
+
+def test_retry_edit_exhausted(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_bytes(b"")
+
+    def always_conflict(fp: InPlace[bytes]) -> None:
+        fp.write(fp.read() + b"x")
+        with open(p, "ab") as other:
+            other.write(b"y")
+
+    with pytest.raises(ConflictError):
+        retry_edit(p, always_conflict, "b", retries=2)
+    assert pylistdir(tmp_path) == ["file.txt"]
+    assert p.read_bytes() == b"yyy"
@@ -0,0 +1,146 @@
+from __future__ import annotations
+from concurrent.futures import Future
+import errno
+import os
+from pathlib import Path
+import tempfile
+import time
+import pytest
+import in_place
+from in_place import InPlace, Transaction, edit_file, wait_for_backups
+from test_in_place_util import TEXT, pylistdir
+
+
+@pytest.fixture
+def remote(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    """
+    A directory that `os.replace()` treats as being on another filesystem
+    """
+    remote = tmp_path / "remote"
+    remote.mkdir()
+    real_replace = os.replace
+
+    def replace(src: str, dst: str, **kwargs: int | None) -> None:
+        r = os.path.join(remote, "")
+        if not os.fsdecode(src).startswith(r) and os.fsdecode(dst).startswith(r):
+            raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+        real_replace(src, dst, **kwargs)
+
+    monkeypatch.setattr(os, "replace", replace)
+    return remote
+
+
+def test_backup_cross_device(tmp_path: Path, remote: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT)
+    with InPlace(p, backup=remote / "file.txt.bak") as fp:
+        for line in fp:
+            fp.write(line.swapcase())
+    wait_for_backups()
+    assert pylistdir(tmp_path) == ["file.txt", "remote"]
+    assert pylistdir(remote) == ["file.txt.bak"]
+    assert (remote / "file.txt.bak").read_text() == TEXT
+    assert p.read_text() == TEXT.swapcase()
+
+
+def test_backup_cross_device_forgotten(tmp_path: Path, remote: Path) -> None:
+    # Successful copies are dropped without waiting for them:
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT)
+    with InPlace(p, backup=remote / "file.txt.bak") as fp:
+        fp.write(fp.read().upper())
+    deadline = time.monotonic() + 5
+    while in_place._backup_copies and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not in_place._backup_copies
+    assert (remote / "file.txt.bak").read_text() == TEXT
+
+
+def test_backup_cross_device_stats(tmp_path: Path, remote: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT)
+    p.chmod(0o640)
+    os.utime(p, ns=(1_000_000_000, 2_000_000_000))
+    with InPlace(p, backup=remote / "file.txt.bak") as fp:
+        fp.write(fp.read().upper())
+    wait_for_backups()
+    st = (remote / "file.txt.bak").stat()
+    assert st.st_mode & 0o777 == 0o640
+    assert st.st_mtime_ns == 2_000_000_000
+
+
+def test_backup_cross_device_transaction(tmp_path: Path, remote: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT)
+    q = tmp_path / "other.txt"
+    q.write_text("other\n")
+    with Transaction() as txn:
+        with txn.open(p, backup=remote / "file.txt.bak") as fp:
+            fp.write(fp.read().upper())
+        with txn.open(q, backup_ext="~") as fq:
+            fq.write("OTHER\n")
+    wait_for_backups()
+    assert pylistdir(tmp_path) == ["file.txt", "other.txt", "other.txt~", "remote"]
+    assert pylistdir(remote) == ["file.txt.bak"]
+    assert (remote / "file.txt.bak").read_text() == TEXT
+    assert p.read_text() == TEXT.upper()
+    assert q.read_text() == "OTHER\n"
+    assert (tmp_path / "other.txt~").read_text() == "other\n"
+
+
+def test_backup_cross_device_edit_file(tmp_path: Path, remote: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text("foo\n")
+    assert edit_file(p, str.upper, backup=remote / "file.txt.bak")
+    wait_for_backups()
+    assert pylistdir(tmp_path) == ["file.txt", "remote"]
+    assert (remote / "file.txt.bak").read_text() == "foo\n"
+    assert p.read_text() == "FOO\n"
+
+
+def test_backup_cross_device_rollback(tmp_path: Path, remote: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT)
+    with InPlace(p, backup=remote / "file.txt.bak") as fp:
+        fp.write("foo\n")
+        fp.rollback()
+    wait_for_backups()
+    assert pylistdir(tmp_path) == ["file.txt", "remote"]
+    assert pylistdir(remote) == []
+    assert p.read_text() == TEXT
+
+
+def test_backup_cross_device_error(tmp_path: Path, remote: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT)
+    with InPlace(p, backup=remote / "nonexistent" / "file.txt.bak") as fp:
+        fp.write(fp.read().upper())
+    assert p.read_text() == TEXT.upper()
+    with pytest.raises(FileNotFoundError):
+        wait_for_backups()
+    # Errors are only reported once:
+    wait_for_backups()
+
+
+def test_wait_for_backups_timeout(monkeypatch: pytest.MonkeyPatch) -> None:
+    blocked: Future[None] = Future()
+    monkeypatch.setattr(in_place, "_backup_copies", {blocked})
+    with pytest.raises(TimeoutError):
+        wait_for_backups(timeout=0.01)
+    blocked.set_result(None)
+    wait_for_backups()
+
+
+def test_backup_real_cross_device(tmp_path: Path) -> None:
+    shm = "/dev/shm"
+    if not os.path.isdir(shm) or os.stat(shm).st_dev == tmp_path.stat().st_dev:
+        pytest.skip("No other filesystem available")
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT)
+    with tempfile.TemporaryDirectory(dir=shm) as d:
+        bak = Path(d, "file.txt.bak")
+        with InPlace(p, backup=bak) as fp:
+            fp.write(fp.read().upper())
+        wait_for_backups()
+        assert bak.read_text() == TEXT
+    assert p.read_text() == TEXT.upper()
@@ -0,0 +1,84 @@
+from __future__ import annotations
+from pathlib import Path
+import pytest
+from in_place import edit_csv
+from test_in_place_util import pylistdir
+
+CSV = "id,name,qty\n1,apple,3\n2,banana,0\n3,cherry,12\n4,date,7\n"
+
+
+def double_qty(rows: list[list[str]]) -> list[list[str]]:
+    return [r[:2] + [str(int(r[2]) * 2)] if r[0] != "id" else r for r in rows]
+
+
+def drop_empty(rows: list[list[str]]) -> list[list[str]]:
+    return [r for r in rows if r[2] != "0"]
+
+
+def fail(rows: list[list[str]]) -> list[list[str]]:
+    if any(r[0] == "3" for r in rows):
+        raise RuntimeError("I changed my mind.")
+    return rows
+
+
+@pytest.mark.parametrize("batch_size", [1, 2, 100])
+@pytest.mark.parametrize("workers", [1, 2])
+def test_edit_csv(tmp_path: Path, batch_size: int, workers: int) -> None:
+    p = tmp_path / "data.csv"
+    p.write_text(CSV)
+    edit_csv(p, double_qty, batch_size=batch_size, workers=workers)
+    assert pylistdir(tmp_path) == ["data.csv"]
+    assert p.read_text() == (
+        "id,name,qty\n1,apple,6\n2,banana,0\n3,cherry,24\n4,date,14\n"
+    )
+
+
+def test_edit_csv_dialect(tmp_path: Path) -> None:
+    p = tmp_path / "data.csv"
+    p.write_bytes(b"id;name;qty\r\n1;apple;3\r\n2;'ban;ana';0\r\n3;cherry;12\r\n")
+    edit_csv(p, drop_empty, batch_size=2, backup_ext="~")
+    assert pylistdir(tmp_path) == ["data.csv", "data.csv~"]
+    assert p.read_bytes() == b"id;name;qty\r\n1;apple;3\r\n3;cherry;12\r\n"
+
+
+def test_edit_csv_unsniffable(tmp_path: Path) -> None:
+    p = tmp_path / "data.csv"
+    p.write_bytes(b"x\ny\nz\n")
+    edit_csv(p, lambda rows: rows)
+    assert p.read_bytes() == b"x\ny\nz\n"
+
+
+def test_edit_csv_explicit_dialect(tmp_path: Path) -> None:
+    p = tmp_path / "data.csv"
+    p.write_text("a\tb\tc\n1\t2\t0\n")
+    edit_csv(p, drop_empty, dialect="excel-tab")
+    assert p.read_bytes() == b"a\tb\tc\r\n"
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_edit_csv_error(tmp_path: Path, workers: int) -> None:
+    p = tmp_path / "data.csv"
+    p.write_text(CSV)
+    with pytest.raises(RuntimeError):
+        edit_csv(p, fail, batch_size=1, workers=workers)
+    assert pylistdir(tmp_path) == ["data.csv"]
+    assert p.read_text() == CSV
+
+
+def test_edit_csv_empty(tmp_path: Path) -> None:
+    p = tmp_path / "data.csv"
+    p.write_text("")
+    edit_csv(p, drop_empty)
+    assert pylistdir(tmp_path) == ["data.csv"]
+    assert p.read_text() == ""
+
+
+def test_edit_csv_bad_args(tmp_path: Path) -> None:
+    p = tmp_path / "data.csv"
+    p.write_text(CSV)
+    with pytest.raises(ValueError):
+        edit_csv(p, drop_empty, batch_size=0)
+    with pytest.raises(ValueError):
+        edit_csv(p, drop_empty, workers=0)
+    assert pylistdir(tmp_path) == ["data.csv"]
+    assert p.read_text() == CSV
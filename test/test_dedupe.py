@@ -0,0 +1,82 @@
+from __future__ import annotations
+from pathlib import Path
+import random
+import pytest
+import in_place
+from in_place import dedupe_lines
+from test_in_place_util import pylistdir
+
+
+def reference(lines: list[str], keep: str) -> list[str]:
+    if keep == "last":
+        return reference(lines[::-1], "first")[::-1]
+    seen: set[str] = set()
+    out = []
+    for line in lines:
+        if line not in seen:
+            seen.add(line)
+            out.append(line)
+    return out
+
+
+@pytest.mark.parametrize("keep", ["first", "last"])
+def test_dedupe_lines(tmp_path: Path, keep: str) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text("a\nb\na\nc\nb\na\n")
+    assert dedupe_lines(p, keep=keep) == 3  # type: ignore[arg-type]
+    assert pylistdir(tmp_path) == ["file.txt"]
+    expected = {"first": "a\nb\nc\n", "last": "c\nb\na\n"}[keep]
+    assert p.read_text() == expected
+
+
+@pytest.mark.parametrize("keep", ["first", "last"])
+@pytest.mark.parametrize("memory_limit", [1, 1000, 10**9])
+def test_dedupe_lines_spill(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path, keep: str, memory_limit: int
+) -> None:
+    monkeypatch.setattr(in_place, "DEDUPE_FANOUT", 4)
+    rng = random.Random(memory_limit)
+    lines = [f"{rng.randrange(300)}\n" for _ in range(3000)]
+    p = tmp_path / "file.txt"
+    p.write_text("".join(lines))
+    expected = reference(lines, keep)
+    removed = dedupe_lines(
+        p, keep=keep, memory_limit=memory_limit  # type: ignore[arg-type]
+    )
+    assert removed == len(lines) - len(expected)
+    assert p.read_text() == "".join(expected)
+    assert pylistdir(tmp_path) == ["file.txt"]
+
+
+def test_dedupe_lines_unterminated(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_bytes(b"x\r\ny\nx")
+    assert dedupe_lines(p, mode="b", backup_ext="~") == 0
+    assert pylistdir(tmp_path) == ["file.txt", "file.txt~"]
+    assert p.read_bytes() == b"x\r\ny\nx"
+    assert (tmp_path / "file.txt~").read_bytes() == b"x\r\ny\nx"
+    p.write_bytes(b"x\ny\nx")
+    assert dedupe_lines(p, mode="b") == 1
+    assert p.read_bytes() == b"x\ny\n"
+
+
+def test_dedupe_lines_empty(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text("")
+    assert dedupe_lines(p) == 0
+    assert p.read_text() == ""
+
+
+@pytest.mark.parametrize(
+    "kwargs,msg",
+    [
+        ({"keep": "middle"}, "invalid keep value"),
+        ({"memory_limit": 0}, "memory_limit must be positive"),
+    ],
+)
+def test_dedupe_lines_invalid(tmp_path: Path, kwargs: dict, msg: str) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text("a\na\n")
+    with pytest.raises(ValueError, match=msg):
+        dedupe_lines(p, **kwargs)
+    assert p.read_text() == "a\na\n"
@@ -0,0 +1,80 @@
+from __future__ import annotations
+from io import BytesIO
+import os
+from pathlib import Path
+from typing import Any
+import pytest
+from in_place import apply_delta, encode_delta
+from test_in_place_util import pylistdir
+
+OLD = bytes(range(256)) * 64
+
+OPS: list[tuple[Any, ...]] = [
+    ("insert", b"header"),
+    ("copy", 1000, 5000),
+    ("copy", 0, 0),
+    ("insert", b""),
+    ("copy", 0, 10),
+    ("insert", b"\x00" * 3),
+    ("copy", len(OLD) - 7, 7),
+]
+
+NEW = b"header" + OLD[1000:6000] + OLD[:10] + b"\x00" * 3 + OLD[-7:]
+
+
+@pytest.mark.parametrize("form", ["ops", "bytes", "path", "file"])
+def test_apply_delta(tmp_path: Path, form: str) -> None:
+    p = tmp_path / "asset.bin"
+    p.write_bytes(OLD)
+    os.chmod(p, 0o640)
+    delta: Any
+    if form == "ops":
+        delta = iter(OPS)
+    elif form == "bytes":
+        delta = encode_delta(OPS)
+    elif form == "path":
+        delta = tmp_path / "patch.delta"
+        delta.write_bytes(encode_delta(OPS))
+    else:
+        delta = BytesIO(encode_delta(OPS))
+    apply_delta(p, delta, backup_ext=".orig")
+    assert p.read_bytes() == NEW
+    assert (tmp_path / "asset.bin.orig").read_bytes() == OLD
+    assert p.stat().st_mode & 0o777 == 0o640
+
+
+def test_apply_delta_large_insert(tmp_path: Path) -> None:
+    p = tmp_path / "asset.bin"
+    p.write_bytes(b"abc")
+    data = os.urandom(3 * 1024 * 1024 + 5)
+    apply_delta(p, encode_delta([("copy", 1, 2), ("insert", data)]))
+    assert p.read_bytes() == b"bc" + data
+
+
+@pytest.mark.parametrize(
+    "delta,msg",
+    [
+        ([("copy", 0, len(OLD) + 1)], "out of bounds"),
+        ([("copy", -1, 1)], "out of bounds"),
+        ([("move", 0, 1)], "unknown operation"),
+        (b"XXXX", "bad magic number"),
+        (b"IPD1\x03", "unknown opcode"),
+        (b"IPD1\x01\x80", "truncated integer"),
+        (b"IPD1\x02\x05abc", "truncated insert"),
+    ],
+)
+def test_apply_delta_invalid(tmp_path: Path, delta: Any, msg: str) -> None:
+    p = tmp_path / "asset.bin"
+    p.write_bytes(OLD)
+    with pytest.raises(ValueError, match=msg):
+        apply_delta(p, [("insert", b"x"), *delta] if isinstance(delta, list) else delta)
+    assert pylistdir(tmp_path) == ["asset.bin"]
+    assert p.read_bytes() == OLD
+
+
+def test_encode_delta() -> None:
+    assert encode_delta([("copy", 300, 1), ("insert", b"hi")]) == (
+        b"IPD1\x01\xac\x02\x01\x02\x02hi"
+    )
+    with pytest.raises(ValueError, match="negative integer"):
+        encode_delta([("copy", -1, 1)])
@@ -0,0 +1,206 @@
+from __future__ import annotations
+import errno
+import os
+from os.path import relpath
+from pathlib import Path
+import platform
+from typing import Any
+import pytest
+import in_place
+from in_place import DirCache, InPlace
+from test_in_place_util import TEXT, pylistdir
+
+
+def test_dir_cache_many_files(monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> None:
+    paths = []
+    for i in range(5):
+        p = tmp_path / f"file{i}.txt"
+        p.write_text(TEXT)
+        p.chmod(0o640)
+        paths.append(p)
+    realpath_calls = 0
+    real_realpath = os.path.realpath
+
+    def realpath(path: str) -> str:
+        nonlocal realpath_calls
+        realpath_calls += 1
+        return real_realpath(path)
+
+    monkeypatch.setattr(os.path, "realpath", realpath)
+    with DirCache() as cache:
+        for p in paths:
+            with InPlace(p, dir_cache=cache) as fp:
+                files = pylistdir(tmp_path)
+                assert len(files) == 6
+                assert files[0].startswith("._in_place-")
+                for line in fp:
+                    fp.write(line.swapcase())
+    assert realpath_calls == 1
+    assert pylistdir(tmp_path) == [p.name for p in paths]
+    for p in paths:
+        assert p.read_text() == TEXT.swapcase()
+        assert p.stat().st_mode & 0o777 == 0o640
+
+
+def test_dir_cache_backup(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT)
+    (tmp_path / "backups").mkdir()
+    with DirCache() as cache:
+        with InPlace(p, backup_ext="~", dir_cache=cache) as fp:
+            fp.write(fp.read().swapcase())
+        with InPlace(p, backup=tmp_path / "backups" / "b.txt", dir_cache=cache) as fp:
+            fp.write(fp.read().upper())
+    assert pylistdir(tmp_path) == ["backups", "file.txt", "file.txt~"]
+    assert (tmp_path / "file.txt~").read_text() == TEXT
+    assert (tmp_path / "backups" / "b.txt").read_text() == TEXT.swapcase()
+    assert p.read_text() == TEXT.upper()
+
+
+def test_dir_cache_rollback(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT)
+    with DirCache() as cache:
+        with pytest.raises(RuntimeError):
+            with InPlace(p, backup_ext="~", dir_cache=cache) as fp:
+                fp.write(fp.read().swapcase())
+                raise RuntimeError("I changed my mind.")
+    assert pylistdir(tmp_path) == ["file.txt"]
+    assert p.read_text() == TEXT
+
+
+def test_dir_cache_missing_file(tmp_path: Path) -> None:
+    with DirCache() as cache:
+        with pytest.raises(FileNotFoundError):
+            InPlace(tmp_path / "nonexistent.txt", dir_cache=cache)
+    assert pylistdir(tmp_path) == []
+
+
+@pytest.mark.skipif(
+    platform.system() == "Windows", reason="Symlinks require privileges on Windows"
+)
+def test_dir_cache_symlink(tmp_path: Path) -> None:
+    realdir = tmp_path / "real"
+    realdir.mkdir()
+    real = realdir / "realfile.txt"
+    real.write_text(TEXT)
+    linkdir = tmp_path / "link"
+    linkdir.mkdir()
+    link = linkdir / "linkfile.txt"
+    target = relpath(real, linkdir)
+    link.symlink_to(target)
+    dirlink = tmp_path / "dirlink"
+    dirlink.symlink_to("real")
+    with DirCache() as cache:
+        with InPlace(link, backup_ext="~", dir_cache=cache) as fp:
+            fp.write(fp.read().swapcase())
+        with InPlace(dirlink / "realfile.txt", dir_cache=cache) as fp:
+            fp.write(fp.read().upper())
+    assert pylistdir(realdir) == ["realfile.txt", "realfile.txt~"]
+    assert pylistdir(linkdir) == ["linkfile.txt"]
+    assert link.is_symlink()
+    assert os.readlink(link) == target
+    assert dirlink.is_symlink()
+    assert real.read_text() == TEXT.upper()
+    assert (realdir / "realfile.txt~").read_text() == TEXT
+
+
+@pytest.mark.skipif(
+    platform.system() == "Windows", reason="Symlinks require privileges on Windows"
+)
+def test_dir_cache_symlink_chain(tmp_path: Path) -> None:
+    real = tmp_path / "real.txt"
+    real.write_text(TEXT)
+    (tmp_path / "link1").symlink_to("real.txt")
+    (tmp_path / "link2").symlink_to("link1")
+    with DirCache() as cache:
+        with InPlace(tmp_path / "link2", dir_cache=cache) as fp:
+            fp.write(fp.read().upper())
+    assert pylistdir(tmp_path) == ["link1", "link2", "real.txt"]
+    assert real.read_text() == TEXT.upper()
+
+
+@pytest.mark.skipif(
+    platform.system() == "Windows", reason="Symlinks require privileges on Windows"
+)
+def test_dir_cache_symlink_loop(tmp_path: Path) -> None:
+    (tmp_path / "l1").symlink_to("l2")
+    (tmp_path / "l2").symlink_to("l1")
+    with DirCache() as cache:
+        with pytest.raises(OSError) as excinfo:
+            InPlace(tmp_path / "l1", dir_cache=cache)
+    assert excinfo.value.errno == errno.ELOOP
+    assert pylistdir(tmp_path) == ["l1", "l2"]
+
+
+def test_dir_cache_mktemp_no_path_lookup(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT)
+    (tmp_path / "._in_place-taken").touch()
+    names = iter(["._in_place-taken", "._in_place-free"])
+
+    def lexists(_: Any) -> bool:
+        raise AssertionError("lexists() should not be called")
+
+    with DirCache() as cache:
+        cache.resolve(str(p))
+        monkeypatch.setattr(in_place, "random_basename", lambda: next(names))
+        monkeypatch.setattr(os.path, "lexists", lexists)
+        with InPlace(p, dir_cache=cache) as fp:
+            assert pylistdir(tmp_path) == [
+                "._in_place-free",
+                "._in_place-taken",
+                "file.txt",
+            ]
+            fp.write(fp.read().upper())
+    monkeypatch.undo()
+    assert pylistdir(tmp_path) == ["._in_place-taken", "file.txt"]
+    assert p.read_text() == TEXT.upper()
+
+
+@pytest.mark.skipif(
+    not in_place.DIR_FD_SUPPORTED, reason="Requires directory file descriptors"
+)
+def test_dir_cache_moved_dir(tmp_path: Path) -> None:
+    # Once the directory is cached, it is only accessed through its file
+    # descriptor, so edits still work after the directory is moved away from
+    # its cached path.
+    d = tmp_path / "d"
+    d.mkdir()
+    p = d / "file.txt"
+    p.write_text("0")
+    for i in (1, 2, 3):
+        (d / f"file.txt.~{i}~").write_text("old")
+    moved = tmp_path / "moved"
+
+    def bump(**kwargs: Any) -> None:
+        with InPlace(p, dir_cache=cache, **kwargs) as fp:
+            fp.write(str(int(fp.read()) + 1))
+
+    with DirCache() as cache:
+        cache.resolve(str(p))
+        d.rename(moved)
+        bump(backup_rotate=2)
+        bump(backup_rotate=2)
+        bump(backup_ext="~", backup_method="link")
+        bump(backup_store=tmp_path / "store")
+        with pytest.raises(RuntimeError):
+            with InPlace(p, dir_cache=cache, resume=True) as fp:
+                fp.write(str(int(fp.read()) + 1))
+                fp.checkpoint("done")
+                raise RuntimeError("Interrupted")
+        with InPlace(p, dir_cache=cache, resume=True) as fp:
+            assert fp.resumed
+            assert fp.resume_state == "done"
+    assert pylistdir(moved) == [
+        ".file.txt.~next~",
+        "file.txt",
+        "file.txt.~4~",
+        "file.txt.~5~",
+        "file.txt~",
+    ]
+    assert (moved / "file.txt.~5~").read_text() == "1"
+    assert (moved / "file.txt~").read_text() == "2"
+    assert (moved / "file.txt").read_text() == "5"
@@ -0,0 +1,119 @@
+from __future__ import annotations
+from io import BytesIO, StringIO
+from pathlib import Path
+import pytest
+from in_place import InPlace, Transaction, diff_lines
+from test_in_place_util import TEXT, pylistdir
+
+
+def test_dry_run(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT)
+    with InPlace(p, backup_ext="~", dry_run=True) as fp:
+        for line in fp:
+            fp.write(line.swapcase())
+    assert pylistdir(tmp_path) == ["file.txt"]
+    assert p.read_text() == TEXT
+    nlines = sum(line != line.swapcase() for line in TEXT.splitlines())
+    assert fp.lines_removed == nlines
+    assert fp.lines_added == nlines
+
+
+def test_dry_run_unchanged(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT)
+    with InPlace(p, dry_run=True) as fp:
+        fp.map_lines(lambda _: None)
+    assert pylistdir(tmp_path) == ["file.txt"]
+    assert fp.lines_removed == fp.lines_added == 0
+
+
+def test_diff(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text("".join(f"{i}\n" for i in range(20)))
+    out = StringIO()
+    with InPlace(p, diff=out, dry_run=True) as fp:
+        for line in fp:
+            if line == "10\n":
+                fp.write("ten\n")
+            elif line != "12\n":
+                fp.write(line)
+        fp.write("end")
+    assert out.getvalue() == (
+        f"--- {p}\n"
+        f"+++ {p}\n"
+        "@@ -8,9 +8,8 @@\n"
+        " 7\n"
+        " 8\n"
+        " 9\n"
+        "-10\n"
+        "+ten\n"
+        " 11\n"
+        "-12\n"
+        " 13\n"
+        " 14\n"
+        " 15\n"
+        "@@ -18,3 +17,4 @@\n"
+        " 17\n"
+        " 18\n"
+        " 19\n"
+        "+end\n"
+        "\\ No newline at end of file\n"
+    )
+    assert (fp.lines_removed, fp.lines_added) == (2, 2)
+    assert p.read_text() == "".join(f"{i}\n" for i in range(20))
+
+
+def test_diff_commits(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_bytes(b"foo\r\nbar\r\n")
+    out = BytesIO()
+    with InPlace(p, "b", diff=out) as fp:
+        fp.write(fp.read().replace(b"bar", b"baz"))
+    assert out.getvalue() == (
+        f"--- {p}\n+++ {p}\n@@ -1,2 +1,2 @@\n foo\r\n-bar\r\n+baz\r\n".encode()
+    )
+    assert p.read_bytes() == b"foo\r\nbaz\r\n"
+
+
+def test_dry_run_transaction(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text("foo\n")
+    q = tmp_path / "other.txt"
+    q.write_text("bar\n")
+    with Transaction() as txn:
+        with txn.open(p, dry_run=True) as fp:
+            fp.write("FOO\n")
+        with txn.open(q) as fq:
+            fq.write("BAR\n")
+    assert (fp.lines_removed, fp.lines_added) == (1, 1)
+    assert pylistdir(tmp_path) == ["file.txt", "other.txt"]
+    assert p.read_text() == "foo\n"
+    assert q.read_text() == "BAR\n"
+
+
+def test_dry_run_transaction_closed_by_commit(tmp_path: Path) -> None:
+    paths = [tmp_path / name for name in ("a.txt", "b.txt", "c.txt")]
+    for p in paths:
+        p.write_text("foo\n")
+    with Transaction() as txn:
+        fa = txn.open(paths[0], dry_run=True)
+        fa.write("A\n")
+        fb = txn.open(paths[1])
+        fb.write("B\n")
+        fc = txn.open(paths[2])
+        fc.write("C\n")
+    assert (fa.lines_removed, fa.lines_added) == (1, 1)
+    assert fb.closed
+    assert pylistdir(tmp_path) == ["a.txt", "b.txt", "c.txt"]
+    assert [p.read_text() for p in paths] == ["foo\n", "B\n", "C\n"]
+
+
+@pytest.mark.parametrize("window", [1, 2, 3, 5, 100])
+def test_diff_lines_window(window: int) -> None:
+    a = [f"{i}\n" for i in range(30)]
+    b = a[:5] + ["x\n"] + a[7:20] + ["y\n", "z\n"] + a[20:28]
+    events = list(diff_lines(a, b, window))
+    assert [line for tag, line in events if tag != "+"] == a
+    assert [line for tag, line in events if tag != "-"] == b
+    assert sum(tag == "-" for tag, _ in events) >= 4
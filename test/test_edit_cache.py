@@ -0,0 +1,84 @@
+from __future__ import annotations
+import os
+from pathlib import Path
+import pytest
+from in_place import EditCache, InPlace, edit_csv, parallel_map_lines
+
+
+def upper_rows(rows: list[list[str]]) -> list[list[str]]:
+    return [[cell.upper() for cell in row] for row in rows]
+
+
+def test_edit_cache(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text("foo\n")
+    db = tmp_path / "cache.db"
+    with EditCache(db, version="1") as cache:
+        assert not cache.is_current(p)
+        with InPlace(p) as fp:
+            fp.write(fp.read().upper())
+        cache.record(p)
+        assert cache.is_current(p)
+    with EditCache(db, version="1") as cache:
+        assert cache.is_current(p)
+        assert cache.is_current(os.path.relpath(p))
+    with EditCache(db, version="2") as cache:
+        assert not cache.is_current(p)
+
+
+def test_edit_cache_detects_changes(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text("foo\n")
+    with EditCache(tmp_path / "cache.db") as cache:
+        cache.record(p)
+        p.write_text("quux\n")
+        assert not cache.is_current(p)
+        cache.record(p)
+        with InPlace(p) as fp:
+            fp.write(fp.read())
+        assert not cache.is_current(p)
+        cache.record(p)
+        p.unlink()
+        assert not cache.is_current(p)
+
+
+def test_edit_cache_record_missing(tmp_path: Path) -> None:
+    with EditCache(tmp_path / "cache.db") as cache:
+        with pytest.raises(FileNotFoundError):
+            cache.record(tmp_path / "nonexistent.txt")
+
+
+def test_edit_csv_cache(tmp_path: Path) -> None:
+    p = tmp_path / "data.csv"
+    p.write_bytes(b"a,b\r\nc,d\r\n")
+    calls: list[int] = []
+
+    def func(rows: list[list[str]]) -> list[list[str]]:
+        calls.append(len(rows))
+        return upper_rows(rows)
+
+    with EditCache(tmp_path / "cache.db") as cache:
+        edit_csv(p, func, cache=cache)
+        edit_csv(p, func, cache=cache)
+    assert calls == [2]
+    assert p.read_bytes() == b"A,B\r\nC,D\r\n"
+
+
+def test_edit_csv_cache_dry_run(tmp_path: Path) -> None:
+    p = tmp_path / "data.csv"
+    p.write_text("a,b\r\n")
+    with EditCache(tmp_path / "cache.db") as cache:
+        edit_csv(p, upper_rows, cache=cache, dry_run=True)
+        assert not cache.is_current(p)
+
+
+def test_parallel_map_lines_cache(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text("foo\nbar\n")
+    with EditCache(tmp_path / "cache.db") as cache:
+        parallel_map_lines(p, str.upper, workers=1, cache=cache)
+        assert cache.is_current(p)
+        ino = p.stat().st_ino
+        parallel_map_lines(p, str.upper, workers=1, cache=cache)
+        assert p.stat().st_ino == ino
+    assert p.read_text() == "FOO\nBAR\n"
@@ -0,0 +1,131 @@
+from __future__ import annotations
+import errno
+import os
+from pathlib import Path
+import stat
+import pytest
+from in_place import edit_file
+from test_in_place_util import TEXT, pylistdir
+
+
+@pytest.mark.parametrize("small_file_limit", [0, 4096])
+def test_edit_file(tmp_path: Path, small_file_limit: int) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT)
+    os.chmod(p, 0o640)
+    assert edit_file(p, str.swapcase, backup_ext="~", small_file_limit=small_file_limit)
+    assert pylistdir(tmp_path) == ["file.txt", "file.txt~"]
+    assert p.read_text() == TEXT.swapcase()
+    assert (tmp_path / "file.txt~").read_text() == TEXT
+    assert p.stat().st_mode & 0o777 == 0o640
+
+
+@pytest.mark.parametrize("small_file_limit", [0, 4096])
+def test_edit_file_unchanged(tmp_path: Path, small_file_limit: int) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT)
+    ino = p.stat().st_ino
+    assert not edit_file(
+        p, lambda s: s, backup_ext="~", small_file_limit=small_file_limit
+    )
+    assert not edit_file(p, lambda _: None, small_file_limit=small_file_limit)
+    assert pylistdir(tmp_path) == ["file.txt"]
+    assert p.stat().st_ino == ino
+
+
+@pytest.mark.parametrize("small_file_limit", [0, 4096])
+def test_edit_file_newlines(tmp_path: Path, small_file_limit: int) -> None:
+    p = tmp_path / "file.txt"
+    p.write_bytes(b"a\r\nb\rc\n")
+    seen: list[str] = []
+
+    def func(s: str) -> str:
+        seen.append(s)
+        return s.upper()
+
+    assert edit_file(p, func, small_file_limit=small_file_limit)
+    assert seen == ["a\nb\nc\n"]
+    assert p.read_bytes() == "A\nB\nC\n".replace("\n", os.linesep).encode()
+
+
+@pytest.mark.parametrize("small_file_limit", [0, 4096])
+def test_edit_file_binary_encoding(tmp_path: Path, small_file_limit: int) -> None:
+    p = tmp_path / "file.txt"
+    p.write_bytes(b"foo\r\nbar\r\n")
+    assert edit_file(
+        p,
+        lambda bs: bs.replace(b"\r\n", b"\n"),
+        mode="b",
+        small_file_limit=small_file_limit,
+    )
+    assert p.read_bytes() == b"foo\nbar\n"
+    p.write_bytes("åéîøü\n".encode("utf-16"))
+    assert edit_file(p, str.upper, encoding="utf-16", small_file_limit=small_file_limit)
+    assert p.read_bytes() == "ÅÉÎØÜ\n".encode("utf-16")
+
+
+def test_edit_file_error(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT)
+
+    def func(_: str) -> str:
+        raise RuntimeError("Oops")
+
+    with pytest.raises(RuntimeError, match="Oops"):
+        edit_file(p, func, backup_ext="~")
+    assert pylistdir(tmp_path) == ["file.txt"]
+    assert p.read_text() == TEXT
+
+
+def test_edit_file_symlink(tmp_path: Path) -> None:
+    real = tmp_path / "real.txt"
+    real.write_text(TEXT)
+    link = tmp_path / "link.txt"
+    link.symlink_to(real)
+    assert edit_file(link, str.upper)
+    assert link.is_symlink()
+    assert real.read_text() == TEXT.upper()
+
+
+def test_edit_file_missing(tmp_path: Path) -> None:
+    with pytest.raises(FileNotFoundError):
+        edit_file(tmp_path / "nonexistent.txt", str.upper)
+    assert pylistdir(tmp_path) == []
+
+
+def test_edit_file_not_regular(monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> None:
+    # A FIFO or character device reports an `st_size` of 0 and must not be
+    # mistaken for an empty small file.
+    real_fstat = os.fstat
+    calls = 0
+
+    def fake_fstat(fd: int) -> os.stat_result:
+        nonlocal calls
+        st = real_fstat(fd)
+        calls += 1
+        if calls > 1:
+            return st
+        fields = list(st)
+        fields[stat.ST_MODE] = stat.S_IFCHR | 0o644
+        fields[stat.ST_SIZE] = 0
+        return os.stat_result(fields)
+
+    p = tmp_path / "file.txt"
+    p.write_text("foo\n")
+    monkeypatch.setattr(os, "fstat", fake_fstat)
+    assert edit_file(p, str.upper)
+    monkeypatch.undo()
+    assert pylistdir(tmp_path) == ["file.txt"]
+    assert p.read_text() == "FOO\n"
+
+
+def test_edit_file_max_size(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text("0123456789")
+    with pytest.raises(OSError) as excinfo:
+        edit_file(p, str.upper, max_size=9)
+    assert excinfo.value.errno == errno.EFBIG
+    assert pylistdir(tmp_path) == ["file.txt"]
+    assert p.read_text() == "0123456789"
+    assert edit_file(p, lambda s: s[::-1], max_size=10)
+    assert p.read_text() == "9876543210"
@@ -2,6 +2,8 @@ from __future__ import annotations
 import os
 from pathlib import Path
 import platform
+import subprocess
+import sys
 import pytest
 from in_place import InPlace
 from test_in_place_util import TEXT, pylistdir
@@ -460,3 +462,19 @@ def test_dos_newline(tmp_path: Path) -> None:
         b"aLL MIMSY WERE THE BOROGOVES,\r\r\n"
         b"\taND THE MOME RATHS OUTGRABE.\r\n"
     )
+
+
+def test_lazy_imports() -> None:
+    # Modules used only by optional features are not imported up front:
+    code = (
+        "import sys\n"
+        "before = set(sys.modules)\n"
+        "import in_place\n"
+        "print(' '.join(sorted(set(sys.modules) - before)))\n"
+    )
+    r = subprocess.run(
+        [sys.executable, "-c", code], stdout=subprocess.PIPE, text=True, check=True
+    )
+    loaded = set(r.stdout.split())
+    for mod in ["concurrent.futures", "csv", "difflib", "multiprocessing", "sqlite3"]:
+        assert mod not in loaded
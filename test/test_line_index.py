@@ -0,0 +1,175 @@
+from __future__ import annotations
+from pathlib import Path
+import pytest
+import in_place
+from in_place import InPlace, scan_lines
+from test_in_place_util import TEXT, pylistdir
+
+TEXT_BYTES = TEXT.encode("us-ascii")
+LINES = TEXT_BYTES.splitlines(keepends=True)
+
+
+def test_line_offsets(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_bytes(TEXT_BYTES)
+    with InPlace(p, "b") as fp:
+        offsets = fp.line_offsets()
+        assert len(offsets) == len(LINES) + 1
+        assert offsets[0] == 0
+        assert offsets[-1] == len(TEXT_BYTES)
+        for i, line in enumerate(LINES):
+            assert TEXT_BYTES[offsets[i] : offsets[i + 1]] == line
+        assert fp.line_offsets() is offsets
+        fp.copy_lines()
+    assert p.read_bytes() == TEXT_BYTES
+
+
+@pytest.mark.parametrize(
+    "data,expected",
+    [
+        (b"", [0]),
+        (b"\n", [0, 1]),
+        (b"foo", [0, 3]),
+        (b"foo\nbar", [0, 4, 7]),
+        (b"foo\nbar\n", [0, 4, 8]),
+        (b"foo\r\nbar\r\n", [0, 5, 10]),
+    ],
+)
+def test_line_offsets_edge_cases(
+    tmp_path: Path, data: bytes, expected: list[int]
+) -> None:
+    p = tmp_path / "file.txt"
+    p.write_bytes(data)
+    with InPlace(p, "b") as fp:
+        assert list(fp.line_offsets()) == expected
+        fp.rollback()
+    assert p.read_bytes() == data
+
+
+@pytest.mark.parametrize("window", [1, 7, 64, 1 << 20])
+def test_scan_lines_windows(monkeypatch: pytest.MonkeyPatch, window: int) -> None:
+    monkeypatch.setattr(in_place, "SCAN_WINDOW", window)
+    expected = [0]
+    for line in LINES:
+        expected.append(expected[-1] + len(line))
+    assert list(scan_lines(TEXT_BYTES)) == expected
+    assert list(scan_lines(TEXT_BYTES + b"foo")) == expected + [len(TEXT_BYTES) + 3]
+
+
+def test_replace_lines(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_bytes(TEXT_BYTES)
+    with InPlace(p, "b") as fp:
+        fp.replace_lines(5, 10, [b"foo\n", b"bar\n"])
+        fp.replace_lines(12, 13, [])
+        assert fp.readline() == LINES[13]
+        fp.write(b"baz\n")
+        fp.copy_lines()
+    assert pylistdir(tmp_path) == ["file.txt"]
+    assert p.read_bytes() == b"".join(
+        LINES[:5] + [b"foo\n", b"bar\n"] + LINES[10:12] + [b"baz\n"] + LINES[14:]
+    )
+
+
+def test_replace_lines_after_reading(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_bytes(TEXT_BYTES)
+    with InPlace(p, "b") as fp:
+        for _ in range(3):
+            fp.write(next(fp).upper())
+        fp.replace_lines(4, 4, [b"inserted\n"])
+        fp.copy_lines(6)
+    assert p.read_bytes() == b"".join(
+        [ln.upper() for ln in LINES[:3]] + [LINES[3], b"inserted\n"] + LINES[4:6]
+    )
+
+
+def test_replace_lines_past_end(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_bytes(b"foo\nbar\n")
+    with InPlace(p, "b") as fp:
+        fp.replace_lines(1, 100, [b"quux\n"])
+        fp.replace_lines(100, 200, [b"end\n"])
+        assert fp.read() == b""
+    assert p.read_bytes() == b"foo\nquux\nend\n"
+
+
+def test_replace_lines_backwards(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_bytes(TEXT_BYTES)
+    with InPlace(p, "b") as fp:
+        fp.replace_lines(5, 6, [b"foo\n"])
+        with pytest.raises(ValueError):
+            fp.replace_lines(2, 3, [b"bar\n"])
+        with pytest.raises(ValueError):
+            fp.replace_lines(8, 7, [b"bar\n"])
+        with pytest.raises(ValueError):
+            fp.copy_lines(-1)
+        fp.copy_lines()
+    assert p.read_bytes() == b"".join(LINES[:5] + [b"foo\n"] + LINES[6:])
+
+
+def test_line_offsets_text_mode(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT)
+    with InPlace(p) as fp:
+        with pytest.raises(ValueError, match="binary mode"):
+            fp.line_offsets()  # type: ignore[misc]
+    assert p.read_text() == ""
+
+
+@pytest.mark.parametrize("max_bytes", [1, 7, 64, 100000])
+def test_iter_line_batches(tmp_path: Path, max_bytes: int) -> None:
+    p = tmp_path / "file.txt"
+    p.write_bytes(TEXT_BYTES)
+    seen: list[bytes] = []
+    with InPlace(p, "b") as fp:
+        for batch in fp.iter_line_batches(max_bytes):
+            assert batch.data.endswith(b"\n")
+            assert len(batch) == len(batch.lines())
+            assert [bytes(ln) for ln in batch] == batch.lines()
+            assert bytes(batch[-1]) == batch.lines()[-1]
+            seen.extend(batch.lines())
+            fp.write(batch.data.upper())
+    assert seen == LINES
+    assert p.read_bytes() == TEXT_BYTES.upper()
+
+
+def test_iter_line_batches_long_line(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    long_line = b"x" * 100000 + b"\n"
+    p.write_bytes(b"a\n" + long_line + b"b\n" + long_line + b"tail")
+    with InPlace(p, "b") as fp:
+        lines = [ln for batch in fp.iter_line_batches(1000) for ln in batch.lines()]
+        fp.rollback()
+    assert lines == [b"a\n", long_line, b"b\n", long_line, b"tail"]
+
+
+def test_iter_line_batches_partial_last_line(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_bytes(b"foo\r\nbar\nbaz")
+    with InPlace(p, "b") as fp:
+        assert fp.readline() == b"foo\r\n"
+        batches = list(fp.iter_line_batches(2))
+        assert [b.lines() for b in batches] == [[b"bar\n"], [b"baz"]]
+        fp.rollback()
+    with InPlace(p, "b") as fp:
+        batch, last = fp.iter_line_batches()
+        assert batch.lines() == [b"foo\r\n", b"bar\n"]
+        assert list(batch.offsets) == [0, 5, 9]
+        with pytest.raises(IndexError):
+            batch[2]
+        assert last.lines() == [b"baz"]
+        fp.writelines(ln for ln in batch.lines() if ln != b"bar\n")
+        fp.write(last.data)
+    assert p.read_bytes() == b"foo\r\nbaz"
+
+
+def test_iter_line_batches_text_mode(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT)
+    with InPlace(p) as fp:
+        with pytest.raises(ValueError, match="binary mode"):
+            next(fp.iter_line_batches())  # type: ignore[misc]
+        fp.rollback()
+    assert p.read_text() == TEXT
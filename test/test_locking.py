@@ -0,0 +1,119 @@
+from __future__ import annotations
+from pathlib import Path
+import sys
+import threading
+import time
+import pytest
+from in_place import InPlace, Transaction
+from test_in_place_util import TEXT, pylistdir
+
+pytest.importorskip("fcntl")
+
+
+def test_lock_exclusive(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT)
+    with InPlace(p, backup_ext="~", lock="exclusive") as fp:
+        assert fp.lock_wait >= 0
+        files = pylistdir(tmp_path)
+        assert len(files) == 3
+        assert files[0].startswith("._in_place-")
+        assert files[1:] == ["file.txt", "file.txt.lock"]
+        with pytest.raises(TimeoutError):
+            InPlace(p, lock="exclusive", lock_timeout=0.05)
+        with pytest.raises(TimeoutError):
+            InPlace(p, lock="shared", lock_timeout=0)
+        assert len(pylistdir(tmp_path)) == 3
+        fp.write(fp.read().swapcase())
+    assert pylistdir(tmp_path) == ["file.txt", "file.txt.lock", "file.txt~"]
+    assert p.read_text() == TEXT.swapcase()
+    with InPlace(p, lock="exclusive", lock_timeout=0) as fp:
+        fp.write(fp.read().swapcase())
+    assert p.read_text() == TEXT
+
+
+def test_lock_shared(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT)
+    fp1 = InPlace(p, lock="shared", lock_timeout=0)
+    fp2 = InPlace(p, lock="shared", lock_timeout=0)
+    with pytest.raises(TimeoutError):
+        InPlace(p, lock="exclusive", lock_timeout=0)
+    fp1.rollback()
+    with pytest.raises(TimeoutError):
+        InPlace(p, lock="exclusive", lock_timeout=0)
+    fp2.rollback()
+    with InPlace(p, lock="exclusive", lock_timeout=0):
+        pass
+    assert pylistdir(tmp_path) == ["file.txt", "file.txt.lock"]
+    assert p.read_text() == ""
+
+
+def test_lock_serializes_edits(tmp_path: Path) -> None:
+    p = tmp_path / "counter.txt"
+    p.write_text("0\n")
+    waits: list[float] = []
+
+    def increment() -> None:
+        for _ in range(10):
+            with InPlace(p, lock="exclusive") as fp:
+                n = int(fp.read())
+                time.sleep(0.001)
+                fp.write(f"{n + 1}\n")
+            waits.append(fp.lock_wait)
+
+    threads = [threading.Thread(target=increment) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert p.read_text() == "40\n"
+    assert len(waits) == 40
+    assert max(waits) > 0
+
+
+def test_lock_released_on_error(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT)
+    with pytest.raises(RuntimeError):
+        with InPlace(p, lock="exclusive"):
+            raise RuntimeError("I changed my mind.")
+    with pytest.raises(FileNotFoundError):
+        InPlace(tmp_path / "nonexistent.txt", lock="exclusive")
+    with InPlace(p, lock="exclusive", lock_timeout=0) as fp:
+        fp.write(fp.read())
+    assert p.read_text() == TEXT
+
+
+def test_lock_transaction(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT)
+    with Transaction() as txn:
+        with txn.open(p, lock="exclusive") as fp:
+            fp.write(fp.read().swapcase())
+        # The lock is held until the transaction is committed:
+        with pytest.raises(TimeoutError):
+            InPlace(p, lock="exclusive", lock_timeout=0)
+    with InPlace(p, lock="exclusive", lock_timeout=0) as fp:
+        assert fp.read() == TEXT.swapcase()
+        fp.rollback()
+
+
+def test_bad_lock(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT)
+    with pytest.raises(ValueError, match="invalid lock mode"):
+        InPlace(p, lock="sometimes")  # type: ignore[call-overload]
+    assert pylistdir(tmp_path) == ["file.txt"]
+
+
+def test_lock_unsupported(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT)
+    monkeypatch.setitem(sys.modules, "fcntl", None)
+    with pytest.raises(ValueError, match="not supported"):
+        InPlace(p, lock="exclusive")
+    assert pylistdir(tmp_path) == ["file.txt"]
+    with InPlace(p) as fp:
+        fp.write(fp.read().swapcase())
+    assert p.read_text() == TEXT.swapcase()
@@ -0,0 +1,88 @@
+from __future__ import annotations
+from pathlib import Path
+import pytest
+from in_place import InPlace
+from test_in_place_util import TEXT, UNICODE, pylistdir
+
+
+def shout(line: str) -> str | None:
+    if "Jabberwock" in line:
+        return line.upper()
+    return None
+
+
+@pytest.mark.parametrize("newline", [None, "", "\n", "preserve"])
+def test_map_lines(tmp_path: Path, newline: str | None) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT)
+    with InPlace(p, newline=newline) as fp:
+        fp.map_lines(shout)
+    assert pylistdir(tmp_path) == ["file.txt"]
+    assert p.read_text() == "".join(
+        ln.upper() if "Jabberwock" in ln else ln
+        for ln in TEXT.splitlines(keepends=True)
+    )
+
+
+@pytest.mark.parametrize("encoding", ["utf-8", "latin-1", "utf-16"])
+def test_map_lines_contains(tmp_path: Path, encoding: str) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text(UNICODE + TEXT + UNICODE, encoding=encoding)
+    seen = []
+
+    def func(line: str) -> str:
+        seen.append(line)
+        return line.replace("ø", "o")
+
+    with InPlace(p, encoding=encoding, newline="preserve") as fp:
+        assert fp.readline() == UNICODE
+        fp.write("first\n")
+        fp.map_lines(func, contains="ø")
+        assert fp.read() == ""
+        fp.write("last\n")
+    assert seen == [UNICODE]
+    assert p.read_text(encoding=encoding) == "first\n" + TEXT + "åéîoü\nlast\n"
+
+
+def test_map_lines_preserve_line_endings(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_bytes(b"foo\r\nbar\rbaz\nquux")
+    seen = []
+
+    def func(line: str) -> str:
+        seen.append(line)
+        return line.upper() if line.startswith("ba") else line
+
+    with InPlace(p, newline="preserve") as fp:
+        fp.map_lines(func)
+    assert seen == ["foo\r\n", "bar\r", "baz\n", "quux"]
+    assert p.read_bytes() == b"foo\r\nBAR\rBAZ\nquux"
+
+
+def test_map_lines_preserve_invalid_passthrough(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_bytes(b"caf\xe9\nfoo\n")
+    with InPlace(p, encoding="utf-8", newline="preserve") as fp:
+        fp.map_lines(str.upper, contains="foo")
+    assert p.read_bytes() == b"caf\xe9\nFOO\n"
+
+
+def test_map_lines_after_iteration(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT)
+    with InPlace(p, newline="") as fp:
+        fp.write(next(fp))
+        fp.map_lines(str.swapcase)
+    lines = TEXT.splitlines(keepends=True)
+    assert p.read_text() == lines[0] + "".join(lines[1:]).swapcase()
+
+
+def test_map_lines_bytes(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_bytes(TEXT.encode("us-ascii"))
+    with InPlace(p, "b") as fp:
+        fp.map_lines(bytes.upper, contains=b"Jabberwock")
+    assert p.read_text() == "".join(
+        ln.upper() if "Jabberwock" in ln else ln
+        for ln in TEXT.splitlines(keepends=True)
+    )
@@ -0,0 +1,126 @@
+from __future__ import annotations
+from pathlib import Path
+import pytest
+from in_place import InPlace, Transaction
+from test_in_place_util import pylistdir
+
+
+def edit(p: Path, **kwargs: object) -> None:
+    with InPlace(p, **kwargs) as fp:  # type: ignore[call-overload]
+        fp.write(str(int(fp.read()) + 1))
+
+
+def test_backup_numbered(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text("0")
+    for _ in range(3):
+        edit(p, backup_numbered=True)
+    assert pylistdir(tmp_path) == [
+        ".file.txt.~next~",
+        "file.txt",
+        "file.txt.~1~",
+        "file.txt.~2~",
+        "file.txt.~3~",
+    ]
+    assert [(tmp_path / f"file.txt.~{i}~").read_text() for i in (1, 2, 3)] == [
+        "0",
+        "1",
+        "2",
+    ]
+    assert p.read_text() == "3"
+
+
+def test_backup_numbered_continues_existing(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text("0")
+    (tmp_path / "file.txt.~7~").write_text("old")
+    (tmp_path / "file.txt.~12~").write_text("old")
+    (tmp_path / "other.txt.~20~").write_text("old")
+    edit(p, backup_numbered=True)
+    assert (tmp_path / "file.txt.~13~").read_text() == "0"
+    (tmp_path / ".file.txt.~next~").write_text("garbage")
+    edit(p, backup_numbered=True)
+    assert (tmp_path / "file.txt.~14~").read_text() == "1"
+    assert (tmp_path / ".file.txt.~next~").read_text() == "15\n"
+
+
+def test_backup_rotate(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text("0")
+    for _ in range(5):
+        edit(p, backup_rotate=2)
+    assert pylistdir(tmp_path) == [
+        ".file.txt.~next~",
+        "file.txt",
+        "file.txt.~4~",
+        "file.txt.~5~",
+    ]
+    assert (tmp_path / "file.txt.~4~").read_text() == "3"
+    assert (tmp_path / "file.txt.~5~").read_text() == "4"
+    assert p.read_text() == "5"
+
+
+def test_backup_rotate_prunes_scanned(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text("0")
+    for i in range(1, 6):
+        (tmp_path / f"file.txt.~{i}~").write_text("old")
+    edit(p, backup_rotate=2)
+    assert pylistdir(tmp_path) == [
+        ".file.txt.~next~",
+        "file.txt",
+        "file.txt.~5~",
+        "file.txt.~6~",
+    ]
+    assert (tmp_path / "file.txt.~6~").read_text() == "0"
+
+
+def test_backup_numbered_rollback(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text("0")
+    with InPlace(p, backup_numbered=True) as fp:
+        fp.write("1")
+        fp.rollback()
+    assert pylistdir(tmp_path) == ["file.txt"]
+    assert p.read_text() == "0"
+
+
+def test_backup_numbered_transaction(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text("0")
+    q = tmp_path / "other.txt"
+    q.write_text("a")
+    with Transaction() as txn:
+        with txn.open(p, backup_rotate=1) as fp:
+            fp.write("1")
+        with txn.open(q, backup_numbered=True) as fp:
+            fp.write("b")
+    assert (tmp_path / "file.txt.~1~").read_text() == "0"
+    assert (tmp_path / "other.txt.~1~").read_text() == "a"
+    assert p.read_text() == "1"
+    assert q.read_text() == "b"
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {"backup_numbered": True, "backup_ext": "~"},
+        {"backup_rotate": 3, "backup": "file.bak"},
+        {"backup_numbered": True, "backup_store": "store"},
+    ],
+)
+def test_backup_numbered_exclusive(tmp_path: Path, kwargs: dict) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text("0")
+    with pytest.raises(ValueError, match="mutually exclusive"):
+        InPlace(p, **kwargs)
+    assert pylistdir(tmp_path) == ["file.txt"]
+
+
+@pytest.mark.parametrize("rotate", [0, -1])
+def test_backup_rotate_nonpositive(tmp_path: Path, rotate: int) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text("0")
+    with pytest.raises(ValueError, match="backup_rotate must be positive"):
+        InPlace(p, backup_rotate=rotate)
+    assert pylistdir(tmp_path) == ["file.txt"]
@@ -0,0 +1,84 @@
+from __future__ import annotations
+from pathlib import Path
+import pytest
+from in_place import parallel_map_lines
+from test_in_place_util import TEXT, UNICODE, pylistdir
+
+
+def shout(line: str) -> str | None:
+    if "Jabberwock" in line:
+        return line.upper()
+    return None
+
+
+def number(line: bytes) -> bytes:
+    return b"> " + line
+
+
+def fail(line: str) -> str:
+    if "vorpal" in line:
+        raise RuntimeError("I changed my mind.")
+    return line
+
+
+EXPECTED = "".join(
+    ln.upper() if "Jabberwock" in ln else ln for ln in TEXT.splitlines(keepends=True)
+)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+@pytest.mark.parametrize("shards", [1, 3, 7, 1000])
+def test_parallel_map_lines(tmp_path: Path, workers: int, shards: int) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT)
+    parallel_map_lines(p, shout, workers=workers, shards=shards, encoding="utf-8")
+    assert pylistdir(tmp_path) == ["file.txt"]
+    assert p.read_text() == EXPECTED
+
+
+def test_parallel_map_lines_unicode(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_bytes((UNICODE * 50 + "No newline").encode("utf-8"))
+    parallel_map_lines(
+        p, str.upper, workers=2, shards=4, encoding="utf-8", backup_ext="~"
+    )
+    assert pylistdir(tmp_path) == ["file.txt", "file.txt~"]
+    assert p.read_text(encoding="utf-8") == (UNICODE * 50 + "No newline").upper()
+    assert (tmp_path / "file.txt~").read_text(encoding="utf-8") == (
+        UNICODE * 50 + "No newline"
+    )
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_parallel_map_lines_bytes(tmp_path: Path, workers: int) -> None:
+    p = tmp_path / "file.txt"
+    p.write_bytes(b"foo\r\nbar\n\nbaz")
+    parallel_map_lines(p, number, workers=workers, mode="b", shards=3)
+    assert p.read_bytes() == b"> foo\r\n> bar\n> \n> baz"
+
+
+def test_parallel_map_lines_empty(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_bytes(b"")
+    parallel_map_lines(p, number, workers=2, mode="b")
+    assert pylistdir(tmp_path) == ["file.txt"]
+    assert p.read_bytes() == b""
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_parallel_map_lines_error(tmp_path: Path, workers: int) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT)
+    with pytest.raises(RuntimeError):
+        parallel_map_lines(p, fail, workers=workers, shards=5, encoding="utf-8")
+    assert pylistdir(tmp_path) == ["file.txt"]
+    assert p.read_text() == TEXT
+
+
+def test_parallel_map_lines_bad_encoding(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT, encoding="utf-16")
+    with pytest.raises(ValueError, match="not ASCII-compatible"):
+        parallel_map_lines(p, shout, workers=2, encoding="utf-16")
+    assert pylistdir(tmp_path) == ["file.txt"]
+    assert p.read_text(encoding="utf-16") == TEXT
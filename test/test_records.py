@@ -0,0 +1,88 @@
+from __future__ import annotations
+import io
+from pathlib import Path
+import struct
+import pytest
+from in_place import edit_records
+from test_in_place_util import pylistdir
+
+RECORDS = [(i, i * 10 - 500) for i in range(100)]
+
+
+def pack(records: list[tuple[int, int]]) -> bytes:
+    return b"".join(struct.pack("<iq", a, b) for a, b in records)
+
+
+def test_edit_records_memoryview(tmp_path: Path) -> None:
+    p = tmp_path / "data.bin"
+    p.write_bytes(pack(RECORDS))
+    with edit_records(p, 12, backup_ext="~") as (inp, out):
+        assert inp.readonly
+        assert not out.readonly
+        assert len(inp) == len(out) == 1200
+        assert bytes(out) == bytes(inp)
+        out[12 * 5 : 12 * 6] = struct.pack("<iq", -1, -1)
+    assert pylistdir(tmp_path) == ["data.bin", "data.bin~"]
+    expected = list(RECORDS)
+    expected[5] = (-1, -1)
+    assert p.read_bytes() == pack(expected)
+    assert (tmp_path / "data.bin~").read_bytes() == pack(RECORDS)
+
+
+def test_edit_records_numpy(tmp_path: Path) -> None:
+    np = pytest.importorskip("numpy")
+    p = tmp_path / "data.bin"
+    p.write_bytes(pack(RECORDS))
+    dtype = np.dtype([("x", "<i4"), ("y", "<i8")])
+    with edit_records(p, dtype) as (inp, out):
+        assert not inp.flags.writeable
+        assert out.shape == inp.shape == (100,)
+        out["x"][inp["y"] > 0] += 1000
+    assert p.read_bytes() == pack([(a + 1000 if b > 0 else a, b) for a, b in RECORDS])
+
+
+def test_edit_records_empty(tmp_path: Path) -> None:
+    p = tmp_path / "data.bin"
+    p.touch()
+    with edit_records(p, 12) as (inp, out):
+        assert len(inp) == len(out) == 0
+    assert p.read_bytes() == b""
+
+
+def test_edit_records_bad_size(tmp_path: Path) -> None:
+    p = tmp_path / "data.bin"
+    p.write_bytes(pack(RECORDS) + b"x")
+    with pytest.raises(ValueError, match="not a multiple of the record size"):
+        with edit_records(p, 12):
+            pass  # pragma: no cover
+    assert pylistdir(tmp_path) == ["data.bin"]
+    assert p.read_bytes() == pack(RECORDS) + b"x"
+
+
+def test_edit_records_error(tmp_path: Path) -> None:
+    p = tmp_path / "data.bin"
+    p.write_bytes(pack(RECORDS))
+    with pytest.raises(RuntimeError):
+        with edit_records(p, 12) as (_, out):
+            out[:12] = bytes(12)
+            raise RuntimeError("Nope")
+    assert pylistdir(tmp_path) == ["data.bin"]
+    assert p.read_bytes() == pack(RECORDS)
+
+
+def test_edit_records_tee(tmp_path: Path) -> None:
+    p = tmp_path / "data.bin"
+    p.write_bytes(pack(RECORDS))
+    buf = io.BytesIO()
+    with edit_records(p, 12, tee=[buf]) as (_, out):
+        out[:12] = bytes(12)
+    assert p.read_bytes()[:12] == bytes(12)
+    assert buf.getvalue() == p.read_bytes()
+
+
+def test_edit_records_bad_record_size(tmp_path: Path) -> None:
+    p = tmp_path / "data.bin"
+    p.write_bytes(b"")
+    with pytest.raises(ValueError, match="Record size must be positive"):
+        with edit_records(p, 0):
+            pass  # pragma: no cover
@@ -0,0 +1,163 @@
+from __future__ import annotations
+import json
+from pathlib import Path
+import pytest
+import in_place
+from in_place import InPlace
+from test_in_place_util import pylistdir
+
+LINES = [f"line {i}\n" for i in range(1000)]
+
+
+class Interrupted(Exception):
+    pass
+
+
+def run(p: Path, fail_at: int | None = None, mode: str = "t") -> InPlace:
+    """
+    Uppercase ``p`` line by line with a running count of lines in the
+    checkpoint state, checkpointing every 100 lines and raising `Interrupted`
+    on line ``fail_at``
+    """
+    fp: InPlace = InPlace(p, mode, resume=True)  # type: ignore[call-overload]
+    with fp:
+        count = fp.resume_state or 0
+        for line in fp:
+            if count == fail_at:
+                raise Interrupted()
+            fp.write(line.upper())
+            count += 1
+            if count % 100 == 0:
+                fp.checkpoint(count)
+        assert count == 1000
+    return fp
+
+
+def test_resume_text(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text("".join(LINES))
+    with pytest.raises(Interrupted):
+        run(p, fail_at=250)
+    assert pylistdir(tmp_path) == [
+        "._in_place-resume-file.txt",
+        "._in_place-resume-file.txt.json",
+        "file.txt",
+    ]
+    assert p.read_text() == "".join(LINES)
+    ckpt = json.loads((tmp_path / "._in_place-resume-file.txt.json").read_text())
+    assert ckpt["state"] == 200
+    fp = run(p)
+    assert fp.resumed
+    assert fp.resume_state == 200
+    assert pylistdir(tmp_path) == ["file.txt"]
+    assert p.read_text() == "".join(LINES).upper()
+
+
+def test_resume_binary(tmp_path: Path) -> None:
+    p = tmp_path / "file.bin"
+    p.write_bytes("".join(LINES).encode())
+    with pytest.raises(Interrupted):
+        run(p, fail_at=999, mode="b")
+    with pytest.raises(Interrupted):
+        run(p, fail_at=999, mode="b")
+    fp = run(p, mode="b")
+    assert fp.resumed
+    assert fp.resume_state == 900
+    assert pylistdir(tmp_path) == ["file.bin"]
+    assert p.read_bytes() == "".join(LINES).upper().encode()
+
+
+def test_resume_open_error(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text("".join(LINES))
+    with pytest.raises(Interrupted):
+        run(p, fail_at=250)
+
+    def fail(*_args: object) -> None:
+        raise OSError("copystats failed")
+
+    with monkeypatch.context() as m:
+        m.setattr(in_place, "copystats", fail)
+        with pytest.raises(OSError, match="copystats failed"):
+            InPlace(p, resume=True)
+    # The progress saved by the checkpoint is kept:
+    assert pylistdir(tmp_path) == [
+        "._in_place-resume-file.txt",
+        "._in_place-resume-file.txt.json",
+        "file.txt",
+    ]
+    fp = run(p)
+    assert fp.resumed
+    assert fp.resume_state == 200
+    assert p.read_text() == "".join(LINES).upper()
+
+
+def test_resume_no_checkpoint(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text("".join(LINES))
+    with pytest.raises(Interrupted):
+        run(p, fail_at=50)
+    assert pylistdir(tmp_path) == ["file.txt"]
+    fp = run(p)
+    assert not fp.resumed
+    assert fp.resume_state is None
+    assert p.read_text() == "".join(LINES).upper()
+
+
+def test_resume_file_changed(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text("".join(LINES))
+    with pytest.raises(Interrupted):
+        run(p, fail_at=250)
+    p.write_text("".join(LINES[:500]) + "changed\n" + "".join(LINES[501:]))
+    fp = run(p)
+    assert not fp.resumed
+    assert pylistdir(tmp_path) == ["file.txt"]
+    assert (
+        p.read_text()
+        == ("".join(LINES[:500]) + "CHANGED\n" + "".join(LINES[501:])).upper()
+    )
+
+
+def test_resume_rollback(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text("".join(LINES))
+    with InPlace(p, resume=True) as fp:
+        fp.write(fp.readline().upper())
+        fp.checkpoint()
+        fp.rollback()
+    assert pylistdir(tmp_path) == ["file.txt"]
+    assert p.read_text() == "".join(LINES)
+
+
+def test_resume_output_truncated(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text("".join(LINES))
+    with pytest.raises(Interrupted):
+        with InPlace(p, resume=True) as fp:
+            fp.write(fp.readline().upper())
+            fp.checkpoint("one")
+            fp.write("junk\n")
+            raise Interrupted()
+    with InPlace(p, resume=True) as fp:
+        assert fp.resumed
+        assert fp.resume_state == "one"
+        for line in fp:
+            fp.write(line)
+    assert p.read_text() == LINES[0].upper() + "".join(LINES[1:])
+
+
+def test_checkpoint_not_resumable(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text("foo\n")
+    with InPlace(p) as fp:
+        with pytest.raises(ValueError, match="checkpoint\\(\\) requires resume=True"):
+            fp.checkpoint()
+
+
+def test_resume_dry_run(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text("foo\n")
+    with pytest.raises(ValueError, match="mutually exclusive"):
+        InPlace(p, resume=True, dry_run=True)
+    assert pylistdir(tmp_path) == ["file.txt"]
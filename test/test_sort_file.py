@@ -0,0 +1,89 @@
+from __future__ import annotations
+from pathlib import Path
+import random
+import pytest
+import in_place
+from in_place import sort_file
+from test_in_place_util import TEXT, pylistdir
+
+
+def second_field(line: str) -> str:
+    return line.split(",")[1]
+
+
+def test_sort_file_in_memory(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT)
+    sort_file(p)
+    assert pylistdir(tmp_path) == ["file.txt"]
+    assert p.read_text() == "".join(sorted(TEXT.splitlines(keepends=True)))
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_sort_file_external(tmp_path: Path, workers: int) -> None:
+    rng = random.Random(42)
+    lines = [f"{rng.randrange(1000)},{i}\n" for i in range(5000)]
+    p = tmp_path / "file.txt"
+    p.write_text("".join(lines))
+    sort_file(p, key=second_field, memory_limit=4096, workers=workers)
+    assert pylistdir(tmp_path) == ["file.txt"]
+    assert p.read_text() == "".join(sorted(lines, key=second_field))
+
+
+def test_sort_file_multipass_merge(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+) -> None:
+    monkeypatch.setattr(in_place, "SORT_MERGE_WIDTH", 3)
+    rng = random.Random(0)
+    lines = [f"{rng.randrange(50)}\n".encode() for _ in range(2000)]
+    p = tmp_path / "file.txt"
+    p.write_bytes(b"".join(lines))
+    sort_file(p, mode="b", key=int, reverse=True, memory_limit=1024, backup_ext="~")
+    assert pylistdir(tmp_path) == ["file.txt", "file.txt~"]
+    assert p.read_bytes() == b"".join(sorted(lines, key=int, reverse=True))
+    assert (tmp_path / "file.txt~").read_bytes() == b"".join(lines)
+
+
+def test_sort_file_no_final_newline(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text("b\nc\na")
+    sort_file(p, memory_limit=1)
+    assert p.read_text() == "a\nb\nc\n"
+
+
+def test_sort_file_surrogates(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_bytes(b"\xff\n\xfe\nz\n")
+    sort_file(p, memory_limit=1, encoding="utf-8", errors="surrogateescape")
+    assert p.read_bytes() == b"z\n\xfe\n\xff\n"
+
+
+def test_sort_file_empty(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text("")
+    sort_file(p)
+    assert p.read_text() == ""
+
+
+def test_sort_file_error(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text("1\n2\nx\n3\n")
+    with pytest.raises(ValueError):
+        sort_file(p, key=int, memory_limit=1)
+    assert pylistdir(tmp_path) == ["file.txt"]
+    assert p.read_text() == "1\n2\nx\n3\n"
+
+
+@pytest.mark.parametrize(
+    "kwargs,msg",
+    [
+        ({"memory_limit": 0}, "memory_limit must be positive"),
+        ({"workers": 0}, "workers must be positive"),
+    ],
+)
+def test_sort_file_invalid(tmp_path: Path, kwargs: dict, msg: str) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT)
+    with pytest.raises(ValueError, match=msg):
+        sort_file(p, **kwargs)
+    assert p.read_text() == TEXT
@@ -0,0 +1,93 @@
+from __future__ import annotations
+import hashlib
+import os
+from pathlib import Path
+import pytest
+from in_place import InPlace, apply_delta
+
+BLOCK = 1 << 16
+
+
+def make_sparse(p: Path) -> bytes:
+    """
+    Create a file consisting of some data, a 1 MiB hole, more data, and a
+    trailing 1 MiB hole, and return its contents
+    """
+    with p.open("wb") as fp:
+        fp.write(b"head\n" * 1000)
+        fp.seek(1 << 20, os.SEEK_CUR)
+        fp.write(b"tail\n" * 1000)
+        fp.truncate(fp.tell() + (1 << 20))
+    if p.stat().st_blocks * 512 >= p.stat().st_size:
+        pytest.skip("Filesystem does not support sparse files")
+    return p.read_bytes()
+
+
+def allocated(p: Path) -> int:
+    return p.stat().st_blocks * 512
+
+
+def test_sparse_copy_lines(tmp_path: Path) -> None:
+    p = tmp_path / "file.bin"
+    data = make_sparse(p)
+    with InPlace(p, "b", sparse=True) as fp:
+        fp.write(fp.readline().upper())
+        fp.copy_lines()
+    assert p.read_bytes() == b"HEAD\n" + data[5:]
+    assert allocated(p) < (1 << 20)
+
+
+def test_sparse_write_zeros(tmp_path: Path) -> None:
+    p = tmp_path / "file.bin"
+    make_sparse(p)
+    with InPlace(p, "b", sparse=True) as fp:
+        for line in fp:
+            fp.write(line)
+    assert p.stat().st_size == 5000 + (1 << 20) + 5000 + (1 << 20)
+    assert allocated(p) < (1 << 20)
+
+
+def test_sparse_unaligned_write(tmp_path: Path) -> None:
+    p = tmp_path / "file.bin"
+    p.write_bytes(b"")
+    data = b"x" * 3 + bytes(BLOCK * 4 + 7) + b"y" * 5
+    with InPlace(p, "b", sparse=True, buffering=0) as fp:
+        fp.write(data[:100])
+        fp.write(data[100:])
+    assert p.read_bytes() == data
+
+
+def test_sparse_trailing_zeros(tmp_path: Path) -> None:
+    p = tmp_path / "file.bin"
+    p.write_bytes(b"abc")
+    with InPlace(p, "b", sparse=True) as fp:
+        fp.write(fp.read())
+        fp.write(bytes(1 << 20))
+    assert p.read_bytes() == b"abc" + bytes(1 << 20)
+
+
+def test_sparse_checksum(tmp_path: Path) -> None:
+    p = tmp_path / "file.bin"
+    data = make_sparse(p)
+    with InPlace(p, "b", sparse=True, checksum="sha256") as fp:
+        fp.copy_lines(3)
+        fp.write(b"X")
+        fp.copy_lines()
+    assert p.read_bytes() == data[:15] + b"X" + data[15:]
+    assert fp.output_digest == hashlib.sha256(p.read_bytes()).hexdigest()
+
+
+def test_sparse_delta(tmp_path: Path) -> None:
+    p = tmp_path / "file.bin"
+    data = make_sparse(p)
+    apply_delta(p, [("insert", b"new\n"), ("copy", 0, len(data))], sparse=True)
+    assert p.read_bytes() == b"new\n" + data
+    assert allocated(p) < (1 << 20)
+
+
+def test_sparse_text_mode(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text("foo\n")
+    with pytest.raises(ValueError, match="sparse is only supported in binary mode"):
+        InPlace(p, sparse=True)
+    assert p.read_text() == "foo\n"
@@ -0,0 +1,96 @@
+from __future__ import annotations
+import json
+from pathlib import Path
+import pytest
+from in_place import edit_json, edit_toml
+from test_in_place_util import pylistdir
+
+DOC = {"name": "in_place", "version": "1.0.0", "deps": ["foo", "bar"]}
+
+
+def test_edit_json(tmp_path: Path) -> None:
+    p = tmp_path / "data.json"
+    p.write_text(json.dumps(DOC, indent=4) + "\n")
+    with edit_json(p, backup_ext="~", indent=2) as doc:
+        assert doc == DOC
+        files = pylistdir(tmp_path)
+        assert len(files) == 2
+        assert files[0].startswith("._in_place-")
+        doc["version"] = "1.1.0"
+        doc["deps"].append("åéîøü")
+    assert pylistdir(tmp_path) == ["data.json", "data.json~"]
+    assert (tmp_path / "data.json~").read_text() == json.dumps(DOC, indent=4) + "\n"
+    assert p.read_text(encoding="utf-8") == (
+        "{\n"
+        '  "name": "in_place",\n'
+        '  "version": "1.1.0",\n'
+        '  "deps": [\n'
+        '    "foo",\n'
+        '    "bar",\n'
+        '    "åéîøü"\n'
+        "  ]\n"
+        "}\n"
+    )
+
+
+def test_edit_json_compact(tmp_path: Path) -> None:
+    p = tmp_path / "data.json"
+    p.write_text('{"b": 1, "a": [1, 2]}')
+    with edit_json(p, sort_keys=True) as doc:
+        doc["c"] = None
+    assert p.read_text() == '{"a":[1,2],"b":1,"c":null}'
+
+
+def test_edit_json_unchanged(tmp_path: Path) -> None:
+    p = tmp_path / "data.json"
+    p.write_text(json.dumps(DOC, indent=4))
+    st = p.stat()
+    with edit_json(p, backup_ext="~") as doc:
+        doc["deps"].append("baz")
+        doc["deps"].pop()
+    assert pylistdir(tmp_path) == ["data.json"]
+    assert p.read_text() == json.dumps(DOC, indent=4)
+    assert p.stat().st_ino == st.st_ino
+
+
+def test_edit_json_error(tmp_path: Path) -> None:
+    p = tmp_path / "data.json"
+    p.write_text(json.dumps(DOC))
+    with pytest.raises(RuntimeError):
+        with edit_json(p) as doc:
+            doc["version"] = "2.0.0"
+            raise RuntimeError("I changed my mind.")
+    assert pylistdir(tmp_path) == ["data.json"]
+    assert p.read_text() == json.dumps(DOC)
+
+
+def test_edit_json_invalid(tmp_path: Path) -> None:
+    p = tmp_path / "data.json"
+    p.write_text("{")
+    with pytest.raises(ValueError):
+        with edit_json(p):
+            pass
+    assert pylistdir(tmp_path) == ["data.json"]
+    assert p.read_text() == "{"
+
+
+def test_edit_toml(tmp_path: Path) -> None:
+    pytest.importorskip("tomli_w")
+    p = tmp_path / "pyproject.toml"
+    p.write_text('[project]\nname = "in_place"\nversion = "1.0.0"\n')
+    with edit_toml(p, backup=tmp_path / "backup.toml") as doc:
+        assert doc == {"project": {"name": "in_place", "version": "1.0.0"}}
+        doc["project"]["version"] = "1.1.0"
+    assert pylistdir(tmp_path) == ["backup.toml", "pyproject.toml"]
+    assert p.read_text() == '[project]\nname = "in_place"\nversion = "1.1.0"\n'
+
+
+def test_edit_toml_unchanged(tmp_path: Path) -> None:
+    pytest.importorskip("tomli_w")
+    p = tmp_path / "pyproject.toml"
+    src = '[project]\nname    =   "in_place"  # comment\n'
+    p.write_text(src)
+    with edit_toml(p, backup_ext="~") as doc:
+        assert doc["project"]["name"] == "in_place"
+    assert pylistdir(tmp_path) == ["pyproject.toml"]
+    assert p.read_text() == src
@@ -0,0 +1,175 @@
+from __future__ import annotations
+import gzip
+import io
+from pathlib import Path
+import threading
+import pytest
+import in_place
+from in_place import InPlace, Transaction, apply_delta
+from test_in_place_util import TEXT, pylistdir
+
+
+class Sink:
+    def __init__(self) -> None:
+        self.chunks: list[bytes] = []
+        self.events: list[str] = []
+
+    def write(self, data: bytes) -> int:
+        self.chunks.append(data)
+        return len(data)
+
+    def flush(self) -> None:
+        self.events.append("flush")
+
+    def commit(self) -> None:
+        self.events.append("commit")
+
+    def rollback(self) -> None:
+        self.events.append("rollback")
+
+    @property
+    def data(self) -> bytes:
+        return b"".join(self.chunks)
+
+
+def test_tee_text(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT, encoding="utf-8")
+    sink = Sink()
+    chunks: list[bytes] = []
+    with InPlace(p, encoding="utf-8", tee=[sink, chunks.append]) as fp:
+        for line in fp:
+            fp.write(line.swapcase() + "ü")
+    assert pylistdir(tmp_path) == ["file.txt"]
+    assert sink.data == p.read_bytes()
+    assert b"".join(chunks) == p.read_bytes()
+    assert sink.events == ["flush", "commit"]
+
+
+def test_tee_copy_lines(tmp_path: Path) -> None:
+    p = tmp_path / "file.bin"
+    p.write_bytes(b"".join(b"line %d\n" % i for i in range(10000)))
+    sink = Sink()
+    with InPlace(p, "b", tee=[sink], checksum="sha256") as fp:
+        fp.replace_lines(10, 20, [b"replaced\n"])
+        fp.copy_lines(5000)
+        fp.write(fp.readline().upper())
+        fp.copy_lines()
+    assert sink.data == p.read_bytes()
+
+
+def test_tee_delta(tmp_path: Path) -> None:
+    p = tmp_path / "file.bin"
+    p.write_bytes(b"0123456789")
+    buf = io.BytesIO()
+    apply_delta(p, [("copy", 5, 5), ("insert", b"-"), ("copy", 0, 5)], tee=[buf])
+    assert p.read_bytes() == b"56789-01234"
+    assert buf.getvalue() == b"56789-01234"
+
+
+def test_tee_gzip(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT)
+    with gzip.open(tmp_path / "archive.gz", "wb") as gz:
+        with InPlace(p, tee=[gz]) as fp:
+            fp.write(fp.read().upper())
+    with gzip.open(tmp_path / "archive.gz", "rb") as gz:
+        assert gz.read() == TEXT.upper().encode()
+
+
+def test_tee_rollback(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT)
+    sink = Sink()
+    with InPlace(p, tee=[sink]) as fp:
+        fp.write("foo\n")
+        fp.rollback()
+    assert sink.events == ["flush", "rollback"]
+    assert p.read_text() == TEXT
+
+
+def test_tee_dry_run(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT)
+    sink = Sink()
+    with InPlace(p, tee=[sink], dry_run=True) as fp:
+        fp.write(fp.read().upper())
+    assert sink.data == TEXT.upper().encode()
+    assert sink.events == ["flush", "rollback"]
+    assert p.read_text() == TEXT
+
+
+def test_tee_sink_error(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT)
+    sink = Sink()
+
+    def broken(_: bytes) -> None:
+        raise RuntimeError("Sink failed")
+
+    with pytest.raises(RuntimeError, match="Sink failed"):
+        with InPlace(p, tee=[sink, broken]) as fp:
+            fp.write(fp.read().upper())
+    assert sink.events == ["flush", "rollback"]
+    assert pylistdir(tmp_path) == ["file.txt"]
+    assert p.read_text() == TEXT
+
+
+def test_tee_backpressure(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(in_place, "TEE_QUEUE_SIZE", 1)
+    p = tmp_path / "file.bin"
+    p.write_bytes(b"")
+    entered = threading.Event()
+    gate = threading.Event()
+    received: list[bytes] = []
+
+    def slow(data: bytes) -> None:
+        entered.set()
+        gate.wait()
+        received.append(data)
+
+    with InPlace(p, "b", tee=[slow], buffering=0) as fp:
+        fp.write(b"0\n")
+        entered.wait()
+        fp.write(b"1\n")
+        # One chunk is being written, and one is queued, so the next write
+        # blocks until the sink catches up:
+        t = threading.Thread(target=fp.write, args=(b"2\n",))
+        t.start()
+        t.join(0.1)
+        assert t.is_alive()
+        assert received == []
+        gate.set()
+        t.join()
+        for i in range(3, 100):
+            fp.write(b"%d\n" % i)
+    assert b"".join(received) == p.read_bytes()
+
+
+def test_tee_transaction(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT)
+    q = tmp_path / "other.txt"
+    q.write_text("other\n")
+    sp, sq = Sink(), Sink()
+    with Transaction() as txn:
+        with txn.open(p, tee=[sp]) as fp:
+            fp.write(fp.read().upper())
+        with txn.open(q, tee=[sq]) as fq:
+            fq.write("OTHER\n")
+        assert sp.events == sq.events == []
+    assert sp.data == TEXT.upper().encode()
+    assert sq.data == b"OTHER\n"
+    assert sp.events == sq.events == ["flush", "commit"]
+
+
+def test_tee_transaction_rollback(tmp_path: Path) -> None:
+    p = tmp_path / "file.txt"
+    p.write_text(TEXT)
+    sink = Sink()
+    with Transaction() as txn:
+        with txn.open(p, tee=[sink]) as fp:
+            fp.write(fp.read().upper())
+        txn.rollback()
+    assert sink.events == ["flush", "rollback"]
+    assert p.read_text() == TEXT
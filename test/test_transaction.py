@@ -0,0 +1,177 @@
+from __future__ import annotations
+import errno
+import os
+from pathlib import Path
+from typing import Any
+import pytest
+from in_place import Transaction
+from test_in_place_util import TEXT, pylistdir
+
+
+def setup_files(tmp_path: Path, n: int = 3) -> list[Path]:
+    paths = []
+    for i in range(n):
+        p = tmp_path / f"file{i}.txt"
+        p.write_text(f"{i}\n{TEXT}")
+        paths.append(p)
+    return paths
+
+
+def test_transaction_commit(tmp_path: Path) -> None:
+    paths = setup_files(tmp_path)
+    with Transaction() as txn:
+        for p in paths:
+            with txn.open(p, backup_ext="~") as fp:
+                for line in fp:
+                    fp.write(line.swapcase())
+            assert fp.closed
+            assert p.read_text() == p.name[4] + "\n" + TEXT
+        assert len(pylistdir(tmp_path)) == 6
+    assert txn.closed
+    assert pylistdir(tmp_path) == [  # type: ignore[unreachable]
+        "file0.txt",
+        "file0.txt~",
+        "file1.txt",
+        "file1.txt~",
+        "file2.txt",
+        "file2.txt~",
+    ]
+    for i, p in enumerate(paths):
+        assert p.read_text() == f"{i}\n{TEXT.swapcase()}"
+        assert (tmp_path / f"file{i}.txt~").read_text() == f"{i}\n{TEXT}"
+
+
+def test_transaction_commit_unclosed(tmp_path: Path) -> None:
+    paths = setup_files(tmp_path)
+    txn = Transaction(fsync=True)
+    fps = [txn.open(p, "b") for p in paths]
+    for fp in fps:
+        fp.write(fp.read().upper())
+    txn.commit()
+    assert all(fp.closed for fp in fps)
+    assert pylistdir(tmp_path) == ["file0.txt", "file1.txt", "file2.txt"]
+    for i, p in enumerate(paths):
+        assert p.read_text() == f"{i}\n{TEXT.upper()}"
+    with pytest.raises(ValueError):
+        txn.commit()
+    with pytest.raises(ValueError):
+        txn.open(paths[0])
+
+
+def test_transaction_error(tmp_path: Path) -> None:
+    paths = setup_files(tmp_path)
+    with pytest.raises(RuntimeError):
+        with Transaction() as txn:
+            for p in paths:
+                fp = txn.open(p, backup_ext="~")
+                fp.write(fp.read().swapcase())
+                fp.close()
+            raise RuntimeError("I changed my mind.")
+    assert pylistdir(tmp_path) == ["file0.txt", "file1.txt", "file2.txt"]
+    for i, p in enumerate(paths):
+        assert p.read_text() == f"{i}\n{TEXT}"
+
+
+def test_transaction_member_rollback(tmp_path: Path) -> None:
+    paths = setup_files(tmp_path)
+    with Transaction() as txn:
+        for p in paths:
+            with txn.open(p) as fp:
+                fp.write(fp.read().swapcase())
+                if p.name == "file1.txt":
+                    fp.rollback()
+    assert pylistdir(tmp_path) == ["file0.txt", "file1.txt", "file2.txt"]
+    assert paths[0].read_text() == f"0\n{TEXT.swapcase()}"
+    assert paths[1].read_text() == f"1\n{TEXT}"
+    assert paths[2].read_text() == f"2\n{TEXT.swapcase()}"
+
+
+def test_transaction_bad_backup(tmp_path: Path) -> None:
+    paths = setup_files(tmp_path)
+    with pytest.raises(OSError):
+        with Transaction() as txn:
+            for p in paths:
+                with txn.open(p, backup=tmp_path / "nonexistent" / p.name) as fp:
+                    fp.write(fp.read().swapcase())
+    assert pylistdir(tmp_path) == ["file0.txt", "file1.txt", "file2.txt"]
+    for i, p in enumerate(paths):
+        assert p.read_text() == f"{i}\n{TEXT}"
+
+
+@pytest.mark.parametrize("links", [True, False])
+@pytest.mark.parametrize("backup", [True, False])
+def test_transaction_replace_failure(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path, links: bool, backup: bool
+) -> None:
+    paths = setup_files(tmp_path)
+    real_replace = os.replace
+    failed = False
+
+    def replace(src: Any, dst: Any) -> None:
+        nonlocal failed
+        if os.fspath(dst) == str(paths[2]) and not failed:
+            if "._in_place-" in os.fspath(src):
+                failed = True
+                raise OSError(errno.EIO, "Simulated failure")
+        real_replace(src, dst)
+
+    def link(_src: Any, _dst: Any) -> None:
+        raise OSError(errno.EPERM, "Hard links not supported")
+
+    with Transaction() as txn:
+        for p in paths:
+            with txn.open(p, backup_ext="~" if backup else None) as fp:
+                fp.write(fp.read().swapcase())
+        monkeypatch.setattr(os, "replace", replace)
+        if not links:
+            monkeypatch.setattr(os, "link", link)
+        with pytest.raises(OSError, match="Simulated failure"):
+            txn.commit()
+    monkeypatch.undo()
+    assert pylistdir(tmp_path) == ["file0.txt", "file1.txt", "file2.txt"]
+    for i, p in enumerate(paths):
+        assert p.read_text() == f"{i}\n{TEXT}"
+
+
+@pytest.mark.parametrize("links", [True, False])
+def test_transaction_replace_failure_keeps_backups(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path, links: bool
+) -> None:
+    paths = setup_files(tmp_path)
+    for i, p in enumerate(paths):
+        (tmp_path / f"{p.name}.bak").write_text(f"old backup {i}\n")
+    real_replace = os.replace
+    failed = False
+
+    def replace(src: Any, dst: Any) -> None:
+        nonlocal failed
+        if os.fspath(dst) == str(paths[1]) and not failed:
+            if "._in_place-" in os.fspath(src):
+                failed = True
+                raise OSError(errno.EIO, "Simulated failure")
+        real_replace(src, dst)
+
+    def link(_src: Any, _dst: Any) -> None:
+        raise OSError(errno.EPERM, "Hard links not supported")
+
+    with Transaction() as txn:
+        for p in paths:
+            with txn.open(p, backup=tmp_path / f"{p.name}.bak") as fp:
+                fp.write(fp.read().swapcase())
+        monkeypatch.setattr(os, "replace", replace)
+        if not links:
+            monkeypatch.setattr(os, "link", link)
+        with pytest.raises(OSError, match="Simulated failure"):
+            txn.commit()
+    monkeypatch.undo()
+    assert pylistdir(tmp_path) == [
+        "file0.txt",
+        "file0.txt.bak",
+        "file1.txt",
+        "file1.txt.bak",
+        "file2.txt",
+        "file2.txt.bak",
+    ]
+    for i, p in enumerate(paths):
+        assert p.read_text() == f"{i}\n{TEXT}"
+        assert (tmp_path / f"{p.name}.bak").read_text() == f"old backup {i}\n"